@@ -1,93 +1,93 @@
 import os
 import argparse
 
-# for beta in [3.4,3.6]:
-#     dir_path = f"{beta}_s{s}t{}
-    
-DIRECTORIES =  { 
-"meson":             "/p/scratch/exotichadrons/su3-distillation/meson_sdb/",
-"peram":             "/p/scratch/exotichadrons/exolaunch/perams_sdb/numvec64/",
-}
-
-SDB_PATTERNS = {
-    "meson": "meson-{}_cfg{}.sdb",
-    "peram": "peram_{}_cfg{}.sdb",
-}
-
-H5_PATTERNS = {
-    "meson": "meson-{}_cfg{}.h5",
-    "peram": "peram_{}_cfg{}.h5",
-}
-nvecs = [96]
-
-CFG_RANGE = range(11, 2000, 10)
-
-def check_files(file_type):
-    missing_sdb = []
-    missing_h5 = []
-    nvecs = [96]
-
-    for nvec in nvecs:
-        if file_type in DIRECTORIES:
-            directory = DIRECTORIES[file_type].format(nvec)
-            sdb_pattern = SDB_PATTERNS[file_type]
-            h5_pattern = H5_PATTERNS[file_type]
-
-            for cfg in CFG_RANGE:
-                sdb_file = sdb_pattern.format(nvec, cfg)
-                h5_file = h5_pattern.format(nvec, cfg)
-
-                sdb_path = os.path.join(directory, sdb_file)
-                h5_path = os.path.join(directory, h5_file)
-
-                sdb_exists = os.path.isfile(sdb_path)
-                h5_exists = os.path.isfile(h5_path)
-
-                if not sdb_exists:
-                    missing_sdb.append(sdb_path)
-                if not h5_exists:
-                    missing_h5.append(h5_path)
+from scripts import completeness, verify_outputs
+
+TYPES = list(completeness.OUTPUTS)
+
+
+def find_yaml_files(args):
+    if args.ini_dir:
+        return sorted(
+            os.path.join(root, file)
+            for root, _, files in os.walk(args.ini_dir)
+            for file in files
+            if file.endswith('.yml') or file.endswith('.yaml')
+        )
+    return [args.ini]
+
+
+def check_files(dataMap, types_to_check, nvecs=None, exts=None, jobs=8):
+    """Print the missing cfgs of every (type, nvec, ext) as compressed ranges; return the number missing."""
+    missing = completeness.find_missing(dataMap, types_to_check, nvecs=nvecs, exts=exts, jobs=jobs)
+    n_cfgs = len(completeness.cfg_grid(dataMap))
+    total = 0
+    for (file_type, nvec, ext), cfgs in missing.items():
+        label = f"{file_type} nvec {nvec} {ext}"
+        if cfgs:
+            print(f"  {label}: {len(cfgs)}/{n_cfgs} missing in {completeness.output_dir(dataMap, file_type)}")
+            print(f"    cfg {completeness.compress_ranges(cfgs, dataMap['cfg_d'])}")
         else:
-            print(f"Unknown file type: {file_type}")
-            return
+            print(f"  {label}: all {n_cfgs} present")
+        total += len(cfgs)
+    return total
+
+
+def verify_files(dataMap, types_to_check, args):
+    """Print the status counts of every (type, nvec, ext) and the cfgs of the bad files; return the number not ok."""
+    report = verify_outputs.verify_ensemble(
+        dataMap, types_to_check, nvecs=args.nvecs, exts=args.ext, jobs=args.jobs, tolerance=args.tolerance,
+        bytes_per_complex=args.bytes_per_complex, magic=None if args.skip_magic else verify_outputs.SUPERBBLAS_MAGIC)
+    total = 0
+    for (file_type, nvec, ext), entry in report.items():
+        counts = ', '.join(f"{len(entry[status])} {status}" for status in verify_outputs.STATUSES)
+        print(f"  {file_type} nvec {nvec} {ext}: {counts}")
+        for status in verify_outputs.STATUSES[1:]:
+            if entry[status]:
+                print(f"    {status}: cfg {completeness.compress_ranges(entry[status], dataMap['cfg_d'])}")
+                total += len(entry[status])
+        if args.details:
+            for detail in entry.get('details', []):
+                print(f"    {detail}")
+    return total
 
-    return missing_sdb, missing_h5
 
 def main():
     # Argument parser
     parser = argparse.ArgumentParser(description="Check for missing SDB and HDF5 files.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file (cfg_i/cfg_f/cfg_d and data_path are read from it)')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
     parser.add_argument(
-        "-t", "--type", 
-        choices=["meson", "peram", "peram_strange", "all"], 
-        required=True, 
-        help="Specify the type to process: meson, peram, peram_strange, or all."
+        "-t", "--type",
+        nargs='+',
+        choices=TYPES + ["all"],
+        required=True,
+        help=f"Output types to check: {', '.join(TYPES)}, or all."
     )
+    parser.add_argument('--nvecs', nargs='+', type=int, help='nvecs to expect (default: the ones create_tasks_ens.py renders)')
+    parser.add_argument('--ext', nargs='+', choices=['sdb', 'h5'], help='Only check these extensions')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Directories listed / files verified concurrently (default: %(default)s)')
+    parser.add_argument('--verify', action='store_true', help='Check the size and header of every file and classify it as ok, truncated, corrupt or missing')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='With --verify, fraction of the modelled sdb size below which a file is truncated (default: %(default)s)')
+    parser.add_argument('--bytes_per_complex', type=int, help='With --verify, bytes per complex number in the sdb size model (default: 16, or 8 with output_precision: single in the yaml)')
+    parser.add_argument('--skip_magic', action='store_true', help='With --verify, do not check the superbblas storage magic of sdb files')
+    parser.add_argument('--details', action='store_true', help='With --verify, print the reason for every bad file')
     args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
 
-    file_type = args.type
-
-    if file_type == "all":
-        types_to_check = ["meson", "peram", "peram_strange"]
-    else:
-        types_to_check = [file_type]
-
-    for type_to_check in types_to_check:
-        print(f"Processing type: {type_to_check}")
-        missing_sdb, missing_h5 = check_files(type_to_check)
-
-        if missing_sdb:
-            print(f"\nMissing SDB files for {type_to_check}:")
-            for file in missing_sdb:
-                print(file)
-        else:
-            print(f"All SDB files are present for {type_to_check}.")
+    types_to_check = TYPES if "all" in args.type else args.type
 
-        if missing_h5:
-            print(f"\nMissing HDF5 files for {type_to_check}:")
-            for file in missing_h5:
-                print(file)
+    total = 0
+    for yaml_file in find_yaml_files(args):
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        print(f"Processing ensemble: {dataMap['ens_short']}")
+        if args.verify:
+            total += verify_files(dataMap, types_to_check, args)
         else:
-            print(f"All HDF5 files are present for {type_to_check}.")
+            total += check_files(dataMap, types_to_check, nvecs=args.nvecs, exts=args.ext, jobs=args.jobs)
+    if total:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -3,43 +3,9 @@ import argparse
 import jinja2
 import yaml
 from pathlib import Path
-import re
 
-from scripts.yml_to_xml import eigs_xml, perams_xml, meson_xml, chroma_sh_xml, disco_xml
-
-
-def parse_ensemble(short_tag: str) -> dict:
-    long_tag = {
-        "a065m420": "b3.70_ms-0.000_mud-0.020_s32t96-000",
-        "a065m300": "b3.70_ms0.000_mud-0.025_s40t96-000",
-        "a085m420": "b3.57_ms-0.007_mud-0.038_s24t64-000",
-        "a085m300": "b3.57_ms-0.007_mud-0.044_s32t64-000",
-        "a085m200": "b3.57_ms-0.007_mud-0.048_s48t64-000",
-        "a125m400": "b3.30_ms-0.057_mud-0.1200_s16t64-000",
-        "a125m330": "b3.30_ms-0.057_mud-0.1233_s24t64-000",
-        "a125m280": "b3.30_ms-0.057_mud-0.1265_s24t64-000",
-    }
-    if short_tag not in long_tag:
-        raise ValueError(f"Unknown ensemble: {short_tag}")
-
-    key = long_tag[short_tag]
-    p_match = re.search(r"-(\d{3})$", key)
-    P = p_match.group(1) if p_match else "000"
-
-    m = re.match(
-        r"b(?P<beta>[0-9]+\.[0-9]+)_ms(?P<ms>[0-9\.\-]+)_mud-(?P<mud>[0-9\.]+)_s(?P<NL>\d+)t(?P<NT>\d+)-\d+",
-        key
-    )
-    if not m:
-        raise ValueError(f"Failed to parse: {key}")
-
-    info = m.groupdict()
-    info.update({
-        "NL": int(info["NL"]),
-        "NT": int(info["NT"]),
-        "P": P,
-    })
-    return info
+from yml_to_xml import eigs_xml, perams_xml, meson_xml, chroma_sh_xml, disco_xml
+from yml_to_xml.ensembles import parse_ensemble
 
 
 class TaskHandler:
@@ -90,6 +56,7 @@ def process_yaml_file(yaml_file: Path, options, env, handler):
     dataMap['Nt_forward'] = ens_props['NT']
     dataMap['prop_t_fwd'] = ens_props['NT']
     dataMap['meson_t_fwd'] = ens_props['NT']
+    dataMap['meson_t_source'] = dataMap.get('t_start', 0)
     dataMap['NL'] = ens_props['NL']
 
     # 1. SBD directories in data_path
@@ -163,7 +130,8 @@ def process_yaml_file(yaml_file: Path, options, env, handler):
 
             render_data['launch_path'] = str(launch_path)
             render_data['gauge_file'] = str(gauge_file)
-            render_data['momentum_list'] = meson_xml._gen_mom_list()
+            render_data['momentum_list'] = meson_xml._gen_mom_list(
+                dataMap.get('mom2_min', 0), dataMap.get('mom2_max', 3), dataMap.get('meson_mom_reduction', 'none'))
             render_data['displacement_list'] = meson_xml._displacement_list()
 
             try:
@@ -1,342 +1,580 @@
 import argparse
 import os
+import json
+import time
 import jinja2
+import jinja2.meta
 import yaml
-from yml_to_xml import eigs_xml, perams_xml, meson_xml, chroma_sh_xml, disco_xml
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from scripts import fs_plan, manifest, slurm_array, stage_times, walltime, workflow_dag
+from yml_to_xml import ensembles
 import re
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 FDIR = os.path.dirname(os.path.realpath(__file__))
 TEMPLATE = os.path.join(FDIR, 'templates')
+TEMPLATE_CACHE = os.path.join(TEMPLATE, '.jinja_cache')
 RESULTPATH = os.path.join(FDIR, 'res')
 OUTPATH = os.path.join(RESULTPATH, 'out')
 LOGPATH = os.path.join(RESULTPATH, 'log')
+DATA_DIRS = ['eigs_sdb', 'perams_sdb', 'meson_sdb', 'meson2_sdb', 'chroma_out', 'perams_charm_sdb', 'perams_strange_sdb', 'disco_sdb']
 
-def parse_ensemble(short_tag: str) -> Dict[str, Any]:
-    """Parse ensemble short tag to extract parameters.
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.6/B3.6_M-0.013M0.25_L32T64/NS8_LS1_G2
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.6/B3.6_M-0.013M0.25_L40T64/NS8_LS1_G2
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.6/B3.6_M-0.013M0.25_L48T64/NS8_LS1_G2
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.6/B3.6_M-0.013M0.25_L64T64/NS8_LS1_G2
-    for beta=3.4
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.4/B3.4_M-0.040M0.33_L24T64/NS8_LS1_G2/
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.4/B3.4_M-0.040M0.33_L32T64/NS8_LS1_G2/
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.4/B3.4_M-0.040M0.33_L36T64/NS8_LS1_G2/
-    /p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B3.4/B3.4_M-0.040M0.33_L48T64/NS8_LS1_G2/
-    """
-    long_tag = {
-        "a065m420": "b3.70_ms-0.000_mud-0.020_s32t96-000",
-        "a065m300": "b3.70_ms-0.000_mud-0.025_s40t96-000",
-        "a085m420": "b3.57_ms-0.007_mud-0.038_s24t64-000",
-        "a085m300": "b3.57_ms-0.007_mud-0.044_s32t64-000",
-        "a085m200": "b3.57_ms-0.007_mud-0.048_s48t64-000",
-        "a125m400": "b3.30_ms-0.057_mud-0.1200_s16t64-000",
-        "a125m330": "b3.30_ms-0.057_mud-0.1233_s24t64-000",
-        "a125m280": "b3.30_ms-0.057_mud-0.1265_s24t64-000",
-        "b3.6_s32t64": "b3.6_mc0.25_mud-0.013_s32t64",
-        "b3.6_s40t64": "b3.6_mc0.25_mud-0.013_s40t64",
-        "b3.6_s48t64": "b3.6_mc0.25_mud-0.013_s48t64",
-        "b3.6_s64t64": "b3.6_mc0.25_mud-0.013_s64t64",
-        "b3.4_s24t64": "b3.4_mc0.33_mud-0.040_s24t64",
-        "b3.4_s32t64": "b3.4_mc0.33_mud-0.040_s32t64",
-        "b3.4_s36t64": "b3.4_mc0.33_mud-0.040_s36t64",
-        "b3.4_s48t64": "b3.4_mc0.33_mud-0.040_s48t64",
-    }
-    if short_tag not in long_tag:
-        raise ValueError(f"Unknown ensemble short tag: {short_tag}")
-    key = long_tag[short_tag]
-    patterns = [
-        r"b(?P<beta>[0-9]+\.[0-9]+)_ms(?P<ms>-?[0-9]+\.[0-9]+)_mud-(?P<mud>[0-9]+\.[0-9]+)_s(?P<NL>[0-9]+)t(?P<NT>[0-9]+)-(?P<P>[0-9]{3})",
-        r"b(?P<beta>[0-9]+\.[0-9]+)"
-        r"_mc(?P<mc>[0-9]+\.[0-9]{2})"
-        r"_mud-(?P<mud>[0-9]+\.[0-9]{3})"
-        r"_s(?P<NL>[0-9]{2})"
-        r"t(?P<NT>[0-9]{2})",
-    ]
-    type_map = {
-        "beta": str,
-        "ms": str,
-        "mud": str,
-        "mc": str,
-        "NL": int,
-        "NT": int,
-        "P": str,
-    }
-    info = {}
-    for pattern in patterns:
-        match = re.match(pattern, key)
-        if match:
-            groups = match.groupdict()
-            info = {
-                key: type_map[key](val)
-                for key, val in groups.items()
-                if key in type_map and val is not None
-            }
-            break
-    # Derive cfg_path, cfg_name, and run_path
-    # if 'mc' in info:
-    #     info["cfg_path"] = f"/p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B{info['beta']}/B{info['beta']}_M-{info['mud']}M{info['mc']}_L{info['NL']}T{info['NT']}/NS8_LS1_G2"
-    #     info["cfg_name"] = f"test_b{info['beta']}_m{info['mud']}m{info['mc']}_l{info['NL']}t{info['NT']}_nf3p1_cfg_"
-    # else:
-    #     info["cfg_path"] = f"/p/project1/exotichadrons/pederiva/6stout/beta_{info['beta']}/ms_{info['ms']}/mud_-{info['mud']}/s{info['NL']}t{info['NT']}/cnfg/"
-    #     info["cfg_name"] = f"b{info['beta']}_ms{info['ms']}_mud-{info['mud']}_s{info['NL']}t{info['NT']}-{info['P']}-n_cfg_"
-    return info
-
-class ChromaOptions(BaseModel):
-    """Chroma run options for launching jobs."""
-    # Slurm job options
-    code_dir: str
-    account: str
-    num_gpu: int
-    max_moms_per_job: int
-    facility: str
-    eigs_path: str
-    partition: str
-    # Ensemble properties
-    cfg_i: int
-    cfg_f: int
-    cfg_d: int  # cfg step size
-    # Eigs options
-    num_iter: int
-    num_orthog: int
-    eigs_tasks_node: int
-    eigs_slurm_nodes: int
-    eigs_chroma_geometry: List[int]
-    eigs_chroma_minutes: int
-    # Peram options
-    prop_slurm_nodes: int
-    prop_num_gpu: int
-    prop_chroma_geometry: List[int]
-    prop_chroma_minutes: int
-    prop_mass_charm_label: str
-    prop_t_sources: str
-    num_tsrcs: int
-    prop_t_back: int
-    prop_nvec: int
-    prop_zphases: str
-    prop_clov_coeff: float
-    rho: float
-    precision: str
-    max_iter: int
-    # Meson options
-    meson_slurm_nodes: int
-    meson_chroma_max_tslices_in_contraction: int
-    meson_nvec: int
-    meson_chroma_geometry: List[int]
-    meson_chroma_minutes: int
-    meson_chroma_parts: int
-    meson_zphases: str
-    meson_t_back: int
-    # Distillation basis
-    Frequency: int
-    max_nvec: int
-    num_vecs: int
-    num_vecs_perams: int
-    decay_dir: int
-    t_start: int
-    Nt_backward: int
-    num_tries: int
-    max_rhs: int
-    phase: List[int]
-    write_fingerprint: bool
-    LinkSmearingType: str
-    link_smear_fact: float
-    link_smear_num: int
-    no_smear_dir: int
-    gauge_id: str
-    colorvec_out: str
+TEMPLATE_FILES = {
+    'eigs': 'eigs.jinja.xml',
+    'meson': 'meson.jinja.xml',
+    'meson2': 'meson2.jinja.xml',
+    'disco': 'disco.jinja.xml',
+    'peram': 'peram.jinja.xml',
+    'chroma_eigs': 'eigs.sh.j2',
+    'chroma_meson': 'meson.sh.j2',
+    'chroma_meson2': 'meson2.sh.j2',
+    'chroma_peram': 'peram.sh.j2',
+    'chroma_disco': 'disco.sh.j2',
+    'chroma_disco_merge': 'disco_merge.sh.j2',
+    'fused': 'fused.jinja.xml',
+    'chroma_fused': 'fused.sh.j2',
+}
+
+INCLUDE = re.compile(r"""{%-?\s*include\s+['"]([^'"]+)['"]""")
+
+def template_sources(name):
+    """A template file followed by the files it includes, e.g. the measurement elements shared with fused.jinja.xml."""
+    names = [name]
+    for included in names:
+        with open(os.path.join(TEMPLATE, included)) as f:
+            names.extend(n for n in INCLUDE.findall(f.read()) if n not in names)
+    return names
+
+class LazyTemplates(dict):
+    """Template mapping that compiles each template the first time it is looked up."""
+    def __init__(self, env):
+        super().__init__()
+        self.env = env
+
+    def __missing__(self, obj):
+        template = self.env.get_template(TEMPLATE_FILES[obj])
+        self[obj] = template
+        return template
 
 class TaskHandler:
     def __init__(self, env):
-        self.templates = {
-            'eigs': env.get_template('eigs.jinja.xml'),
-            'meson': env.get_template('meson.jinja.xml'),
-            'meson2': env.get_template('meson2.jinja.xml'),
-            'disco': env.get_template('disco.jinja.xml'),
-            'peram': env.get_template('peram.jinja.xml'),
-            'chroma_eigs': env.get_template('eigs.sh.j2'),
-            'chroma_meson': env.get_template('meson.sh.j2'),
-            'chroma_meson2': env.get_template('meson2.sh.j2'),
-            'chroma_peram': env.get_template('peram.sh.j2'),
-            'chroma_disco': env.get_template('disco.sh.j2')
-        }
-        self.xml_classes = {
+        self.env = env
+        self.templates = LazyTemplates(env)
+        self._template_digests = {}
+        self._template_inputs = {}
+
+    @property
+    def xml_classes(self):
+        """Pydantic models of the run objects; imported on demand since pydantic is slow to load."""
+        from yml_to_xml import eigs_xml, perams_xml, meson_xml, disco_xml, task_options
+        return {
             'eigs': eigs_xml.Eigs,
             'meson': meson_xml.Meson,
             'meson2': meson_xml.Meson,
             'disco': disco_xml.Disco,
             'peram': perams_xml.Perams,
-            'chroma_eigs': ChromaOptions,
-            'chroma_meson': ChromaOptions,
-            'chroma_meson2': ChromaOptions,
-            'chroma_peram': ChromaOptions,
-            'chroma_disco': ChromaOptions,
+            'chroma_eigs': task_options.EigsOptions,
+            'chroma_meson': task_options.MesonOptions,
+            'chroma_meson2': task_options.MesonOptions,
+            'chroma_peram': task_options.PeramOptions,
+            'chroma_disco': task_options.DiscoOptions,
+            'chroma_disco_merge': task_options.ChromaOptions,
+            'fused': perams_xml.Perams,
+            'chroma_fused': task_options.FusedOptions,
         }
 
-def process_yaml_file(yaml_file, options, env, handler):
-    """Process a single YAML file to generate XML and shell scripts."""
+    def template_digest(self, obj):
+        """Hash of the template source of a run object and the templates it includes, cached per handler."""
+        if obj not in self._template_digests:
+            digests = [manifest.digest_file(os.path.join(TEMPLATE, name)) for name in template_sources(TEMPLATE_FILES[obj])]
+            self._template_digests[obj] = digests[0] if len(digests) == 1 else manifest.digest_data(digests)
+        return self._template_digests[obj]
+
+    def template_inputs(self, obj):
+        """Names of the variables a template reads, so unrelated YAML keys do not invalidate it.
+
+        Parsing a template is about as expensive as compiling it, so the result is
+        kept in the bytecode cache directory keyed by the template hash.
+        """
+        if obj not in self._template_inputs:
+            digest = self.template_digest(obj)
+            cache_file = os.path.join(TEMPLATE_CACHE, f'inputs-{digest}.json')
+            try:
+                with open(cache_file) as f:
+                    self._template_inputs[obj] = json.load(f)
+            except (OSError, ValueError):
+                names = set()
+                for name in template_sources(TEMPLATE_FILES[obj]):
+                    source = self.env.loader.get_source(self.env, name)[0]
+                    names |= jinja2.meta.find_undeclared_variables(self.env.parse(source))
+                names = sorted(names)
+                self._template_inputs[obj] = names
+                try:
+                    with open(cache_file, 'w') as f:
+                        json.dump(names, f)
+                except OSError:
+                    pass
+        return self._template_inputs[obj]
+
+def load_ensemble(yaml_file, options, times=None):
+    """Load an ensemble YAML and derive its parameters.
+
+    Returns the ensemble short tag, the render parameters and the ordered list of run objects.
+    The time spent reading and deriving is added to ``times`` if given.
+    """
+    times = {} if times is None else times
     ens_short = os.path.splitext(os.path.basename(yaml_file))[0]
     print(f"Processing ensemble: {ens_short}")
-    with open(yaml_file) as f:
-        dataMap = yaml.safe_load(f)
+    with stage_times.timed(times, 'yaml_load'):
+        with open(yaml_file) as f:
+            dataMap = yaml.safe_load(f)
+    parse_start = time.perf_counter()
     try:
-        ens_props = parse_ensemble(ens_short)
+        ens_props = ensembles.parse_ensemble(ens_short)
     except ValueError as e:
         print(f"Error parsing ensemble {ens_short}: {e}")
         raise
-    dataMap.update(ens_props)  # Add derived parameters (beta, ms, mud, cfg_path, cfg_name, run_path, etc.)
+    dataMap.update(ens_props)  # Add the parameters of the long tag (beta, ms or mc, mud, NL, NT, P)
+    for key, value in ensembles.defaults(ens_short).items():
+        dataMap.setdefault(key, value)  # volume, and cfg_path and cfg_name unless the yaml has them
     dataMap['ens_short'] = ens_short
     dataMap['Nt_forward'] = ens_props['NT']
     dataMap['prop_t_fwd'] = ens_props['NT']
     dataMap['meson_t_fwd'] = ens_props['NT']
+    dataMap['meson_t_source'] = dataMap.get('t_start', 0)
     dataMap['NL'] = ens_props['NL']
     dataMap['num_vecs_perams'] = ens_props['NT']
     dataMap['meson_nvec'] = ens_props['NT']
-    additional_dirs = ['eigs_sdb', 'perams_sdb', 'meson_sdb', 'meson2_sdb', 'chroma_out', 'perams_charm_sdb', 'perams_strange_sdb']
-    data_path = dataMap['data_path']
-    try:
-        os.makedirs(data_path, exist_ok=True)
-        print(f"Ensured base data_path exists: {data_path}")
-    except Exception as e:
-        print(f"Error creating data_path {data_path}: {e}")
-        raise
-    for dir_name in additional_dirs:
-        dir_path = os.path.join(data_path, dir_name)
-        try:
-            os.makedirs(dir_path, exist_ok=True)
-            if os.path.exists(dir_path):
-                print(f"Directory exists or was created: {dir_path}")
-            else:
-                print(f"Failed to create directory: {dir_path}")
-        except Exception as e:
-            print(f"Error creating directory {dir_path}: {e}")
-            raise
+    # -geom of every job: checked against its rank count, solved where missing or auto
+    from yml_to_xml import geometry
+    geometry.resolve_all(dataMap)
+    # the disco reducer job runs scripts/merge_disco_shards.py from this checkout on this yaml
+    dataMap['project_dir'] = PROJECT_DIR
+    # node-local directory the eigs are staged to before reading, see scripts/stage_cache.py
+    dataMap.setdefault('stage_dir', None)
+    dataMap['ini_file'] = os.path.abspath(yaml_file)
     run_objects = []
+    peram_jobs = []
     for task in options.list_tasks:
         if task == 'eigs':
             run_objects.extend(['eigs', 'chroma_eigs'])
         elif task.startswith('peram'):
-            # Parse task: peram_mg_light, peram_clover_charm, etc.
-            parts = task.split('_')
-            if len(parts) != 3:
-                raise ValueError(f"Invalid peram task: {task}. Use peram_mg_light, peram_clover_charm, etc.")
-            _, inverter_type, flavor = parts
-            if inverter_type not in ['mg', 'clover']:
-                raise ValueError(f"Invalid inverter: {inverter_type}")
-            flavor = flavor.lower()
-            flavor_config = {
-                'light': {'mass_label': 'light', 'quark_mass': dataMap['prop_mass_light_label'], 'output_sdb_path': f"{data_path}/perams_sdb"},
-                'strange': {'mass_label': 'strange', 'quark_mass': dataMap.get('prop_mass_strange_label'), 'output_sdb_path': f"{data_path}/perams_strange_sdb"},
-                'charm': {'mass_label': 'charm', 'quark_mass': dataMap.get('prop_mass_charm_label'), 'output_sdb_path': f"{data_path}/perams_charm_sdb"},
-            }.get(flavor)
-            if not flavor_config:
-                raise ValueError(f"Invalid flavor: {flavor}")
-            dataMap.update(flavor_config)
-            dataMap.update({
-                'inverter_type': inverter_type,
-                'flavor': flavor,
-            })
+            peram_jobs.append(peram_job(task, dataMap))
             run_objects.extend(['peram', 'chroma_peram'])
         elif task == 'meson':
             run_objects.extend(['meson', 'chroma_meson'])
         elif task == 'meson2':
             run_objects.extend(['meson2', 'chroma_meson2'])
         elif task == 'disco':
+            from yml_to_xml import disco_parts
             run_objects.extend(['disco', 'chroma_disco'])
+            if len(disco_parts.disco_shards(dataMap)) > 1:
+                run_objects.append('chroma_disco_merge')
+        elif task == 'fused':
+            run_objects.extend(['fused', 'chroma_fused'])
 
+    # one peram input and script per entry, rendered in its own launch directory
+    dataMap['peram_jobs'] = peram_jobs
     # Remove duplicates while preserving order
     run_objects = list(dict.fromkeys(run_objects))
+    stage_times.add(times, {'ensemble_parse': time.perf_counter() - parse_start})
+    return ens_short, dataMap, run_objects
+
+def peram_job(task, dataMap):
+    """Render variables of one peram task, e.g. peram_mg_light or peram_mg_light+peram_clover_charm.
 
-    cfg_i = dataMap['cfg_i']
-    cfg_f = dataMap['cfg_f']
-    cfg_step = dataMap['cfg_d']
+    Every flavor of a combined task is one measurement of the same chroma input,
+    which then loads the gauge field and eigs once for all of them. Outputs stay
+    per flavor.
+    """
+    from yml_to_xml import inverter_params
+    data_path = dataMap['data_path']
+    flavors = []
+    for inverter_type, flavor in workflow_dag.peram_flavors(task):
+        flavor_config = {
+            'light': {'mass_label': 'light', 'quark_mass': dataMap['prop_mass_light_label'], 'output_sdb_path': f"{data_path}/perams_sdb"},
+            'strange': {'mass_label': 'strange', 'quark_mass': dataMap.get('prop_mass_strange_label'), 'output_sdb_path': f"{data_path}/perams_strange_sdb"},
+            'charm': {'mass_label': 'charm', 'quark_mass': dataMap.get('prop_mass_charm_label'), 'output_sdb_path': f"{data_path}/perams_charm_sdb"},
+        }[flavor]
+        flavor_config.update({'inverter_type': inverter_type, 'flavor': flavor,
+                              'inverter': inverter_params.inverter_params(dataMap, flavor)})
+        flavors.append(flavor_config)
+    return {
+        'peram_task': task,
+        'flavor': workflow_dag.NAME_SEP.join(f['flavor'] for f in flavors),
+        'inverter_type': workflow_dag.NAME_SEP.join(f['inverter_type'] for f in flavors),
+        'peram_flavors': flavors,
+    }
+
+def task_dir_name(obj, part):
+    """Task-specific subdirectory of launch_path for a run object; peram jobs are told apart by their part variables."""
+    if obj in ['eigs', 'chroma_eigs']:
+        return 'ini-eigs'
+    elif obj in ['meson', 'chroma_meson']:
+        return 'ini-meson'
+    elif obj in ['meson2', 'chroma_meson2']:
+        return 'ini-meson2'
+    elif obj in ['disco', 'chroma_disco', 'chroma_disco_merge']:
+        return 'ini-disco'
+    elif obj in ['fused', 'chroma_fused']:
+        return 'ini-fused'
+    elif obj == 'peram' or obj == 'chroma_peram':
+        return f"ini-perams-{part['flavor']}-{part['inverter_type']}"
+    return 'ini-other'
 
-    for cfg_id in range(cfg_i, cfg_f, cfg_step):
-        print(f'Creating scripts for configuration {cfg_id} from {yaml_file}')
+def output_name(obj, cfg_id, suffix=''):
+    """File name of the rendered XML input or launch script for a run object."""
+    if obj.startswith('chroma'):
+        return f'{obj[len("chroma_"):]}_cfg{cfg_id:02d}{suffix}.sh'
+    return f'{obj}_cfg{cfg_id:02d}{suffix}.ini.xml'
+
+def run_parts(dataMap, obj):
+    """Render variables of every job a run object is split into for one configuration.
+
+    Mesons get one input and one job per momentum chunk and time slab (see
+    yml_to_xml/meson_parts.py), every peram task one per shard of source time
+    slices (see yml_to_xml/peram_parts.py). Disco gets one input per color part and time
+    group (see yml_to_xml/disco_parts.py) and a single array job running them
+    all. The fused run object is a single job chaining all the eigs, peram and
+    meson measurements (see yml_to_xml/fused.py). Every other run object is a
+    single job.
+    """
+    kind = obj.split('_')[-1] if obj.startswith('chroma') else obj
+    if kind in ['meson', 'meson2']:
+        from yml_to_xml import meson_parts
+        return meson_parts.meson_parts(dataMap, kind)
+    if kind == 'peram':
+        from yml_to_xml import peram_parts
+        return [dict(job, **shard) for job in dataMap['peram_jobs']
+                for shard in peram_parts.peram_shards(dataMap, len(job['peram_flavors']))]
+    if obj == 'disco':
+        from yml_to_xml import disco_parts
+        return disco_parts.disco_shards(dataMap)
+    if obj == 'chroma_disco':
+        from yml_to_xml import disco_parts
+        return [{'disco_shards': disco_parts.shard_suffixes(dataMap)}]
+    if kind == 'fused':
+        from yml_to_xml import fused
+        return [fused.fused_vars(dataMap, peram_job(fused.peram_task(dataMap), dataMap))]
+    return [{}]
+
+def plan_targets(dataMap, run_objects, cfg_ids):
+    """List the (cfg_id, run object, output path, part variables) of every file of an ensemble."""
+    parts = {obj: run_parts(dataMap, obj) for obj in run_objects}
+    targets = []
+    for cfg_id in cfg_ids:
         for obj in run_objects:
-            # Determine task-specific subdirectory
-            if obj in ['eigs', 'chroma_eigs']:
-                task_dir = 'ini-eigs'
-            elif obj in ['meson', 'chroma_meson']:
-                task_dir = 'ini-meson'
-            elif obj in ['meson2', 'chroma_meson2']:
-                task_dir = 'ini-meson2'
-            elif obj in ['disco', 'chroma_disco']:
-                task_dir = 'ini-disco'
-            elif obj == 'peram' or obj == 'chroma_peram':
-                flavor = dataMap['flavor']
-                inverter_type = dataMap['inverter_type']
-                task_dir = f'ini-perams-{flavor}-{inverter_type}'
-            else:
-                task_dir = 'ini-other'
-
-            # Create directory structure: run_path/task_dir/cnfg{cfg_id}
-            obj_dir = os.path.join(dataMap['launch_path'], task_dir, f'cnfg{cfg_id:02d}')
-            try:
-                os.makedirs(obj_dir, exist_ok=True)
-                print(f"Ensured task directory exists: {obj_dir}")
-            except Exception as e:
-                print(f"Error creating task directory {obj_dir}: {e}")
-                raise
-
-            # Determine output file name
-            if obj in ['chroma_eigs', 'chroma_disco']:
-                ini_out = f'{obj.split("_")[1]}_cfg{cfg_id:02d}.sh'
-            elif obj.startswith('chroma') and obj not in ['chroma_eigs', 'chroma_disco']:
-                ini_out = f'{obj.split("_")[1]}_cfg{cfg_id:02d}.sh'
-            elif obj in ['disco', 'eigs']:
-                ini_out = f'{obj}_cfg{cfg_id:02d}.ini.xml'
-            else:
-                ini_out = f'{obj}_cfg{cfg_id:02d}.ini.xml'  # fallback
-
-            ini_out_path = os.path.join(obj_dir, ini_out)
-            if os.path.exists(ini_out_path) and not options.overwrite:
-                print(f"Skipping {ini_out_path} (already exists, overwrite=False)")
+            for part in parts[obj]:
+                # Directory structure: launch_path/task_dir/cnfg{cfg_id}
+                obj_dir = os.path.join(dataMap['launch_path'], task_dir_name(obj, part), f'cnfg{cfg_id:02d}')
+                path = os.path.join(obj_dir, output_name(obj, cfg_id, part.get('part_suffix', '')))
+                targets.append((cfg_id, obj, os.path.normpath(path), part))
+    return targets
+
+def plan_ensemble(dataMap, targets):
+    """Directory plan of an ensemble: the data directories plus the parents of every target."""
+    plan = fs_plan.FsPlan()
+    data_path = dataMap['data_path']
+    plan.add_dir(data_path)
+    for dir_name in DATA_DIRS:
+        plan.add_dir(os.path.join(data_path, dir_name), root=data_path)
+    plan.add_dir(dataMap['launch_path'])
+    for _, _, path, _ in targets:
+        plan.add_target(path, root=dataMap['launch_path'])
+    plan.scan()
+    return plan
+
+def render_cfgs(dataMap, targets, overwrite, entries, existing, handler=None):
+    """Render a block of planned targets.
+
+    Directories must already exist and ``existing`` holds the target paths found on
+    disk by the planner, so no per-file stat is needed. A file is only rewritten
+    when the hash of its render inputs or of its template differs from the
+    manifest entry in ``entries`` (or on ``overwrite``). Returns a summary dict with
+    the counts, the changed files, the new manifest entries and the error messages
+    of the failures.
+    """
+    handler = handler or _worker_handler
+    summary = new_summary()
+    times = summary['times']
+    launch_path = dataMap['launch_path']
+    for cfg_id, obj, ini_out_path, part in targets:
+        rel_path = os.path.relpath(ini_out_path, launch_path)
+        try:
+            with stage_times.timed(times, 'dict_copy'):
+                # Prepare data for rendering
+                filtered_data = dataMap.copy()  # Use all dataMap entries
+                filtered_data['cfg_id'] = f'{cfg_id:02d}'
+                filtered_data['part_suffix'] = ''
+                filtered_data.update(part)
+                if obj in ['meson', 'meson2', 'fused']:
+                    from yml_to_xml import meson_xml
+                    filtered_data['displacement_list'] = meson_xml._displacement_list()
+                elif obj == 'disco':
+                    from yml_to_xml import disco_xml
+                    filtered_data['disco_displacement_list'] = disco_xml._displacement_list()
+
+            with stage_times.timed(times, 'hash'):
+                inputs = {key: filtered_data.get(key) for key in handler.template_inputs(obj)}
+                record = [manifest.digest_data(inputs), handler.template_digest(obj)]
+            exists = ini_out_path in existing
+            if exists and not overwrite and entries.get(rel_path) == record:
+                summary['skipped'] += 1
+                summary['entries'][rel_path] = record
                 continue
 
-            # Prepare data for rendering
-            filtered_data = dataMap.copy()  # Use all dataMap entries
-            filtered_data['cfg_id'] = f'{cfg_id:02d}'
-            if obj == 'meson2':
-                filtered_data['momentum_list'] = meson_xml._gen_mom_list2()
-            elif obj == 'meson':
-                filtered_data['momentum_list'] = meson_xml._gen_mom_list()
-            filtered_data['displacement_list'] = meson_xml._displacement_list()
-            filtered_data['disco_displacement_list'] = disco_xml._displacement_list()
-            filtered_data['disco_t_sources'] = disco_xml._displacement_list()
-
-            output_xml = handler.templates[obj].render(filtered_data)
-            print(f"Writing file {ini_out_path} for object {obj}")
-            with open(ini_out_path, 'w') as f:
-                f.write(output_xml)
+            with stage_times.timed(times, 'render'):
+                output_xml = handler.templates[obj].render(filtered_data)
+            with stage_times.timed(times, 'fs'):
+                unchanged = False
+                if exists and not overwrite:
+                    # Inputs changed (or the file predates the manifest) but the
+                    # rendered text may not have: leave the file and its mtime alone.
+                    with open(ini_out_path) as f:
+                        unchanged = f.read() == output_xml
+                if not unchanged:
+                    with open(ini_out_path, 'w') as f:
+                        f.write(output_xml)
+            if unchanged:
+                summary['skipped'] += 1
+                summary['entries'][rel_path] = record
+                continue
+            summary['updated' if exists else 'written'] += 1
+            if exists:
+                summary['changed'].append(rel_path)
+            summary['entries'][rel_path] = record
+        except Exception as e:
+            summary['failed'] += 1
+            summary['errors'].append(f"{ini_out_path}: {type(e).__name__}: {e}")
+    return summary
 
-def main(options):
-    os.makedirs(LOGPATH, exist_ok=True)
-    os.makedirs(OUTPATH, exist_ok=True)
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE), undefined=jinja2.StrictUndefined)
-    handler = TaskHandler(env)
+def target_chunks(targets, jobs):
+    """Split the targets into blocks of whole configurations, several per worker for load balance."""
+    by_cfg = {}
+    for target in targets:
+        by_cfg.setdefault(target[0], []).append(target)
+    cfg_ids = list(by_cfg)
+    size = max(1, -(-len(cfg_ids) // (4 * jobs)))
+    return [[t for cfg_id in cfg_ids[i:i + size] for t in by_cfg[cfg_id]] for i in range(0, len(cfg_ids), size)]
+
+def entries_by_cfg(files):
+    """Group manifest entries by their cnfgNN directory so workers only receive their own."""
+    grouped = {}
+    for rel_path, record in files.items():
+        parts = rel_path.split(os.sep)
+        if len(parts) > 2:
+            grouped.setdefault(parts[1], {})[rel_path] = record
+    return grouped
+
+def new_summary():
+    return {'written': 0, 'updated': 0, 'skipped': 0, 'failed': 0, 'errors': [], 'changed': [], 'entries': {}, 'times': {}}
+
+def merge_summary(total, part):
+    for key in ('written', 'updated', 'skipped', 'failed'):
+        total[key] += part[key]
+    total['errors'].extend(part['errors'])
+    total['changed'].extend(part['changed'])
+    total['entries'].update(part['entries'])
+    stage_times.add(total['times'], part['times'])
+
+def print_summary(ens_short, summary):
+    print(f"{ens_short}: {summary['written']} written, {summary['updated']} updated, "
+          f"{summary['skipped']} unchanged, {summary['failed']} failed")
+    for rel_path in summary['changed'][:10]:
+        print(f"  [UPDATED] {rel_path}")
+    if len(summary['changed']) > 10:
+        print(f"  ... and {len(summary['changed']) - 10} more updated files")
+    for err in summary['errors'][:10]:
+        print(f"  [ERROR] {err}")
+    if len(summary['errors']) > 10:
+        print(f"  ... and {len(summary['errors']) - 10} more errors")
+
+def make_env():
+    """Jinja environment with an on-disk bytecode cache so templates are compiled once across runs."""
+    try:
+        os.makedirs(TEMPLATE_CACHE, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE)
+    except OSError:
+        bytecode_cache = None
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE), undefined=jinja2.StrictUndefined,
+                              bytecode_cache=bytecode_cache)
+
+_worker_handler = None
+
+def _init_worker():
+    """Compile the templates once per worker process."""
+    global _worker_handler
+    _worker_handler = TaskHandler(make_env())
+
+def find_yaml_files(options):
+    """Ensemble YAML files to process, sorted so that runs are reproducible."""
     if options.ini_dir and os.path.isdir(options.ini_dir):
+        yaml_files = []
         for root, _, files in os.walk(options.ini_dir):
             for file in files:
                 if file.endswith('.yml') or file.endswith('.yaml'):
-                    yaml_file = os.path.join(root, file)
-                    print(f"Processing YAML file: {yaml_file}")
-                    process_yaml_file(yaml_file, options, env, handler)
+                    yaml_files.append(os.path.join(root, file))
+        return sorted(yaml_files)
     elif options.ini and os.path.isfile(options.ini):
-        print(f"Processing single YAML file: {options.ini}")
-        process_yaml_file(options.ini, options, env, handler)
-    else:
-        raise ValueError("Please provide a valid --in_file or --ini_dir")
+        return [options.ini]
+    raise ValueError("Please provide a valid --in_file or --ini_dir")
+
+def submit_ensemble(ens_short, dataMap, cfg_ids, options):
+    """Build the per-config job DAG, write its submit plan and optionally submit it."""
+    nodes = workflow_dag.build_dag(dataMap, options.list_tasks, cfg_ids)
+    workflow_dag.mark_done(dataMap, nodes)
+    workflow_dag.print_plan(ens_short, nodes)
+    if options.dry_run:
+        return
+    if options.array:
+        try:
+            arrays = slurm_array.build_arrays(dataMap, nodes, options.array_throttle)
+        except ValueError as e:
+            print(f"Error: {ens_short}: {e}")
+            return
+        plan_path = os.path.join(dataMap['launch_path'], f'submit_{ens_short}_array.sh')
+        n_arrays = slurm_array.write_plan(plan_path, arrays)
+        print(f"Wrote array submit plan with {n_arrays} array jobs "
+              f"({sum(len(a.pending) for a in arrays)} tasks): {plan_path}")
+        if options.submit:
+            job_ids = slurm_array.submit(arrays, options.sbatch)
+            print(f"Submitted {len(job_ids)} array jobs for {ens_short}")
+        return
+    plan_path = os.path.join(dataMap['launch_path'], f'submit_{ens_short}.sh')
+    n_jobs = workflow_dag.write_plan(plan_path, nodes)
+    print(f"Wrote submit plan with {n_jobs} jobs: {plan_path}")
+    if options.submit:
+        job_ids = workflow_dag.submit(nodes, options.sbatch)
+        print(f"Submitted {len(job_ids)} jobs for {ens_short}")
+
+def main(options):
+    start = time.perf_counter()
+    times = {}  # ensemble -> stage -> seconds spent outside render_cfgs
+    if not options.dry_run:
+        os.makedirs(LOGPATH, exist_ok=True)
+        os.makedirs(OUTPATH, exist_ok=True)
+    yaml_files = find_yaml_files(options)
+    manifests = {}
+    summaries = {}
+    pending = []
+    loaded = []
+    # With --jobs the cfg x object work of every ensemble is fanned out over one
+    # pool; results are collected in submission order so the report is stable.
+    pool = None
+    if options.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=options.jobs, initializer=_init_worker)
+    handler = None if pool else TaskHandler(make_env())
+    walltime_model = walltime.load_model(options.walltime_model) if options.walltime_model else None
+    # every ensemble is checked before the first file of any of them is written
+    from yml_to_xml import validate
+    models = (handler or TaskHandler(make_env())).xml_classes
+    ensemble_runs = []
+    for yaml_file in yaml_files:
+        ens_times = {}
+        ens_short, dataMap, run_objects = load_ensemble(yaml_file, options, ens_times)
+        times[ens_short] = ens_times
+        ensemble_runs.append((ens_short, dataMap, run_objects))
+    invalid = 0
+    for ens_short, dataMap, run_objects in ensemble_runs:
+        with stage_times.timed(times[ens_short], 'validate'):
+            errors = validate.validate(dataMap, run_objects, models)
+        for error in errors:
+            print(f"{ens_short}: [INVALID] {error}")
+        invalid += bool(errors)
+    if invalid:
+        if pool:
+            pool.shutdown()
+        raise SystemExit(f"{invalid} ensemble(s) failed validation, nothing written")
+    try:
+        for ens_short, dataMap, run_objects in ensemble_runs:
+            if walltime_model:
+                changes = walltime.apply_walltimes(dataMap, walltime_model, options.list_tasks, options.walltime_margin)
+                for key, (old, new) in changes.items():
+                    print(f"{ens_short}: {key} {old} -> {new} (predicted)")
+            launch_path = dataMap['launch_path']
+            if launch_path not in manifests:
+                with stage_times.timed(times[ens_short], 'fs'):
+                    manifests[launch_path] = manifest.load_manifest(launch_path)
+            ens_manifest = manifests[launch_path]
+            snapshot = manifest.key_digests(dataMap)
+            previous = ens_manifest['ensembles'].get(ens_short)
+            if previous:
+                changed = manifest.changed_keys(previous, snapshot)
+                if changed:
+                    print(f"{ens_short}: inputs changed since last run: {', '.join(changed)}")
+            ens_manifest['ensembles'][ens_short] = snapshot
+            summaries[ens_short] = new_summary()
+            cfg_ids = range(dataMap['cfg_i'], dataMap['cfg_f'], dataMap['cfg_d'])
+            loaded.append((ens_short, dataMap, cfg_ids))
+            with stage_times.timed(times[ens_short], 'plan'):
+                targets = plan_targets(dataMap, run_objects, cfg_ids)
+            with stage_times.timed(times[ens_short], 'fs'):
+                plan = plan_ensemble(dataMap, targets)
+            if options.dry_run:
+                plan.report(ens_short)
+                continue
+            with stage_times.timed(times[ens_short], 'fs'):
+                plan.create_dirs()
+            if pool is None:
+                result = render_cfgs(dataMap, targets, options.overwrite, ens_manifest['files'], plan.existing_files, handler)
+                pending.append((ens_short, launch_path, result))
+                continue
+            grouped = entries_by_cfg(ens_manifest['files'])
+            for chunk in target_chunks(targets, options.jobs):
+                entries = {}
+                for cfg_id in dict.fromkeys(t[0] for t in chunk):
+                    entries.update(grouped.get(f'cnfg{cfg_id:02d}', {}))
+                existing = {t[2] for t in chunk if t[2] in plan.existing_files}
+                future = pool.submit(render_cfgs, dataMap, chunk, options.overwrite, entries, existing)
+                pending.append((ens_short, launch_path, future))
+        for ens_short, launch_path, result in pending:
+            merge_summary(summaries[ens_short], result.result() if pool else result)
+    finally:
+        if pool:
+            pool.shutdown()
+    if options.dry_run:
+        if options.submit_plan or options.submit:
+            for ens_short, dataMap, cfg_ids in loaded:
+                submit_ensemble(ens_short, dataMap, cfg_ids, options)
+        return
+    for ens_short, launch_path, _ in pending:
+        manifests[launch_path]['files'].update(summaries[ens_short]['entries'])
+    save_start = time.perf_counter()
+    for launch_path, ens_manifest in manifests.items():
+        manifest.save_manifest(launch_path, ens_manifest)
+    if summaries:
+        # the manifests are shared between ensembles: book their writing on the first
+        stage_times.add(times[next(iter(summaries))], {'fs': time.perf_counter() - save_start})
+    for ens_short, summary in summaries.items():
+        print_summary(ens_short, summary)
+    if options.profile:
+        report = stage_times.profile(summaries, times, time.perf_counter() - start, options.jobs)
+        stage_times.write_profile(options.profile, report)
+        print(f"Profile: {report['files']} files in {report['seconds']:.2f} s "
+              f"({report['files_per_second']:.0f} files/s), peak RSS {report['peak_rss_mb']:.0f} MB -> {options.profile}")
+    if any(summary['failed'] for summary in summaries.values()):
+        raise SystemExit(1)
+    if options.submit_plan or options.submit:
+        for ens_short, dataMap, cfg_ids in loaded:
+            submit_ensemble(ens_short, dataMap, cfg_ids, options)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--ini', type=str, required=False, help='Path to a single YAML input file')
     parser.add_argument('--ini_dir', type=str, required=False, help='Directory containing YAML files for ensembles')
-    parser.add_argument('-l', '--list_tasks', nargs='+', required=True, help='List of tasks to generate (e.g., eigs, peram_mg_light, meson, disco)')
-    parser.add_argument('--overwrite', action='store_true', help='Overwrite existing XML and shell scripts')
+    parser.add_argument('-l', '--list_tasks', nargs='+', required=True, help='List of tasks to generate (e.g., eigs, peram_mg_light, meson, disco, fused for eigs+peram+meson in one job); join peram tasks with + to run them in one job, e.g. peram_mg_light+peram_mg_strange')
+    parser.add_argument('--overwrite', action='store_true', help='Rewrite every XML and shell script, even those whose inputs are unchanged')
     parser.add_argument('--test', action='store_true', help='Run in test mode')
+    parser.add_argument('--dry_run', action='store_true', help='Print the directory plan and its metadata-op count without writing anything')
+    parser.add_argument('--submit_plan', action='store_true', help='Write launch_path/submit_<ens>.sh chaining the jobs of each config with --dependency=afterok, skipping jobs whose output exists')
+    parser.add_argument('--submit', action='store_true', help='Submit the plan right away (implies --submit_plan)')
+    parser.add_argument('--array', action='store_true', help='With --submit_plan/--submit, submit one slurm array job per task over the per-config scripts instead of one job per config')
+    parser.add_argument('--array_throttle', type=int, help='Maximum number of array tasks running at once (the %% of --array)')
+    parser.add_argument('--sbatch', type=str, default='sbatch', help='sbatch command used by --submit, e.g. scripts/fake_sbatch.py (default: %(default)s)')
+    parser.add_argument('--walltime_model', type=str, help='Walltime model written by scripts/walltime.py; replaces the *_chroma_minutes of the YAML with predictions')
+    parser.add_argument('--walltime_margin', type=float, default=1.25, help='Safety factor on the predicted walltimes (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes used to render configurations and ensembles (default: %(default)s)')
+    parser.add_argument('--profile', type=str, help='Write the time spent in each stage, the files per second and the peak RSS to this JSON file (see scripts/stage_times.py)')
     options = parser.parse_args()
     if not (options.ini or options.ini_dir):
         parser.error("At least one of --in_file or --ini_dir must be provided")
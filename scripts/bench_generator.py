@@ -0,0 +1,132 @@
+'''throughput benchmark of create_tasks_ens.py on synthetic ensembles
+
+Builds one ensemble yaml per size (number of configurations) in a temporary
+directory, with every task type, and runs create_tasks_ens.py --profile on it
+twice: cold (every file written) and warm (every file unchanged, the manifest
+skip path). Reports files per second, peak RSS and the time per stage of
+scripts/stage_times.py:
+
+    python -m scripts.bench_generator
+    python -m scripts.bench_generator --sizes 100 1000 -j 4 --output bench.json
+    python -m scripts.bench_generator --baseline bench.json
+
+With --baseline the files per second are compared to an earlier --output and
+the command fails if any run is slower by more than --tolerance, so a template
+or create_tasks_ens.py change can be checked for regressions.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import yaml
+
+from scripts import stage_times
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# a 3+1 flavor ensemble, so meson2 renders as well
+ENSEMBLE = 'b3.4_s24t64'
+TASKS = ['eigs', 'peram_mg_light', 'peram_mg_strange', 'peram_mg_charm', 'meson', 'meson2', 'disco', 'fused']
+SIZES = [100, 1000, 10000]
+
+
+def ensemble_yaml(root: str, n_cfgs: int) -> dict:
+    '''parameters of a synthetic ensemble of n_cfgs configurations, every path under root'''
+    return {
+        'data_path': f'{root}/data', 'run_path': f'{root}/data', 'launch_path': f'{root}/launch',
+        'eigs_path': f'{root}/data/eigs_sdb', 'code_dir': f'{root}/code',
+        'account': 'bench', 'partition': 'booster', 'facility': 'juwels', 'num_gpu': 4,
+        'max_moms_per_job': 50, 'mom2_min': 0, 'mom2_max': 3,
+        'cfg_i': 0, 'cfg_f': n_cfgs, 'cfg_d': 1,
+        'num_iter': 50, 'num_orthog': 1, 'eigs_tasks_node': 4, 'eigs_slurm_nodes': 1, 'eigs_chroma_minutes': 30,
+        'prop_slurm_nodes': 1, 'prop_num_gpu': 4, 'prop_chroma_minutes': 120,
+        'prop_mass_light_label': -0.040, 'prop_mass_strange_label': -0.007, 'prop_mass_charm_label': 0.33,
+        'num_tsrc': 16, 'prop_t_back': 0, 'prop_nvec': 64,
+        'prop_zphases': '0.00', 'prop_clov_coeff': 1.0, 'rho': 0.125, 'precision': 1.0e-7, 'max_iter': 10000,
+        'meson_slurm_nodes': 1, 'meson_chroma_max_tslices_in_contraction': 4, 'meson_chroma_minutes': 60,
+        'meson_chroma_parts': 1, 'meson_zphases': '0.00', 'meson_t_back': 0,
+        'disco_slurm_nodes': 1, 'disco_chroma_minutes': 120, 'disco_num_gpu': 4, 'disco_max_rhs': 8,
+        'disco_probing_displacement': 4, 'disco_probing_power': 10, 'disco_max_colors_at_once': 256,
+        'disco_max_colors': 3325, 'disco_noise_vectors': 1,
+        'superbblas_threads': 16, 'omp_threads': 16, 'Frequency': 1, 'max_nvec': 128, 'num_vecs': 64,
+        'num_vecs_perams': 64, 'decay_dir': 3, 't_start': 0, 'Nt_backward': 0, 'num_tries': 1, 'max_rhs': 8,
+        'phase': [0.0, 0.0, 0.0], 'write_fingerprint': False, 'LinkSmearingType': 'STOUT_SMEAR',
+        'link_smear_fact': 0.1, 'link_smear_num': 10, 'no_smear_dir': 3, 'gauge_id': 'default_gauge_field',
+        'colorvec_out': 'eigs',
+    }
+
+
+def run(yaml_file: str, profile: str, tasks: list, jobs: int) -> dict:
+    '''one create_tasks_ens.py run, its --profile report'''
+    command = [sys.executable, 'create_tasks_ens.py', '--ini', yaml_file, '-l', *tasks, '-j', str(jobs),
+               '--profile', profile]
+    result = subprocess.run(command, cwd=REPO, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f"{' '.join(command)} failed:\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+    with open(profile) as f:
+        return json.load(f)
+
+
+def bench(sizes: list, tasks: list, jobs: int, keep: str = None) -> dict:
+    '''cold and warm report of every size'''
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_generator_', dir=keep) as tmp:
+        for n_cfgs in sizes:
+            root = os.path.join(tmp, f'cfgs{n_cfgs}')
+            os.makedirs(root)
+            yaml_file = os.path.join(root, f'{ENSEMBLE}.yml')
+            with open(yaml_file, 'w') as f:
+                yaml.safe_dump(ensemble_yaml(root, n_cfgs), f)
+            for state in ('cold', 'warm'):
+                report = run(yaml_file, os.path.join(root, f'{state}.json'), tasks, jobs)
+                results[f'{n_cfgs}/{state}'] = report
+                print_report(f'{n_cfgs} cfgs, {state}', report)
+    return results
+
+
+def print_report(label: str, report: dict) -> None:
+    seconds = report['seconds']
+    print(f"{label}: {report['files']} files in {seconds:.2f} s, {report['files_per_second']:.0f} files/s, "
+          f"peak RSS {report['peak_rss_mb']:.0f} MB")
+    for stage in stage_times.STAGES:
+        spent = report['stages'].get(stage, 0.0)
+        print(f"  {stage:<15} {spent:8.3f} s {100 * spent / seconds if seconds else 0:5.1f}%")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    '''runs slower than the baseline by more than tolerance (a fraction of its files per second)'''
+    slower = []
+    for key, report in results.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key]['files_per_second'], report['files_per_second']
+        print(f"{key}: {old:.0f} -> {new:.0f} files/s ({100 * (new / old - 1) if old else 0:+.1f}%)")
+        if new < old * (1 - tolerance):
+            slower.append(key)
+    return slower
+
+
+def main(options):
+    results = bench(options.sizes, options.list_tasks, options.jobs, options.tmp_dir)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if options.baseline:
+        with open(options.baseline) as f:
+            slower = compare(results, json.load(f), options.tolerance)
+        if slower:
+            raise SystemExit(f"slower than {options.baseline}: {', '.join(slower)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Numbers of configurations of the synthetic ensembles (default: %(default)s)')
+    parser.add_argument('-l', '--list_tasks', nargs='+', default=TASKS, help='Tasks to generate (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes of create_tasks_ens.py (default: %(default)s)')
+    parser.add_argument('--tmp_dir', type=str, help='Directory to build the ensembles in (default: the system temporary directory)')
+    parser.add_argument('--output', type=str, help='Write the reports of every run to this JSON file')
+    parser.add_argument('--baseline', type=str, help='Compare the files per second with an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Fraction of the baseline files per second a run may lose (default: %(default)s)')
+    main(parser.parse_args())
@@ -0,0 +1,181 @@
+'''cost-aware packing of configurations onto multi-GPU, multi-node allocations
+
+Each (task, cfg) becomes a chroma instance with a cost in GPU-minutes and a memory
+footprint. Instances get the smallest power-of-two number of GPUs whose memory
+holds them, the allocation is cut into lanes of that many GPUs, and configurations
+are assigned longest-first to the least loaded lane (LPT). A lane runs its
+instances one after the other, lanes run concurrently, and an allocation is
+closed when no lane can take another instance within the walltime limit. Small
+volumes such as s16t64 thus fill every GPU of a node instead of a fixed group of 4.
+'''
+import math
+
+# relative solve cost of a flavor: light quarks need the multigrid solver the longest
+FLAVOR_FACTOR = {'light': 1.0, 'strange': 0.5, 'charm': 0.25}
+# minutes prefix of the yaml keys (*_chroma_minutes, *_slurm_nodes) per task kind
+TASK_PREFIX = {'eigs': 'eigs', 'peram': 'prop', 'meson': 'meson', 'meson2': 'meson', 'disco': 'disco', 'fused': 'fused'}
+# GPU-minutes per unit of work when the ensemble yaml has no walltime to calibrate on
+DEFAULT_MINUTES_PER_UNIT = 2e-9
+
+
+class Instance:
+    def __init__(self, task, cfg_id, minutes, gpus, part=''):
+        self.task = task
+        self.cfg_id = cfg_id
+        self.minutes = minutes
+        self.gpus = gpus
+        self.part = part
+
+
+class Allocation:
+    def __init__(self, nodes, gpus_per_node, gpus_per_instance, walltime):
+        self.nodes = nodes
+        self.gpus_per_instance = gpus_per_instance
+        self.walltime = walltime
+        n_lanes = nodes * gpus_per_node // gpus_per_instance
+        self.lanes = [[] for _ in range(n_lanes)]
+        self.loads = [0.0] * n_lanes
+
+    def lane_devices(self, lane: int, gpus_per_node: int) -> list:
+        '''(node index, GPU ids) of a lane'''
+        per_node = gpus_per_node // self.gpus_per_instance
+        first = (lane % per_node) * self.gpus_per_instance
+        return lane // per_node, list(range(first, first + self.gpus_per_instance))
+
+    @property
+    def minutes(self) -> int:
+        return int(math.ceil(max(self.loads))) if self.loads else 0
+
+    @property
+    def efficiency(self) -> float:
+        '''busy GPU time over allocated GPU time'''
+        if not self.minutes:
+            return 0.0
+        return sum(self.loads) / (len(self.lanes) * self.minutes)
+
+
+def task_kind(task: str):
+    '''(kind, flavor) of a --list_tasks entry such as peram_mg_strange; combined peram tasks join their flavors with +'''
+    if task.startswith('peram'):
+        return 'peram', '+'.join(name.split('_')[-1] for name in task.split('+'))
+    return task, 'light'
+
+
+def work_units(kind: str, NL: int, NT: int, nvec: int, num_tsrc: int = 1, flavor: str = 'light',
+               n_mom: int = 1, n_disp: int = 1) -> float:
+    '''dimensionless amount of work of one configuration, used to scale measured walltimes'''
+    volume = NL ** 3 * NT
+    if kind == 'eigs':
+        return volume * nvec * nvec ** 0.5
+    if kind == 'peram':
+        return volume * num_tsrc * 4 * nvec * sum(FLAVOR_FACTOR.get(f, 1.0) for f in flavor.split('+'))
+    if kind in ('meson', 'meson2'):
+        return volume * nvec ** 2 * n_mom * n_disp
+    return volume * 100
+
+
+def memory_bytes(kind: str, NL: int, NT: int, nvec: int, max_rhs: int = 1) -> float:
+    '''rough device memory of one instance: gauge and clover fields, colorvecs, solver vectors'''
+    volume = NL ** 3 * NT
+    memory = volume * (4 * 18 + 2 * 72) * 8
+    if kind in ('eigs', 'meson', 'meson2'):
+        memory += volume * 3 * 16 * nvec
+    if kind in ('peram', 'fused'):
+        memory += volume * 3 * 16 * nvec + volume * 12 * 16 * max_rhs * 24
+    if kind == 'disco':
+        memory += volume * 12 * 16 * max_rhs * 24
+    return memory
+
+
+def gpus_per_instance(memory: float, gpus_per_node: int, gpu_mem_gb: float, fill: float = 0.8) -> int:
+    '''smallest power of two GPUs, up to a whole node, whose memory holds one instance'''
+    gpus = 1
+    while gpus < gpus_per_node and memory / gpus > gpu_mem_gb * 1e9 * fill:
+        gpus *= 2
+    return min(gpus, gpus_per_node)
+
+
+def task_work(dataMap: dict, task: str, nvec: int, flavor: str = None) -> float:
+    '''work units of one configuration of a task with the parameters of the ensemble yaml'''
+    kind, task_flavor = task_kind(task)
+    if kind == 'fused':
+        from yml_to_xml import fused
+        return sum(task_work(dataMap, step, nvec) for step in ('eigs', fused.peram_task(dataMap), 'meson'))
+    NL, NT = dataMap['NL'], dataMap['NT']
+    num_tsrc = len(range(0, NT, dataMap.get('num_tsrc', NT)))
+    n_mom = len(dataMap.get('momentum_list', [])) or 1
+    n_disp = len(dataMap.get('displacement_list', [])) or 1
+    return work_units(kind, NL, NT, nvec, num_tsrc, flavor or task_flavor, n_mom, n_disp)
+
+
+def instance_minutes(dataMap: dict, task: str, nvec: int, gpus: int, gpus_per_node: int) -> float:
+    '''walltime of one instance on `gpus` GPUs
+
+    The hand-set *_chroma_minutes of the yaml (for its own nodes, nvec and t_sources)
+    calibrate the work model; it is rescaled to the requested nvec and GPU count
+    assuming ideal strong scaling.
+    '''
+    kind, _ = task_kind(task)
+    if kind == 'fused' and not dataMap.get('fused_chroma_minutes'):
+        # calibrated on the steps it chains
+        from yml_to_xml import fused
+        return sum(instance_minutes(dataMap, step, nvec, gpus, gpus_per_node)
+                   for step in ('eigs', fused.peram_task(dataMap), 'meson'))
+    work = task_work(dataMap, task, nvec)
+    prefix = TASK_PREFIX[kind]
+    minutes = dataMap.get(f'{prefix}_chroma_minutes')
+    if minutes:
+        nodes = dataMap.get(f'{prefix}_slurm_nodes', 1)
+        ref_nvec = dataMap.get('num_vecs' if kind == 'eigs' else 'num_vecs_perams', nvec)
+        ref_work = task_work(dataMap, task, ref_nvec, 'light')
+        gpu_minutes = minutes * nodes * gpus_per_node * work / ref_work
+    else:
+        gpu_minutes = work * DEFAULT_MINUTES_PER_UNIT
+    return gpu_minutes / gpus
+
+
+def pack(instances: list, nodes: int, gpus_per_node: int, walltime: float) -> list:
+    '''pack instances with equal GPU counts into allocations of `nodes` nodes, LPT into lanes'''
+    allocations = []
+    by_gpus = {}
+    for instance in instances:
+        by_gpus.setdefault(instance.gpus, []).append(instance)
+    for gpus, group in sorted(by_gpus.items()):
+        group = sorted(group, key=lambda i: (-i.minutes, i.cfg_id))
+        current = []
+        for instance in group:
+            if instance.minutes > walltime:
+                raise ValueError(f"{instance.task} cfg {instance.cfg_id} needs {instance.minutes:.0f} min "
+                                 f"on {gpus} GPUs, more than the {walltime} min walltime limit")
+            target = None
+            for allocation in current:
+                lane = min(range(len(allocation.lanes)), key=allocation.loads.__getitem__)
+                if allocation.loads[lane] + instance.minutes <= walltime:
+                    target = (allocation, lane)
+                    break
+            if target is None:
+                allocation = Allocation(nodes, gpus_per_node, gpus, walltime)
+                current.append(allocation)
+                target = (allocation, 0)
+            allocation, lane = target
+            allocation.lanes[lane].append(instance)
+            allocation.loads[lane] += instance.minutes
+        allocations.extend(current)
+    return allocations
+
+
+def report(allocations: list) -> str:
+    '''packing-efficiency report, one line per allocation plus the total'''
+    lines = []
+    busy = total = 0.0
+    for k, allocation in enumerate(allocations):
+        n_inst = sum(len(lane) for lane in allocation.lanes)
+        lines.append(f"alloc{k:03d}: {allocation.nodes} node(s), {len(allocation.lanes)} lanes x "
+                     f"{allocation.gpus_per_instance} GPU, {n_inst} instances, {allocation.minutes} min, "
+                     f"efficiency {allocation.efficiency:.0%}")
+        busy += sum(allocation.loads)
+        total += len(allocation.lanes) * allocation.minutes
+    if total:
+        lines.append(f"total: {len(allocations)} allocations, {busy / 60:.1f} busy of {total / 60:.1f} allocated "
+                     f"lane-hours, efficiency {busy / total:.0%}")
+    return '\n'.join(lines)
@@ -0,0 +1,419 @@
+'''state of every (ensemble, output, cfg) of a campaign in a local SQLite index
+
+scan brings the index up to date with the files of the ensembles, and only
+lists a directory again when its mtime changed since the last scan:
+
+- the launch scripts of the ini-* trees of launch_path (generated),
+- the outputs in the *_sdb directories of scripts/completeness.py (done),
+- the START/FINISH stamps and chroma timings of the slurm outputs and logs in
+  chroma_out, res/log and res/out (running, or failed if the job finished
+  without writing its output), parsed by scripts/walltime.py. A log whose job
+  has started but not finished is read again whenever it grows, as appending
+  does not change the mtime of its directory,
+- optionally the jobs of squeue (--squeue) and sacct (--sacct), or of any
+  command printing the same `jobid|state|name|command` lines, e.g. a file of
+  them: --squeue "cat queue.txt". A job is matched to its launch script, or
+  to its -J name.
+
+Outputs are the types of completeness.OUTPUTS, so a peram task is split into
+its flavors (peram, peram_strange, peram_charm). The state of a configuration
+is the first of done (every part, or the merged file, present), failed,
+running, submitted (waiting in the queue), generated and missing; the state of
+the latest job of the configuration takes precedence over the logs. summary and
+list read the index only:
+
+    python -m scripts.campaign_state scan --ini_dir ens --squeue
+    python -m scripts.campaign_state summary
+    python -m scripts.campaign_state list --state failed --output peram_strange
+'''
+import argparse
+import os
+import re
+import shlex
+import sqlite3
+import subprocess
+import time
+
+from scripts import completeness, walltime, workflow_dag
+
+DB_FILE = 'campaign_state.sqlite'
+STATES = ('done', 'failed', 'running', 'submitted', 'generated', 'missing')
+SQUEUE = "squeue --me -h -o '%i|%T|%j|%o'"
+SACCT = 'sacct -X -n -P -o JobID,State,JobName,SubmitLine'
+# slurm job states, as printed by squeue %T and sacct State, and the configuration state they give
+QUEUE_STATES = {'PENDING': 'submitted', 'CONFIGURING': 'submitted', 'REQUEUED': 'submitted', 'RESIZING': 'submitted',
+                'SUSPENDED': 'submitted', 'RUNNING': 'running', 'COMPLETING': 'running'}
+INI_SCRIPT = re.compile(rf'^(?P<obj>[a-z0-9_]+?)_cfg(?P<cfg>\d+){walltime.PART_RE}\.sh$')
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ensembles (ens TEXT PRIMARY KEY, yaml TEXT, launch_path TEXT, cfg_d INTEGER, scanned REAL);
+CREATE TABLE IF NOT EXISTS dirs (ens TEXT, path TEXT, parent TEXT, source TEXT, mtime_ns INTEGER, PRIMARY KEY (ens, path));
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (ens, parent);
+CREATE TABLE IF NOT EXISTS files (ens TEXT, dir TEXT, name TEXT, mtime_ns INTEGER, PRIMARY KEY (ens, dir, name));
+CREATE TABLE IF NOT EXISTS facts (ens TEXT, dir TEXT, name TEXT, output TEXT, cfg INTEGER, part TEXT, state TEXT, job_id TEXT);
+CREATE INDEX IF NOT EXISTS facts_file ON facts (ens, dir, name);
+CREATE INDEX IF NOT EXISTS facts_cfg ON facts (ens, output, cfg);
+CREATE TABLE IF NOT EXISTS grid (ens TEXT, output TEXT, cfg INTEGER, parts TEXT, PRIMARY KEY (ens, output, cfg));
+CREATE TABLE IF NOT EXISTS status (ens TEXT, output TEXT, cfg INTEGER, state TEXT, PRIMARY KEY (ens, output, cfg));
+CREATE INDEX IF NOT EXISTS status_state ON status (state, ens, output);
+'''
+
+
+def connect(path: str = DB_FILE) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def task_from_dir(task_dir: str):
+    '''--list_tasks entry of an ini-* directory, the inverse of workflow_dag.task_spec, or None'''
+    name = task_dir[len('ini-'):] if task_dir.startswith('ini-') else None
+    if name in ('eigs', 'meson', 'meson2', 'disco', 'fused'):
+        return name
+    if name and name.startswith('perams-') and name.count('-') == 2:
+        _, flavors, inverters = name.split('-')
+        return '+'.join(f'peram_{inverter}_{flavor}' for inverter, flavor in
+                        zip(inverters.split(workflow_dag.NAME_SEP), flavors.split(workflow_dag.NAME_SEP)))
+    return None
+
+
+def task_outputs(dataMap: dict, task: str) -> list:
+    '''output types a task writes'''
+    if task == 'disco_merge':
+        return ['disco']
+    if task == 'fused':
+        from yml_to_xml import fused
+        return fused.output_types(dataMap)
+    try:
+        return workflow_dag.task_spec(task)[2].split('+')
+    except ValueError:
+        return []
+
+
+def ini_facts(dataMap: dict, path: str, name: str) -> list:
+    '''(output, cfg, part, state, job_id) of a launch script'''
+    match = INI_SCRIPT.match(name)
+    task = task_from_dir(os.path.basename(os.path.dirname(os.path.dirname(path))))
+    if not match or not task:
+        return []
+    if match['obj'] == 'disco_merge':
+        task = 'disco_merge'
+    return [(output, int(match['cfg']), match['part'] or '', 'generated', None) for output in task_outputs(dataMap, task)]
+
+
+def output_facts(file_type: str):
+    def parse(dataMap: dict, path: str, name: str) -> list:
+        match = completeness.PATTERNS[file_type].match(name)
+        if not match or match['ext'] != 'sdb':
+            return []
+        return [(file_type, int(match['cfg']), match.groupdict().get('part') or '', 'done', None)]
+    return parse
+
+
+def log_facts(dataMap: dict, path: str, name: str) -> list:
+    '''started and finished parts of the jobs stamped in a slurm output or chroma log'''
+    facts = []
+    for task, cfg, part, _, minutes, _ in walltime.parse_file(path):
+        state = 'started' if minutes is None else 'finished'
+        facts += [(output, cfg, part, state, None) for output in task_outputs(dataMap, task)]
+    return list(dict.fromkeys(facts))
+
+
+def sources(dataMap: dict) -> list:
+    '''(directory, source, parse, depth) of everything scanned for an ensemble'''
+    roots = [(dataMap['launch_path'], 'ini', ini_facts, 2)]
+    roots += [(completeness.output_dir(dataMap, file_type), 'sdb', output_facts(file_type), 0)
+              for file_type in completeness.OUTPUTS]
+    for root in dict.fromkeys(dataMap[key] for key in ('data_path', 'run_path') if dataMap.get(key)):
+        roots += [(os.path.join(root, log_dir), 'log', log_facts, 8) for log_dir in walltime.LOG_DIRS]
+    return roots
+
+
+class Scan:
+    '''incremental scan of the directories of one ensemble; touched collects the (output, cfg) whose facts changed'''
+
+    def __init__(self, conn: sqlite3.Connection, dataMap: dict):
+        self.conn = conn
+        self.dataMap = dataMap
+        self.ens = dataMap['ens_short']
+        self.touched = set()
+        self.dirs = 0
+        self.listed = 0
+        self.parsed = 0
+
+    def forget_file(self, directory: str, name: str) -> None:
+        rows = self.conn.execute('SELECT output, cfg FROM facts WHERE ens=? AND dir=? AND name=?', (self.ens, directory, name))
+        self.touched.update(rows)
+        self.conn.execute('DELETE FROM facts WHERE ens=? AND dir=? AND name=?', (self.ens, directory, name))
+        self.conn.execute('DELETE FROM files WHERE ens=? AND dir=? AND name=?', (self.ens, directory, name))
+
+    def forget_dir(self, directory: str) -> None:
+        for (name,) in self.conn.execute('SELECT name FROM files WHERE ens=? AND dir=?', (self.ens, directory)).fetchall():
+            self.forget_file(directory, name)
+        for (sub,) in self.conn.execute('SELECT path FROM dirs WHERE ens=? AND parent=?', (self.ens, directory)).fetchall():
+            self.forget_dir(sub)
+        self.conn.execute('DELETE FROM dirs WHERE ens=? AND path=?', (self.ens, directory))
+
+    def read_file(self, directory: str, name: str, mtime_ns: int, parse) -> None:
+        self.forget_file(directory, name)
+        facts = parse(self.dataMap, os.path.join(directory, name), name)
+        self.parsed += 1
+        self.conn.execute('INSERT INTO files VALUES (?, ?, ?, ?)', (self.ens, directory, name, mtime_ns))
+        self.conn.executemany('INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              [(self.ens, directory, name, *fact) for fact in facts])
+        self.touched.update((output, cfg) for output, cfg, *_ in facts)
+
+    def walk(self, directory: str, parent: str, source: str, parse, depth: int) -> None:
+        self.dirs += 1
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self.forget_dir(directory)
+            return
+        known = self.conn.execute('SELECT mtime_ns FROM dirs WHERE ens=? AND path=?', (self.ens, directory)).fetchone()
+        if known and known[0] == mtime_ns:
+            subdirs = [sub for (sub,) in self.conn.execute('SELECT path FROM dirs WHERE ens=? AND parent=?',
+                                                           (self.ens, directory))]
+            if source == 'log':
+                self.recheck_started(directory, parse)
+        else:
+            subdirs = self.list_dir(directory, depth > 0, parse)
+            if source == 'ini' and parent is None:
+                # below launch_path only the ini-* trees hold launch scripts
+                subdirs = [sub for sub in subdirs if os.path.basename(sub).startswith('ini-')]
+            self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)', (self.ens, directory, parent, source, mtime_ns))
+        for sub in subdirs:
+            self.walk(sub, directory, source, parse, depth - 1)
+
+    def list_dir(self, directory: str, descend: bool, parse) -> list:
+        '''read the files of a changed directory whose mtime changed; returns its subdirectories'''
+        self.listed += 1
+        known = dict(self.conn.execute('SELECT name, mtime_ns FROM files WHERE ens=? AND dir=?', (self.ens, directory)))
+        subdirs, seen = [], set()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if descend:
+                        subdirs.append(entry.path)
+                    continue
+                seen.add(entry.name)
+                mtime_ns = entry.stat().st_mtime_ns
+                if known.get(entry.name) != mtime_ns:
+                    self.read_file(directory, entry.name, mtime_ns, parse)
+        for name in set(known) - seen:
+            self.forget_file(directory, name)
+        known_subdirs = [sub for (sub,) in self.conn.execute('SELECT path FROM dirs WHERE ens=? AND parent=?',
+                                                             (self.ens, directory)).fetchall()]
+        for sub in set(known_subdirs) - set(subdirs):
+            self.forget_dir(sub)
+        return sorted(subdirs)
+
+    def recheck_started(self, directory: str, parse) -> None:
+        '''read the logs of unfinished jobs again if they grew'''
+        rows = self.conn.execute('SELECT DISTINCT files.name, files.mtime_ns FROM facts JOIN files USING (ens, dir, name) '
+                                 "WHERE facts.ens=? AND facts.dir=? AND facts.state='started'", (self.ens, directory)).fetchall()
+        for name, known in rows:
+            try:
+                mtime_ns = os.stat(os.path.join(directory, name)).st_mtime_ns
+            except FileNotFoundError:
+                continue  # the directory mtime changes with it, next scan lists it
+            if mtime_ns != known:
+                self.read_file(directory, name, mtime_ns, parse)
+
+
+def update_grid(conn: sqlite3.Connection, dataMap: dict) -> set:
+    '''expected (output, cfg) of the ensemble with their part suffixes; returns the entries that changed'''
+    ens = dataMap['ens_short']
+    grid = {(file_type, cfg): ' '.join(completeness.default_parts(dataMap, file_type))
+            for file_type in completeness.OUTPUTS for cfg in completeness.cfg_grid(dataMap)}
+    known = {(output, cfg): parts for output, cfg, parts in conn.execute('SELECT output, cfg, parts FROM grid WHERE ens=?', (ens,))}
+    changed = {key for key in grid.keys() | known.keys() if grid.get(key) != known.get(key)}
+    for output, cfg in changed:
+        if (output, cfg) in grid:
+            conn.execute('INSERT OR REPLACE INTO grid VALUES (?, ?, ?, ?)', (ens, output, cfg, grid[(output, cfg)]))
+        else:
+            conn.execute('DELETE FROM grid WHERE ens=? AND output=? AND cfg=?', (ens, output, cfg))
+            conn.execute('DELETE FROM status WHERE ens=? AND output=? AND cfg=?', (ens, output, cfg))
+    return {key for key in changed if key in grid}
+
+
+def cfg_state(parts: list, facts: list) -> str:
+    '''state of one (output, cfg) from the expected part suffixes and its (part, state, job_id) facts'''
+    done = {part for part, state, _ in facts if state == 'done'}
+    if '' in done or set(parts) <= done:
+        return 'done'
+    jobs = [(job_order(job_id), state) for _, state, job_id in facts if job_id]
+    if jobs:
+        state = max(jobs)[1]
+        return QUEUE_STATES.get(state, 'failed')
+    states = {state for _, state, _ in facts}
+    if any(state == 'finished' and (part == '' or part not in done) for part, state, _ in facts):
+        return 'failed'
+    if 'started' in states:
+        return 'running'
+    if 'generated' in states:
+        return 'generated'
+    return 'missing'
+
+
+def job_order(job_id: str) -> tuple:
+    '''sort key of slurm job ids, array tasks 123_4 after their job 123'''
+    return tuple(int(n) if n.isdigit() else 0 for n in job_id.split('_'))
+
+
+def update_status(conn: sqlite3.Connection, ens: str, keys) -> int:
+    for output, cfg in keys:
+        row = conn.execute('SELECT parts FROM grid WHERE ens=? AND output=? AND cfg=?', (ens, output, cfg)).fetchone()
+        if row is None:
+            continue  # output of a configuration outside cfg_i..cfg_f
+        facts = conn.execute('SELECT part, state, job_id FROM facts WHERE ens=? AND output=? AND cfg=?',
+                             (ens, output, cfg)).fetchall()
+        conn.execute('INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?)', (ens, output, cfg, cfg_state(row[0].split(' '), facts)))
+    return len(keys)
+
+
+def scan_ensemble(conn: sqlite3.Connection, yaml_file: str) -> Scan:
+    dataMap = completeness.load_ensemble_data(yaml_file)
+    ens = dataMap['ens_short']
+    conn.execute('INSERT OR REPLACE INTO ensembles VALUES (?, ?, ?, ?, ?)',
+                 (ens, os.path.abspath(yaml_file), os.path.abspath(dataMap['launch_path']), dataMap['cfg_d'], time.time()))
+    scan = Scan(conn, dataMap)
+    for directory, source, parse, depth in sources(dataMap):
+        scan.walk(directory, None, source, parse, depth)
+    update_status(conn, ens, scan.touched | update_grid(conn, dataMap))
+    return scan
+
+
+def queue_jobs(command: str) -> list:
+    '''(job_id, state, rest of the line) of the jobs a squeue/sacct-like command prints as jobid|state|...'''
+    result = subprocess.run(shlex.split(command), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"{command} failed: {result.stderr.strip()}")
+    jobs = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) >= 3 and fields[0]:
+            jobs.append((fields[0], fields[1].split()[0] if fields[1].strip() else '', ' '.join(fields[2:])))
+    return jobs
+
+
+def match_job(rest: str, launch_paths: dict, data: dict):
+    '''(ens, outputs, cfg, part) of a job from the launch script in its command, or its -J name'''
+    for token in rest.split():
+        if not token.endswith('.sh'):
+            continue
+        path = os.path.abspath(token)
+        for ens, launch_path in launch_paths.items():
+            if path.startswith(launch_path + os.sep):
+                facts = ini_facts(data[ens], path, os.path.basename(path))
+                if facts:
+                    return ens, [fact[0] for fact in facts], facts[0][1], facts[0][2]
+    for name in rest.split():
+        for ens in launch_paths:
+            match = re.match(rf'^{re.escape(ens)}_(?P<task>{walltime.TASK_RE})_cfg(?P<cfg>\d+){walltime.PART_RE}$', name)
+            if match:
+                return ens, task_outputs(data[ens], match['task']), int(match['cfg']), match['part'] or ''
+    return None
+
+
+def scan_queue(conn: sqlite3.Connection, source: str, command: str, data: dict) -> int:
+    '''replace the jobs of one queue source; returns the number matched to a configuration'''
+    launch_paths = {ens: os.path.abspath(dataMap['launch_path']) for ens, dataMap in data.items()}
+    touched = {ens: set() for ens in data}
+    for ens, output, cfg in conn.execute('SELECT ens, output, cfg FROM facts WHERE dir=?', (source,)).fetchall():
+        touched.setdefault(ens, set()).add((output, cfg))
+    conn.execute('DELETE FROM facts WHERE dir=? AND ens IN (%s)' % ','.join('?' * len(data)), (source, *data))
+    matched = 0
+    for job_id, state, rest in queue_jobs(command):
+        job = match_job(rest, launch_paths, data)
+        if job is None:
+            continue
+        ens, outputs, cfg, part = job
+        matched += 1
+        for output in outputs:
+            conn.execute('INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (ens, source, job_id, output, cfg, part, state, job_id))
+            touched[ens].add((output, cfg))
+    for ens, keys in touched.items():
+        update_status(conn, ens, keys)
+    return matched
+
+
+def summary(conn: sqlite3.Connection, ens: str = None) -> dict:
+    '''ensemble -> output -> state -> number of configurations'''
+    query = 'SELECT ens, output, state, count(*) FROM status'
+    rows = conn.execute(query + (' WHERE ens=?' if ens else '') + ' GROUP BY ens, output, state', (ens,) if ens else ())
+    counts = {}
+    for ens_short, output, state, n in rows:
+        counts.setdefault(ens_short, {}).setdefault(output, {})[state] = n
+    return counts
+
+
+def cfgs_in_state(conn: sqlite3.Connection, state: str, ens: str = None, output: str = None) -> dict:
+    '''(ensemble, output) -> sorted cfgs in a state'''
+    query = 'SELECT ens, output, cfg FROM status WHERE state=?'
+    params = [state]
+    for column, value in (('ens', ens), ('output', output)):
+        if value:
+            query += f' AND {column}=?'
+            params.append(value)
+    cfgs = {}
+    for ens_short, out, cfg in conn.execute(query + ' ORDER BY ens, output, cfg', params):
+        cfgs.setdefault((ens_short, out), []).append(cfg)
+    return cfgs
+
+
+def print_summary(conn: sqlite3.Connection, ens: str = None, verbose: bool = False) -> None:
+    counts = summary(conn, ens)
+    for ens_short, outputs in sorted(counts.items()):
+        print(f"{ens_short}:")
+        print(f"  {'output':<14}" + ''.join(f'{state:>10}' for state in STATES))
+        for output in completeness.OUTPUTS:
+            if output in outputs and (verbose or set(outputs[output]) != {'missing'}):
+                print(f"  {output:<14}" + ''.join(f'{outputs[output].get(state, 0):>10}' for state in STATES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the state of every configuration of a campaign and query it.")
+    parser.add_argument('mode', choices=['scan', 'summary', 'list'], help='update the index, count the states, or list the cfgs in a state')
+    parser.add_argument('--db', type=str, default=DB_FILE, help='SQLite index (default: %(default)s)')
+    parser.add_argument('--ini', type=str, help='scan: ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='scan: directory of ensemble YAML files')
+    parser.add_argument('--squeue', type=str, nargs='?', const=SQUEUE, help=f'scan: read the queued and running jobs from squeue, or from a command printing the same columns (default command: {SQUEUE.replace("%", "%%")})')
+    parser.add_argument('--sacct', type=str, nargs='?', const=SACCT, help=f'scan: read the finished jobs from sacct, or from a command printing the same columns (default command: {SACCT.replace("%", "%%")})')
+    parser.add_argument('--ens', type=str, help='summary/list: only this ensemble')
+    parser.add_argument('--output', type=str, choices=list(completeness.OUTPUTS), help='list: only this output type')
+    parser.add_argument('--state', type=str, choices=STATES, default='failed', help='list: state of the cfgs to list (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='summary: also show the outputs with nothing generated')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    if args.mode == 'scan':
+        if not (args.ini or args.ini_dir):
+            parser.error("scan needs one of --ini or --ini_dir")
+        if args.ini_dir:
+            yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                                for file in files if file.endswith(('.yml', '.yaml')))
+        else:
+            yaml_files = [args.ini]
+        data = {}
+        for yaml_file in yaml_files:
+            start = time.perf_counter()
+            with conn:
+                scan = scan_ensemble(conn, yaml_file)
+            data[scan.ens] = scan.dataMap
+            print(f"{scan.ens}: {scan.listed} of {scan.dirs} directories listed, {scan.parsed} files read, "
+                  f"{len(scan.touched)} outputs changed in {time.perf_counter() - start:.2f} s")
+        for source, command in (('sacct', args.sacct), ('squeue', args.squeue)):
+            if command:
+                with conn:
+                    print(f"{source}: {scan_queue(conn, source, command, data)} jobs matched")
+        return
+    if args.mode == 'summary':
+        print_summary(conn, args.ens, args.verbose)
+        return
+    cfg_d = dict(conn.execute('SELECT ens, cfg_d FROM ensembles'))
+    for (ens, output), cfgs in cfgs_in_state(conn, args.state, args.ens, args.output).items():
+        print(f"{ens} {output}: {len(cfgs)} {args.state}: cfg {completeness.compress_ranges(cfgs, cfg_d.get(ens, 1))}")
+
+
+if __name__ == '__main__':
+    main()
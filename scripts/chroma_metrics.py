@@ -0,0 +1,241 @@
+'''solver and timing metrics of chroma runs, streamed out of out.xml, log and stdout files
+
+The out.xml and xml log files of PROP_AND_MATELEM_DISTILLATION_SUPERB and
+MESON_MATELEM_COLORVEC_SUPERB are read with iterparse and every element is
+cleared once closed, so memory stays constant whatever the file size. Any
+element whose children carry iteration counts, residuals, timings or GFLOPS
+(n_count, resid, seconds, gflops, ...) becomes one row named after the element,
+with the t_source seen last. Chroma/QUDA stdout in chroma_out is read line by
+line with the regexes below. Files are parsed in parallel and the rows are
+written as one columnar table:
+
+    python -m scripts.chroma_metrics --ini ens/a125m400.yml -o a125m400_metrics.npz
+'''
+import argparse
+import csv
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts import binpack, completeness, walltime
+
+COLUMNS = ['cfg', 'task', 'flavor', 't_source', 'kind', 'iterations', 'residual', 'seconds', 'gflops', 'source']
+NUMERIC = {'cfg': int, 't_source': int, 'iterations': int, 'residual': float, 'seconds': float, 'gflops': float}
+# lower-cased leaf element names -> column
+XML_FIELDS = {
+    'n_count': 'iterations', 'iterations': 'iterations', 'iters': 'iterations', 'ncg_had': 'iterations',
+    'resid': 'residual', 'rsd': 'residual', 'relative_resid': 'residual',
+    'seconds': 'seconds', 'secs': 'seconds', 'time': 'seconds', 'total_time': 'seconds', 'elapsed_time': 'seconds',
+    'gflops': 'gflops',
+}
+T_SOURCE_TAGS = ('t_source', 't_slice', 't0')
+NUMBER = r'([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)'
+TEXT_FIELDS = {
+    'iterations': re.compile(r'(?:at\s+)?(\d+)\s+iterations'),
+    'residual': re.compile(r'(?:relative\s+rsd|relative residual[^=]*|\|r\|/\|b\|)\s*=\s*' + NUMBER, re.I),
+    'seconds': re.compile(r'time[^=]*=\s*' + NUMBER + r'\s*s(?:ecs?)?\b', re.I),
+    'gflops': re.compile(r'gflops(?:/gpu)?\s*=\s*' + NUMBER, re.I),
+}
+TEXT_T_SOURCE = re.compile(r'(?:t_source|source time)\s*[=:]\s*(\d+)', re.I)
+# result directories below data_path/res and the task stem of their files
+TASK_DIRS = {'perams': 'peram', 'meson': 'meson', 'meson2': 'meson2', 'disco': 'disco', 'fused': 'fused'}
+
+
+def new_columns() -> dict:
+    return {column: [] for column in COLUMNS}
+
+
+def add_row(columns: dict, row: dict) -> None:
+    for column in COLUMNS:
+        columns[column].append(row.get(column))
+
+
+def _number(text, kind):
+    try:
+        return kind(float(text.split()[0])) if kind is int else kind(text.split()[0])
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+
+def parse_xml(path: str, base: dict) -> dict:
+    '''rows of an xml file; a truncated file keeps the rows read before the break'''
+    columns = new_columns()
+    stack = []
+    parents = []
+    t_source = None
+    try:
+        for event, elem in ET.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                stack.append({})
+                parents.append(elem)
+                continue
+            fields = stack.pop()
+            parents.pop()
+            tag = elem.tag.lower()
+            if tag in T_SOURCE_TAGS:
+                t_source = _number(elem.text, int)
+            elif tag in XML_FIELDS and stack and not fields:
+                column = XML_FIELDS[tag]
+                value = _number(elem.text, NUMERIC[column])
+                if value is not None:
+                    stack[-1][column] = value
+            elif fields:
+                add_row(columns, dict(base, kind=elem.tag, t_source=t_source, **fields))
+            # drop the closed element from the tree so memory does not grow with the file
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+    except ET.ParseError:
+        pass
+    return columns
+
+
+def parse_text(path: str, base: dict) -> dict:
+    '''rows of a chroma/QUDA stdout file, one per line reporting iterations or a timing'''
+    columns = new_columns()
+    t_source = None
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = TEXT_T_SOURCE.search(line)
+            if match:
+                t_source = int(match[1])
+            fields = {}
+            for column, pattern in TEXT_FIELDS.items():
+                match = pattern.search(line)
+                if match:
+                    fields[column] = NUMERIC[column](float(match[1]))
+            if 'iterations' in fields or 'seconds' in fields:
+                label = line.split(':', 1)[0].strip() if ':' in line else 'solve'
+                add_row(columns, dict(base, kind=label[:40], t_source=t_source, **fields))
+    return columns
+
+
+def parse_file(path: str) -> dict:
+    named = walltime.task_from_name(os.path.basename(path), os.path.basename(os.path.dirname(path)))
+    if named is None:
+        return new_columns()
+    task, cfg = named
+    flavor = binpack.task_kind(task)[1] if task.startswith('peram') else ''
+    base = {'cfg': cfg, 'task': task, 'flavor': flavor, 'source': os.path.basename(path)}
+    try:
+        if path.endswith('.xml') or path.endswith('.log'):
+            return parse_xml(path, base)
+        return parse_text(path, base)
+    except OSError:
+        return new_columns()
+
+
+def _selected(task: str, stems) -> bool:
+    return any(task == stem or task.startswith(stem + '_') for stem in stems)
+
+
+def metric_files(dataMap: dict, task_dirs, stdout: bool = True) -> list:
+    '''out.xml and log files of the selected result directories, plus the chroma stdout files'''
+    stems = [TASK_DIRS[t] for t in task_dirs]
+    paths = []
+    roots = dict.fromkeys(dataMap[key] for key in ('data_path', 'run_path') if dataMap.get(key))
+    for root in roots:
+        for sub in ('out', 'log'):
+            top = os.path.join(root, 'res', sub)
+            if not os.path.isdir(top):
+                continue
+            with os.scandir(top) as it:
+                dirs = [entry for entry in it if entry.is_dir() and _selected(TASK_DIRS.get(entry.name, entry.name), stems)]
+            for entry in dirs:
+                with os.scandir(entry.path) as files:
+                    paths.extend(f.path for f in files if f.is_file())
+        if stdout and os.path.isdir(os.path.join(root, 'chroma_out')):
+            with os.scandir(os.path.join(root, 'chroma_out')) as it:
+                for entry in it:
+                    named = walltime.task_from_name(entry.name, 'chroma_out')
+                    if entry.name.endswith('.out') and named and _selected(named[0], stems):
+                        paths.append(entry.path)
+    return sorted(paths)
+
+
+def extract(paths: list, jobs: int = 8) -> dict:
+    '''rows of all files, parsed by a process pool and concatenated in file order'''
+    columns = new_columns()
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parts = pool.map(parse_file, paths, chunksize=max(1, len(paths) // (4 * jobs)))
+            for part in parts:
+                for column in COLUMNS:
+                    columns[column].extend(part[column])
+    else:
+        for path in paths:
+            part = parse_file(path)
+            for column in COLUMNS:
+                columns[column].extend(part[column])
+    return columns
+
+
+def write_table(path: str, columns: dict) -> None:
+    '''columnar .npz (one array per column, NaN/-1 for missing values) or .csv'''
+    if path.endswith('.npz'):
+        import numpy as np
+        arrays = {}
+        for column in COLUMNS:
+            values = columns[column]
+            if NUMERIC.get(column) is int:
+                arrays[column] = np.array([-1 if v is None else v for v in values], dtype=np.int64)
+            elif NUMERIC.get(column) is float:
+                arrays[column] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                arrays[column] = np.array(['' if v is None else v for v in values], dtype=str)
+        np.savez_compressed(path, **arrays)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*(['' if v is None else v for v in columns[c]] for c in COLUMNS)))
+
+
+def slow_cfgs(columns: dict, top: int = 5) -> dict:
+    '''per task, the cfgs with the longest run (largest timing reported) relative to the task median'''
+    longest = {}
+    for task, cfg, seconds in zip(columns['task'], columns['cfg'], columns['seconds']):
+        if seconds is not None:
+            by_cfg = longest.setdefault(task, {})
+            by_cfg[cfg] = max(by_cfg.get(cfg, 0.0), seconds)
+    result = {}
+    for task, by_cfg in longest.items():
+        values = sorted(by_cfg.values())
+        median = values[len(values) // 2] or 1.0
+        ranked = sorted(by_cfg.items(), key=lambda item: -item[1])[:top]
+        result[task] = [(cfg, seconds, seconds / median) for cfg, seconds in ranked]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract solver iterations, residuals and timings from chroma outputs.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('-t', '--tasks', nargs='+', choices=list(TASK_DIRS), default=['perams', 'meson', 'disco'],
+                        help='Result directories to read (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=str, default='chroma_metrics.csv', help='Table to write, .csv or .npz (default: %(default)s)')
+    parser.add_argument('--no_stdout', action='store_true', help='Only read out.xml and log files, not chroma_out')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Files parsed concurrently (default: %(default)s)')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith('.yml') or file.endswith('.yaml'))
+    else:
+        yaml_files = [args.ini]
+    paths = []
+    for yaml_file in yaml_files:
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        paths.extend(metric_files(dataMap, args.tasks, stdout=not args.no_stdout))
+    columns = extract(paths, args.jobs)
+    write_table(args.output, columns)
+    print(f"Wrote {len(columns['cfg'])} rows from {len(paths)} files: {args.output}")
+    for task, ranked in sorted(slow_cfgs(columns).items()):
+        print(f"  {task} slowest cfgs: " + ', '.join(f"{cfg} ({seconds:.0f}s, {ratio:.1f}x median)" for cfg, seconds, ratio in ranked))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''find missing chroma outputs of an ensemble with one directory listing per output directory
+
+Every output directory is listed once with os.scandir and the file names are parsed
+against the sdb/h5 patterns into a set of present (nvec, cfg, ext) keys, which is
+then diffed against the grid expected from the ensemble yaml.
+'''
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+# type -> (directory under data_path, file name format, extensions written by chroma)
+OUTPUTS = {
+    'eigs': ('eigs_sdb', 'eigs_numvecs{nvec}_cfg{cfg}.{ext}', ('sdb',)),
+    'peram': ('perams_sdb', 'peram_{nvec}_cfg{cfg}{part}.{ext}', ('sdb', 'h5')),
+    'peram_strange': ('perams_strange_sdb', 'peram_{nvec}_cfg{cfg}{part}.{ext}', ('sdb', 'h5')),
+    'peram_charm': ('perams_charm_sdb', 'peram_{nvec}_cfg{cfg}{part}.{ext}', ('sdb', 'h5')),
+    'meson': ('meson_sdb', 'meson-{nvec}_cfg{cfg}{part}.{ext}', ('sdb', 'h5')),
+    'meson2': ('meson2_sdb', 'meson2-{nvec}_cfg{cfg}{part}.{ext}', ('sdb', 'h5')),
+    'disco': ('disco_sdb', 'disco_cfg{cfg}{part}.{ext}', ('sdb',)),
+}
+
+
+def _compile(name_format: str):
+    regex = re.escape(name_format)
+    fields = {'nvec': r'(?P<nvec>\d+)', 'cfg': r'(?P<cfg>\d+)', 'part': r'(?P<part>(?:_mom\d+)?(?:_c\d+)?(?:_t\d+)?)', 'ext': r'(?P<ext>\w+)'}
+    for field, group in fields.items():
+        regex = regex.replace(re.escape('{' + field + '}'), group)
+    return re.compile(regex + '$')
+
+
+PATTERNS = {file_type: _compile(spec[1]) for file_type, spec in OUTPUTS.items()}
+
+
+def file_name(file_type: str, nvec: int, cfg: int, ext: str, part: str = '') -> str:
+    return OUTPUTS[file_type][1].format(nvec=nvec, cfg=f'{cfg:02d}', ext=ext, part=part)
+
+
+def load_ensemble_data(yaml_file: str) -> dict:
+    '''ensemble yaml plus the parameters create_tasks_ens.py derives from the short tag'''
+    from yml_to_xml import ensembles, geometry
+    with open(yaml_file) as f:
+        dataMap = yaml.safe_load(f)
+    ens_short = os.path.splitext(os.path.basename(yaml_file))[0]
+    dataMap.update(ensembles.parse_ensemble(ens_short))
+    for key, value in ensembles.defaults(ens_short).items():
+        dataMap.setdefault(key, value)
+    dataMap['ens_short'] = ens_short
+    geometry.resolve_all(dataMap, warn=None)
+    return dataMap
+
+
+def output_dir(dataMap: dict, file_type: str) -> str:
+    if file_type == 'eigs' and 'eigs_path' in dataMap:
+        return dataMap['eigs_path']
+    return os.path.join(dataMap['data_path'], OUTPUTS[file_type][0])
+
+
+def default_nvecs(dataMap: dict, file_type: str) -> list:
+    '''nvec the generator renders for a type: eigs use num_vecs, perams and mesons use NT'''
+    if file_type == 'eigs':
+        return [dataMap['num_vecs']]
+    if file_type == 'disco':
+        return [0]  # disco loops do not depend on the distillation basis
+    return [dataMap['NT']]
+
+
+def default_parts(dataMap: dict, file_type: str) -> list:
+    '''file name suffixes of the jobs one configuration is split into, e.g. the meson momentum chunks and time slabs'''
+    if file_type in ('meson', 'meson2'):
+        from yml_to_xml import meson_parts
+        return meson_parts.part_suffixes(dataMap, file_type)
+    if file_type.startswith('peram'):
+        from yml_to_xml import peram_parts
+        return peram_parts.shard_suffixes(dataMap)
+    if file_type == 'disco':
+        from yml_to_xml import disco_parts
+        return disco_parts.shard_suffixes(dataMap)
+    return ['']
+
+
+def cfg_grid(dataMap: dict) -> range:
+    return range(dataMap['cfg_i'], dataMap['cfg_f'], dataMap['cfg_d'])
+
+
+def scan_dir(directory: str, pattern) -> set:
+    '''present (nvec, cfg, ext, part) keys in a directory from a single listing'''
+    present = set()
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                match = pattern.match(entry.name)
+                if match:
+                    groups = match.groupdict()
+                    present.add((int(groups.get('nvec') or 0), int(match['cfg']), match['ext'], groups.get('part') or ''))
+    except FileNotFoundError:
+        pass
+    return present
+
+
+def compress_ranges(cfgs, step: int) -> str:
+    '''render sorted cfg ids as ranges with a stride, e.g. "11-291/10, 351"'''
+    cfgs = sorted(cfgs)
+    parts = []
+    i = 0
+    while i < len(cfgs):
+        j = i
+        while j + 1 < len(cfgs) and cfgs[j + 1] - cfgs[j] == step:
+            j += 1
+        if j == i:
+            parts.append(f'{cfgs[i]}')
+        else:
+            parts.append(f'{cfgs[i]}-{cfgs[j]}/{step}')
+        i = j + 1
+    return ', '.join(parts)
+
+
+def find_missing(dataMap: dict, file_types, nvecs=None, exts=None, jobs: int = 8, parts: bool = False) -> dict:
+    '''missing cfgs keyed by (type, nvec, ext); the output directories are listed concurrently
+
+    A cfg whose jobs are split into parts (meson momentum chunks, time slabs, disco and peram shards) is
+    missing unless every part, or the file merged from them, is present; with
+    ``parts`` the missing part suffixes of every cfg are returned instead of the
+    list of cfgs.
+    '''
+    file_types = list(file_types)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        listings = pool.map(lambda t: scan_dir(output_dir(dataMap, t), PATTERNS[t]), file_types)
+        present = dict(zip(file_types, listings))
+    cfgs = cfg_grid(dataMap)
+    missing = {}
+    for file_type in file_types:
+        type_exts = [ext for ext in OUTPUTS[file_type][2] if exts is None or ext in exts]
+        type_parts = default_parts(dataMap, file_type)
+        for nvec in nvecs or default_nvecs(dataMap, file_type):
+            for ext in type_exts:
+                by_cfg = {}
+                for cfg in cfgs:
+                    if (nvec, cfg, ext, '') in present[file_type]:
+                        continue
+                    cfg_missing = [part for part in type_parts if (nvec, cfg, ext, part) not in present[file_type]]
+                    if cfg_missing:
+                        by_cfg[cfg] = cfg_missing
+                missing[(file_type, nvec, ext)] = by_cfg if parts else list(by_cfg)
+    return missing
@@ -1,131 +1,147 @@
-'''just recycling other chroma input file generation script to generate binned srun tasks (serial) for perams and mesons in groups of 4'''
+'''pack the chroma tasks of many configurations into multi-GPU, multi-node slurm allocations
+
+The per-config ini files are the ones written by create_tasks_ens.py; this script only
+writes the binned launch scripts. Configurations are packed by estimated cost (lattice
+volume, nvec, t_sources, flavor, calibrated on the *_chroma_minutes of the ensemble
+yaml) onto lanes of GPUs within the walltime limit, see scripts/binpack.py.
+
+    python -m scripts.create_binned_tasks --in_file ens/a125m400.yml --cfg_i 11 --cfg_f 2000 \
+        --cfg_step 10 -l peram_mg_light meson --nodes 1 --walltime 720 --run_dir ../ini-binned
+'''
 import argparse
 import os
 import jinja2
-import yaml
-from yml_to_xml import perams_xml, meson_xml, chroma_sh_xml
 
-PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
-FDIR = os.path.dirname(os.path.realpath(__file__))
+from scripts import binpack, completeness, workflow_dag
+
+FDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 TEMPLATE = os.path.join(FDIR, 'templates')
-RESULTPATH = os.path.join(FDIR, 'res')
-OUTPATH = os.path.join(RESULTPATH, 'out')
-LOGPATH = os.path.join(RESULTPATH, 'log')
-
-class TaskHandler:
-    def __init__(self, env):
-        self.templates = { 
-            'chroma_peram': env.get_template('peram_mg_binned.sh.j2'),
-            'chroma_peram_strange': env.get_template('peram_strange_mg_binned.sh.j2'),
-            'chroma_peram_charm': env.get_template('peram_charm_mg_binned.sh.j2'),
-            'chroma_meson': env.get_template('meson_binned.sh.j2'),
-        }
-        self.xml_classes = {
-            'chroma_meson': chroma_sh_xml.ChromaOptions,
-            'chroma_peram': chroma_sh_xml.ChromaOptions,
-            'chroma_peram_strange': chroma_sh_xml.ChromaOptions,
-            'chroma_peram_charm': chroma_sh_xml.ChromaOptions,
-
-        }
+
+# task names accepted by earlier versions of this script
+LEGACY_TASKS = {
+    'chroma_peram': 'peram_mg_light',
+    'chroma_peram_strange': 'peram_mg_strange',
+    'chroma_peram_charm': 'peram_mg_charm',
+    'chroma_meson': 'meson',
+}
+
+
+def task_runs(dataMap, task, cfg_id, part=''):
+    '''ini, out, log and stdout paths of one chroma instance, laid out like create_tasks_ens.py'''
+    obj, task_dir, _, upstream = workflow_dag.task_spec(task)
+    data_path = dataMap['data_path']
+    name = f'{workflow_dag.safe_name(task)}_cfg{cfg_id:02d}{part}'
+    return {
+        'cfg_id': f'{cfg_id:02d}',
+        'part': part,
+        # staged to stage_dir before the run if the task reads the eigs
+        'eigs': os.path.join(completeness.output_dir(dataMap, 'eigs'), f"eigs_numvecs{dataMap['num_vecs']}_cfg{cfg_id:02d}.sdb") if upstream == 'eigs' else '',
+        'ini': os.path.join(dataMap['launch_path'], task_dir, f'cnfg{cfg_id:02d}', f'{obj}_cfg{cfg_id:02d}{part}.ini.xml'),
+        'out': os.path.join(data_path, 'res', 'out', workflow_dag.safe_name(task), f'{name}.out.xml'),
+        'log': os.path.join(data_path, 'res', 'log', workflow_dag.safe_name(task), f'{name}.log'),
+        'stdout': os.path.join(data_path, 'chroma_out', f'{name}.out'),
+    }
+
+
+def task_parts(dataMap, task):
+    '''(file name suffix, fraction of the work) of the jobs one configuration is split into'''
+    if task in ('meson', 'meson2'):
+        from yml_to_xml import meson_parts
+        return [(part['part_suffix'], part['meson_part_share']) for part in meson_parts.meson_parts(dataMap, task)]
+    if task == 'disco':
+        from yml_to_xml import disco_parts
+        shards = disco_parts.disco_shards(dataMap)
+        work = [shard['disco_num_colors'] * len(shard['disco_t_sources'].split()) for shard in shards]
+        return [(shard['part_suffix'], w / sum(work)) for shard, w in zip(shards, work)]
+    if task.startswith('peram'):
+        from yml_to_xml import peram_parts
+        shards = peram_parts.peram_shards(dataMap)
+        work = [len(shard['prop_t_source_list'].split()) for shard in shards]
+        return [(shard['part_suffix'], w / sum(work)) for shard, w in zip(shards, work)]
+    return [('', 1.0)]
+
+
+def lane_geometry(dataMap, task, gpus):
+    '''the yaml geometry of the task if it matches the lane size, else the best one for the lane, see yml_to_xml/geometry.py'''
+    from yml_to_xml import geometry
+    kind, _ = binpack.task_kind(task)
+    prefix = binpack.TASK_PREFIX[kind]
+    return geometry.resolve(dataMap, prefix, dataMap.get(f'{prefix}_chroma_geometry'), n_ranks=gpus, warn=None)
+
 
 def main(options):
-    with open(os.path.join(options.in_file)) as f:
-        dataMap = yaml.safe_load(f)
-    missing_values = [key for key in ['run_path', 'cfg_path'] if key not in dataMap]
-
-    if missing_values:
-        for key in missing_values:
-            value = input(f"you forgot to include '{key}' in your infile dummy!: ")
-            dataMap[key] = value
-
-        with open(options.in_file, 'w') as f:
-            yaml.safe_dump(dataMap, f)
-
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE), undefined=jinja2.StrictUndefined)
-    handler = TaskHandler(env)
-    run_objects = []
-    for task in options.list_tasks:
-        if 'peram' in task:
-            run_objects.append('chroma_peram')
-        if 'peram_strange' in task:
-            run_objects.append('chroma_peram_strange')
-        if 'peram_charm' in task:
-            run_objects.append('chroma_peram_charm')
-        if 'meson' in task:
-            run_objects.append('chroma_meson')
-    cfg_step=50
-    group_size=4 # change this number of in files per slurm script
-    devices = [0, 1, 2, 3]  # Assuming 4 GPUs are available
-
-    for cfg_group_start in range(options.cfg_i, options.cfg_f, cfg_step * group_size):
-        cfg_group_end = min(cfg_group_start + cfg_step *(group_size-1), options.cfg_f)
-        cfg_ids = range(cfg_group_start, cfg_group_end + cfg_step, cfg_step)
-        cfg_group_name = f'cfgs_{cfg_group_start}-{cfg_group_end}'
-        print(f'Creating scripts and directories for configuration group {cfg_group_name}')
-        
-        group_dir = os.path.join(options.run_dir, cfg_group_name)
-        print(os.path.realpath(group_dir))
-        os.makedirs(group_dir, exist_ok=True)
-
-        for nvec in options.num_vecs:
-            nvec_dir = os.path.join(group_dir, f'numvec{nvec}')
-            # print(os.path.realpath(nvec_dir))
-            os.makedirs(nvec_dir, exist_ok=True)
-
-            for obj in run_objects:
-                if obj.startswith('chroma_'):
-                    _obj = obj[len('chroma_'):]
-                    ini_out = f'{_obj}_{nvec}_cfgs_{cfg_group_start}-{cfg_group_end}.sh'
-                    ini_path = os.path.join(nvec_dir,ini_out)
-                    cfg_ids_and_devices = list(zip(cfg_ids, devices))
-                    # print(ini_path)
-                else:
-                    for cfg_id in cfg_ids:
-                        ini_out = f'{obj}_{nvec}_cfg_{cfg_id}.ini.xml'
-                        ini_path = os.path.join(nvec_dir, ini_out)
-                        print(ini_path)
-                
-
-                with open(options.in_file) as f:
-                    dataMap = yaml.safe_load(f)
-
-                    if obj in options.list_tasks:
-                        base = handler.xml_classes[obj]
-                        # if dataMap['facility'] in ['jureca', 'juwels']:
-                        #     expected_keys = base.__fields__.keys()
-                        # else:
-                        expected_keys = base.model_fields.keys()
-                        filtered_data = {k: v for k, v in dataMap.items() if k in expected_keys}
-                        # filtered_data['cfg_id'] = f'{cfg_id:02d}'
-                        filtered_data['cfg_ids'] = cfg_ids
-                        filtered_data['cfg_ids_and_devices'] = cfg_ids_and_devices
-                        filtered_data['cfg_group_start'] = cfg_group_start
-                        filtered_data['cfg_group_end'] = cfg_group_end
-
-                        moms = meson_xml._gen_mom_list()
-                        disp = meson_xml._displacement_list()
-                        filtered_data['momentum_list'] = moms
-                        filtered_data['displacement_list'] = disp
-                        # default value in yml file is overridden by the nvec loop for nvec study
-                        filtered_data['num_vecs_perams'] = nvec
-                        filtered_data['meson_nvec'] = nvec
-                        ens_props = chroma_sh_xml.parse_ensemble(short_tag=filtered_data['ens_short'])
-                        filtered_data.update(ens_props)
-                        output_xml = handler.templates[obj].render(filtered_data)
-                        
-                        print(f"Writing file {ini_path} for object {obj}")
-                        
-                        with open(ini_path, 'w') as f:
-                            f.write(output_xml)
+    dataMap = completeness.load_ensemble_data(options.in_file)
+    dataMap.setdefault('num_vecs_perams', dataMap['NT'])
+    dataMap.setdefault('stage_dir', None)
+    dataMap['project_dir'] = FDIR
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE), undefined=jinja2.StrictUndefined,
+                             trim_blocks=True, lstrip_blocks=True)
+    template = env.get_template('binned.sh.j2')
+    cfg_step = options.cfg_step or dataMap['cfg_d']
+    cfg_ids = range(options.cfg_i, options.cfg_f, cfg_step)
+    tasks = [LEGACY_TASKS.get(task, task) for task in options.list_tasks]
+
+    for nvec in options.num_vecs or [dataMap['NT']]:
+        nvec_dir = os.path.join(options.run_dir, f'numvec{nvec}')
+        os.makedirs(nvec_dir, exist_ok=True)
+        for task in tasks:
+            kind, _ = binpack.task_kind(task)
+            memory = binpack.memory_bytes(kind, dataMap['NL'], dataMap['NT'], nvec, dataMap.get('max_rhs', 1))
+            gpus = options.gpus_per_instance or binpack.gpus_per_instance(memory, options.gpus_per_node, options.gpu_mem)
+            minutes = binpack.instance_minutes(dataMap, task, nvec, gpus, options.gpus_per_node) * options.margin
+            instances = [binpack.Instance(task, cfg_id, minutes * fraction, gpus, part)
+                         for cfg_id in cfg_ids for part, fraction in task_parts(dataMap, task)]
+            allocations = binpack.pack(instances, options.nodes, options.gpus_per_node, options.walltime)
+            packing_report = binpack.report(allocations)
+            print(f"{dataMap['ens_short']} {task} nvec {nvec}: {len(instances)} instances of "
+                  f"{max(i.minutes for i in instances):.0f} min on {gpus} GPU(s)")
+            print(packing_report)
+
+            for alloc_id, allocation in enumerate(allocations):
+                ini_path = os.path.join(nvec_dir, f'{workflow_dag.safe_name(task)}_{nvec}_alloc{alloc_id:03d}.sh')
+                if os.path.exists(ini_path) and not options.overwrite:
+                    print(f"Skipping {ini_path} (already exists, overwrite=False)")
+                    continue
+                lanes = []
+                for lane, lane_instances in enumerate(allocation.lanes):
+                    node, devices = allocation.lane_devices(lane, options.gpus_per_node)
+                    runs = [task_runs(dataMap, task, inst.cfg_id, inst.part)
+                            for inst in sorted(lane_instances, key=lambda i: (i.cfg_id, i.part))]
+                    if runs:
+                        lanes.append({'node': node, 'devices': devices, 'runs': runs})
+                filtered_data = dict(dataMap)
+                filtered_data.update({
+                    'task': task,
+                    'task_name': workflow_dag.safe_name(task),
+                    'alloc_id': f'{alloc_id:03d}',
+                    'nodes': allocation.nodes,
+                    'minutes': allocation.minutes,
+                    'gpus_per_node': options.gpus_per_node,
+                    'geometry': lane_geometry(dataMap, task, gpus),
+                    'lanes': lanes,
+                    'packing_report': binpack.report([allocation]),
+                })
+                with open(ini_path, 'w') as f:
+                    f.write(template.render(filtered_data))
+            with open(os.path.join(nvec_dir, f'{workflow_dag.safe_name(task)}_{nvec}_packing.txt'), 'w') as f:
+                f.write(packing_report + '\n')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--in_file', type=str, required=True)
     parser.add_argument('--cfg_i', type=int, required=True)
     parser.add_argument('--cfg_f', type=int, required=True)
-    parser.add_argument('--cfg_step', type=int, nargs='?', default=10, help='default: %(default)s')
-    parser.add_argument('-l', '--list_tasks', nargs='+', help='<Required> Set flag', required=True)
-    parser.add_argument('-nv', '--num_vecs', nargs='+', help='<Required> number of eigenvectors to use for perams and mesons, must match', required=True, type=int)
-    parser.add_argument('--overwrite', type=bool, nargs='?', default=False, help='if true, overwrite existing xml and sh scripts for chroma task of interest')
+    parser.add_argument('--cfg_step', type=int, nargs='?', default=None, help='default: cfg_d of the ensemble yaml')
+    parser.add_argument('-l', '--list_tasks', nargs='+', help='<Required> tasks as in create_tasks_ens.py, e.g. peram_mg_light meson', required=True)
+    parser.add_argument('-nv', '--num_vecs', nargs='+', help='number of eigenvectors to use for perams and mesons (default: NT, as create_tasks_ens.py)', type=int)
+    parser.add_argument('--overwrite', action='store_true', help='overwrite existing binned scripts')
     parser.add_argument('--run_dir', default='', help='default: %(default)s')
+    parser.add_argument('--nodes', type=int, default=1, help='nodes per allocation (default: %(default)s)')
+    parser.add_argument('--gpus_per_node', type=int, default=4, help='default: %(default)s')
+    parser.add_argument('--gpu_mem', type=float, default=40, help='memory per GPU in GB (default: %(default)s)')
+    parser.add_argument('--gpus_per_instance', type=int, default=None, help='GPUs per chroma instance (default: smallest power of two that fits in memory)')
+    parser.add_argument('--walltime', type=float, default=720, help='walltime limit per allocation in minutes (default: %(default)s)')
+    parser.add_argument('--margin', type=float, default=1.2, help='safety factor on the estimated instance walltime (default: %(default)s)')
     options = parser.parse_args()
-    main(options)
\ No newline at end of file
+    main(options)
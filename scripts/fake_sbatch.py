@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+'''stand-in for sbatch to exercise submit plans without a slurm cluster
+
+Prints an incrementing job id like `sbatch --parsable` and appends every call to
+$FAKE_SBATCH_LOG (default ./fake_sbatch.log), so dependency chains can be checked.
+'''
+import os
+import sys
+
+
+def main():
+    log = os.environ.get('FAKE_SBATCH_LOG', 'fake_sbatch.log')
+    job_id = 1000
+    if os.path.exists(log):
+        with open(log) as f:
+            job_id += sum(1 for _ in f)
+    with open(log, 'a') as f:
+        f.write(f"{job_id} {' '.join(sys.argv[1:])}\n")
+    if '--parsable' in sys.argv:
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+
+
+if __name__ == '__main__':
+    main()
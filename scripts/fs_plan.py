@@ -0,0 +1,101 @@
+'''plan the directories and files of a generation run before touching the filesystem
+
+On Lustre/GPFS every stat, exists and mkdir is a round trip to the metadata server.
+The planner collects all directories and target files first, lists each parent
+directory once with os.scandir to learn what already exists, and creates only the
+missing directories, each exactly once. It also counts the metadata operations.
+'''
+import os
+
+
+class FsPlan:
+    def __init__(self):
+        self.dirs = set()
+        self.targets = []
+        self.missing_dirs = []
+        self.existing_files = set()
+        self.scan_ops = 0
+        self.stat_ops = 0
+        self.mkdir_ops = 0
+        self._listings = {}
+        self._isdir = {}
+
+    def add_dir(self, path: str, root: str = None) -> None:
+        '''plan a directory and every intermediate directory below root'''
+        path = os.path.normpath(path)
+        root = os.path.normpath(root) if root else None
+        while path not in self.dirs:
+            self.dirs.add(path)
+            if root is None or path == root or not path.startswith(root + os.sep):
+                break
+            path = os.path.dirname(path)
+
+    def add_target(self, path: str, root: str = None) -> None:
+        path = os.path.normpath(path)
+        self.targets.append(path)
+        self.add_dir(os.path.dirname(path), root)
+
+    def _listing(self, path: str):
+        '''names in a directory, None if it does not exist; one scandir per directory'''
+        if path not in self._listings:
+            self.scan_ops += 1
+            try:
+                with os.scandir(path) as it:
+                    self._listings[path] = {entry.name for entry in it}
+            except (FileNotFoundError, NotADirectoryError):
+                self._listings[path] = None
+        return self._listings[path]
+
+    def _exists(self, path: str) -> bool:
+        parent, name = os.path.split(path)
+        if parent not in self.dirs:
+            # top of a planned tree: a single stat instead of listing a shared parent
+            # such as the scratch root, which can hold thousands of entries
+            if path not in self._isdir:
+                self.stat_ops += 1
+                self._isdir[path] = os.path.isdir(path)
+            return self._isdir[path]
+        if not self._exists(parent):
+            return False
+        listing = self._listing(parent)
+        return listing is not None and name in listing
+
+    def scan(self) -> None:
+        '''find the missing directories and the target files that already exist'''
+        self.missing_dirs = sorted(d for d in self.dirs if not self._exists(d))
+        missing = set(self.missing_dirs)
+        for path in self.targets:
+            parent, name = os.path.split(path)
+            if parent in missing:
+                continue
+            listing = self._listing(parent)
+            if listing is not None and name in listing:
+                self.existing_files.add(path)
+
+    def create_dirs(self) -> None:
+        '''create every missing directory once, parents before children'''
+        created = set()
+        for path in self.missing_dirs:
+            parent = os.path.dirname(path)
+            if parent in created or self._exists(parent):
+                os.mkdir(path)
+                self.mkdir_ops += 1
+            else:
+                os.makedirs(path, exist_ok=True)
+                self.mkdir_ops += path.count(os.sep)
+            created.add(path)
+
+    @property
+    def metadata_ops(self) -> int:
+        return self.scan_ops + self.stat_ops + self.mkdir_ops
+
+    def report(self, name: str, max_lines: int = 20) -> None:
+        new_files = len(self.targets) - len(self.existing_files)
+        print(f"Plan for {name}: {len(self.dirs)} directories ({len(self.missing_dirs)} to create), "
+              f"{len(self.targets)} target files ({len(self.existing_files)} exist, {new_files} new)")
+        for path in self.missing_dirs[:max_lines]:
+            print(f"  mkdir {path}")
+        if len(self.missing_dirs) > max_lines:
+            print(f"  ... and {len(self.missing_dirs) - max_lines} more directories")
+        print(f"  metadata ops: {self.scan_ops} scandir + {self.stat_ops} stat + {len(self.missing_dirs)} mkdir "
+              f"(per-file checks would need {len(self.targets) * 2 + len(self.dirs)})")
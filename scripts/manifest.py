@@ -0,0 +1,60 @@
+'''per launch_path manifest of generated files for incremental regeneration
+
+Every rendered xml/sh file is recorded with a hash of its render inputs and a hash
+of the template source it came from. A file only has to be rewritten when one of
+the two changed, so editing a single yaml key touches only the affected outputs.
+'''
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = '.manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_path(launch_path: str) -> str:
+    return os.path.join(launch_path, MANIFEST_NAME)
+
+
+def load_manifest(launch_path: str) -> dict:
+    '''load the manifest of a launch_path, an empty one if missing or unreadable'''
+    path = manifest_path(launch_path)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'version': MANIFEST_VERSION, 'files': {}, 'ensembles': {}}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'files': {}, 'ensembles': {}}
+    manifest.setdefault('files', {})
+    manifest.setdefault('ensembles', {})
+    return manifest
+
+
+def save_manifest(launch_path: str, manifest: dict) -> None:
+    '''write the manifest atomically so an interrupted run never leaves a truncated file'''
+    path = manifest_path(launch_path)
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, sort_keys=True, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def digest_data(data) -> str:
+    '''stable hash of render inputs; key order and non-json types do not matter'''
+    blob = json.dumps(data, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def digest_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def changed_keys(old: dict, new: dict) -> list:
+    '''names of the per-key digests that differ between two ensemble snapshots'''
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def key_digests(dataMap: dict) -> dict:
+    return {k: digest_data(v) for k, v in dataMap.items()}
@@ -0,0 +1,129 @@
+'''reduce the shards of the disconnected loops of a configuration into one result
+
+The disco job of a configuration is a slurm array with one task per (color part,
+time group) shard (yml_to_xml/disco_parts.py). Once every shard sdb is present and
+non-empty:
+
+- with disco_merge_cmd in the ensemble yaml, that command is run to reduce the
+  shards into disco_cfg<cfg>.sdb. It is a format string with {out}, the merged
+  file, and {shards}, the shard files; color parts hold partial sums of the trace
+  and must be added, time groups hold different time slices.
+- without it the shards are kept and disco_cfg<cfg>.shards.json lists each one
+  with its colors and time sources, for the analysis to reduce.
+
+create_tasks_ens.py renders a disco_merge_cfg<cfg>.sh job running this script for
+one configuration, submitted with afterok on the array job.
+
+    python -m scripts.merge_disco_shards --ini ens/a096m300.yml --cfgs 11 21
+'''
+import argparse
+import os
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts import completeness, part_files, verify_outputs
+
+
+def index_path(dataMap: dict, cfg: int) -> str:
+    return os.path.join(completeness.output_dir(dataMap, 'disco'), f'disco_cfg{cfg:02d}.shards.json')
+
+
+def write_index(shards: list, shard_paths: list, out_path: str) -> None:
+    index = {'reduce': 'sum over color parts',
+             'shards': [{'file': os.path.basename(path), 'color_part': shard['color_part'],
+                         'first_color': shard['disco_first_color'], 'num_colors': shard['disco_num_colors'],
+                         't_sources': [int(t) for t in shard['disco_t_sources'].split()]}
+                        for shard, path in zip(shards, shard_paths)]}
+    part_files.write_json(index, out_path)
+
+
+def run_merge(command: str, shard_paths: list, out_path: str) -> str:
+    '''run disco_merge_cmd into a temporary file; returns an error message or an empty string'''
+    tmp_path = out_path + '.tmp'
+    cmd = command.format(out=shlex.quote(tmp_path), shards=' '.join(shlex.quote(p) for p in shard_paths))
+    try:
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        if result.returncode != 0:
+            return (result.stderr.strip().splitlines() or [f'exit code {result.returncode}'])[-1]
+        if not os.path.exists(tmp_path):
+            return f'{os.path.basename(tmp_path)} not written'
+        os.replace(tmp_path, out_path)
+        return ''
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def merge_cfg(dataMap: dict, cfg: int, remove_shards: bool = False) -> str:
+    '''reduce the shards of one configuration; returns a one-line status'''
+    from yml_to_xml import disco_parts
+    shards = disco_parts.disco_shards(dataMap)
+    directory = completeness.output_dir(dataMap, 'disco')
+    merged = os.path.join(directory, completeness.file_name('disco', 0, cfg, 'sdb'))
+    shard_paths = [os.path.join(directory, completeness.file_name('disco', 0, cfg, 'sdb', shard['part_suffix']))
+                   for shard in shards]
+    if shard_paths == [merged]:
+        # a single shard is written under the merged name already
+        return 'merged' if os.path.exists(merged) else 'missing'
+    if os.path.exists(merged) and not any(os.path.exists(path) for path in shard_paths):
+        return 'merged'
+    for path in shard_paths:
+        # the disco sdb is a key/value database, not superbblas storage: no magic to check
+        status, detail = verify_outputs.verify_file(path, 'sdb', magic=None)
+        if status != 'ok':
+            return f'{status}: {os.path.basename(path)}' + (f' ({detail})' if detail else '')
+    command = dataMap.get('disco_merge_cmd')
+    if not command:
+        write_index(shards, shard_paths, index_path(dataMap, cfg))
+        return 'indexed'
+    error = run_merge(command, shard_paths, merged)
+    if error:
+        return f'failed: {error}'
+    if remove_shards:
+        for path in shard_paths:
+            os.remove(path)
+    return 'merged'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduce the shard sdbs of the disco array jobs into one result per configuration.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('--cfgs', nargs='+', type=int, help='Configurations to reduce (default: the whole cfg grid)')
+    parser.add_argument('--remove_shards', action='store_true', help='Delete the shards once disco_merge_cmd succeeded')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Configurations reduced concurrently (default: %(default)s)')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith('.yml') or file.endswith('.yaml'))
+    else:
+        yaml_files = [args.ini]
+    failed = 0
+    for yaml_file in yaml_files:
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        print(f"Processing ensemble: {dataMap['ens_short']}")
+        cfgs = args.cfgs or list(completeness.cfg_grid(dataMap))
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            statuses = list(pool.map(lambda cfg: merge_cfg(dataMap, cfg, args.remove_shards), cfgs))
+        by_status = {}
+        for cfg, status in zip(cfgs, statuses):
+            by_status.setdefault(status.split(':')[0], []).append(cfg)
+        print(f"  disco: {', '.join(f'{len(c)} {s}' for s, c in by_status.items())}")
+        if 'missing' in by_status:
+            print(f"    shards missing: cfg {completeness.compress_ranges(by_status['missing'], dataMap['cfg_d'])}")
+        # cfgs asked for by name come from a finished array job: missing shards are an error there
+        bad = ('truncated', 'corrupt', 'failed') + (('missing',) if args.cfgs else ())
+        for cfg, status in zip(cfgs, statuses):
+            if status.split(':')[0] in bad:
+                print(f"    cfg {cfg}: {status}")
+                failed += 1
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
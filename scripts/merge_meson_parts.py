@@ -0,0 +1,103 @@
+'''combine the part files of split meson jobs back into one file per configuration
+
+Meson jobs split into momentum chunks and time slabs (yml_to_xml/meson_parts.py)
+write one file per part. Once every part of a configuration is present and passes
+the header check of verify_outputs.py:
+
+- h5 parts are copied into meson-<nvec>_cfg<cfg>.h5; groups are merged and a
+  dataset found in more than one part is an error, since parts cover disjoint
+  momenta and time slices. The merged file is written next to the parts under a
+  temporary name and renamed when complete.
+- sdb parts are superbblas storage, which can only be rewritten through
+  superbblas itself; they are kept and meson-<nvec>_cfg<cfg>.parts.json lists
+  them with the momenta and time slices each one holds, for the analysis to read.
+
+    python -m scripts.merge_meson_parts --ini ens/a096m300.yml -t meson --remove_parts
+'''
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts import completeness, part_files, verify_outputs
+
+
+def write_index(parts: list, part_paths: list, out_path: str) -> None:
+    index = {'parts': [{'file': os.path.basename(path), 't_source': part['meson_t_source'],
+                        'Nt_forward': part['meson_t_fwd'], 'momenta': part['momentum_list']}
+                       for part, path in zip(parts, part_paths)]}
+    part_files.write_json(index, out_path)
+
+
+def merge_cfg(dataMap: dict, file_type: str, nvec: int, ext: str, cfg: int, remove_parts: bool = False) -> str:
+    '''merge the parts of one configuration; returns a one-line status'''
+    from yml_to_xml import meson_parts
+    parts = meson_parts.meson_parts(dataMap, file_type)
+    directory = completeness.output_dir(dataMap, file_type)
+    merged = os.path.join(directory, completeness.file_name(file_type, nvec, cfg, ext))
+    part_paths = [os.path.join(directory, completeness.file_name(file_type, nvec, cfg, ext, part['part_suffix']))
+                  for part in parts]
+    if os.path.exists(merged) and not any(os.path.exists(path) for path in part_paths):
+        return 'merged'
+    for path in part_paths:
+        status, detail = verify_outputs.verify_file(path, ext, magic=verify_outputs.SUPERBBLAS_MAGIC)
+        if status != 'ok':
+            return f'{status}: {os.path.basename(path)}' + (f' ({detail})' if detail else '')
+    if ext == 'h5':
+        part_files.merge_h5(part_paths, merged)
+        if remove_parts:
+            for path in part_paths:
+                os.remove(path)
+        return 'merged'
+    write_index(parts, part_paths, os.path.splitext(merged)[0] + '.parts.json')
+    return 'indexed'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the part files of split meson jobs into one file per configuration.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('-t', '--type', nargs='+', choices=['meson', 'meson2'], default=['meson'], help='default: %(default)s')
+    parser.add_argument('--nvecs', nargs='+', type=int, help='nvecs to merge (default: the ones create_tasks_ens.py renders)')
+    parser.add_argument('--ext', nargs='+', choices=['sdb', 'h5'], default=['sdb', 'h5'], help='default: %(default)s')
+    parser.add_argument('--remove_parts', action='store_true', help='Delete the h5 parts once merged')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Configurations merged concurrently (default: %(default)s)')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith('.yml') or file.endswith('.yaml'))
+    else:
+        yaml_files = [args.ini]
+    failed = 0
+    for yaml_file in yaml_files:
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        print(f"Processing ensemble: {dataMap['ens_short']}")
+        for file_type in args.type:
+            if completeness.default_parts(dataMap, file_type) == ['']:
+                print(f"  {file_type}: not split into parts, nothing to merge")
+                continue
+            for nvec in args.nvecs or completeness.default_nvecs(dataMap, file_type):
+                for ext in args.ext:
+                    cfgs = list(completeness.cfg_grid(dataMap))
+                    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+                        statuses = list(pool.map(
+                            lambda cfg: merge_cfg(dataMap, file_type, nvec, ext, cfg, args.remove_parts), cfgs))
+                    by_status = {}
+                    for cfg, status in zip(cfgs, statuses):
+                        by_status.setdefault(status.split(':')[0], []).append(cfg)
+                    summary = ', '.join(f"{len(c)} {s}" for s, c in by_status.items())
+                    print(f"  {file_type} nvec {nvec} {ext}: {summary}")
+                    if 'missing' in by_status:
+                        print(f"    parts missing: cfg {completeness.compress_ranges(by_status['missing'], dataMap['cfg_d'])}")
+                    for cfg, status in zip(cfgs, statuses):
+                        if status.split(':')[0] in ('truncated', 'corrupt'):
+                            print(f"    cfg {cfg}: {status}")
+                            failed += 1
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''check and combine the source time slice shards of the perambulators of a configuration
+
+Peram jobs split by source time slice (yml_to_xml/peram_parts.py) write one
+peram_<nvec>_cfg<cfg>_t<k> file per shard. A configuration is complete when
+
+- the rendered inputs of its shards ask for every source time slice of
+  range(0, prop_t_fwd, num_tsrc) exactly once, with the num_vecs of the
+  ensemble, and
+- every shard file passes the header check of verify_outputs.py and holds at
+  least the payload of its sources times all (4 nvec)^2 spin-vector pairs, i.e.
+  no (t_source, vec) block can be missing from it.
+
+Complete h5 shards are merged into peram_<nvec>_cfg<cfg>.h5 with h5py. sdb shards
+are superbblas storage, which can only be rewritten through superbblas itself;
+they are kept and peram_<nvec>_cfg<cfg>.shards.json lists the sources of each.
+
+    python -m scripts.merge_peram_shards --ini ens/a096m300.yml -l peram_mg_light peram_mg_strange
+'''
+import argparse
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts import completeness, part_files, verify_outputs, workflow_dag
+
+
+def input_sources(path: str, mass_label: str):
+    '''(t_sources, num_vecs) a rendered peram input asks for, for the flavor of a combined input with this mass_label'''
+    for contractions in ET.parse(path).iter('Contractions'):
+        if contractions.findtext('mass_label') == mass_label:
+            return [int(t) for t in contractions.findtext('t_sources').split()], int(contractions.findtext('num_vecs'))
+    raise ValueError(f'no {mass_label} measurement')
+
+
+def check_inputs(dataMap: dict, ini_paths: list, nvec: int, mass_label: str) -> str:
+    '''why the shard inputs do not cover every source time slice once, or an empty string'''
+    from yml_to_xml import peram_parts
+    seen = []
+    for path in ini_paths:
+        try:
+            sources, num_vecs = input_sources(path, mass_label)
+        except (OSError, ET.ParseError, AttributeError, ValueError) as e:
+            return f'unreadable input {os.path.basename(path)}: {e}'
+        if num_vecs != nvec:
+            return f'{os.path.basename(path)} has num_vecs {num_vecs}, not {nvec}'
+        seen.extend(sources)
+    expected = peram_parts.t_sources(dataMap)
+    if sorted(seen) != expected:
+        missing = sorted(set(expected) - set(seen))
+        repeated = sorted({t for t in seen if seen.count(t) > 1})
+        return f'sources missing {missing} repeated {repeated}'
+    return ''
+
+
+def merge_cfg(dataMap: dict, task: str, flavor: str, nvec: int, ext: str, cfg: int, remove_shards: bool = False) -> str:
+    '''check and merge the shards of one flavor of a configuration; returns a one-line status'''
+    from yml_to_xml import peram_parts
+    task_dir = workflow_dag.task_spec(task)[1]
+    file_type = workflow_dag.peram_output_type(flavor)
+    shards = peram_parts.peram_shards(dataMap)
+    directory = completeness.output_dir(dataMap, file_type)
+    merged = os.path.join(directory, completeness.file_name(file_type, nvec, cfg, ext))
+    shard_paths = [os.path.join(directory, completeness.file_name(file_type, nvec, cfg, ext, shard['part_suffix']))
+                   for shard in shards]
+    if os.path.exists(merged) and not any(os.path.exists(path) for path in shard_paths):
+        return 'merged'
+    for shard, path in zip(shards, shard_paths):
+        n_src = len(shard['prop_t_source_list'].split())
+        min_size = verify_outputs.expected_payload(dataMap, file_type, nvec, n_src=n_src)
+        status, detail = verify_outputs.verify_file(path, ext, min_size)
+        if status != 'ok':
+            return f'{status}: {os.path.basename(path)}' + (f' ({detail})' if detail else '')
+    cfg_dir = os.path.join(dataMap['launch_path'], task_dir, f'cnfg{cfg:02d}')
+    error = check_inputs(dataMap, [os.path.join(cfg_dir, f"peram_cfg{cfg:02d}{shard['part_suffix']}.ini.xml")
+                                   for shard in shards], nvec, flavor)
+    if error:
+        return f'invalid: {error}'
+    if ext == 'h5':
+        part_files.merge_h5(shard_paths, merged)
+        if remove_shards:
+            for path in shard_paths:
+                os.remove(path)
+        return 'merged'
+    index = {'shards': [{'file': os.path.basename(path), 't_sources': [int(t) for t in shard['prop_t_source_list'].split()]}
+                        for shard, path in zip(shards, shard_paths)]}
+    part_files.write_json(index, os.path.splitext(merged)[0] + '.shards.json')
+    return 'indexed'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and combine the source time slice shards of peram jobs.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('-l', '--list_tasks', nargs='+', default=['peram_mg_light'], help='Peram tasks as in create_tasks_ens.py, combined ones included (default: %(default)s)')
+    parser.add_argument('--nvecs', nargs='+', type=int, help='nvecs to merge (default: the ones create_tasks_ens.py renders)')
+    parser.add_argument('--ext', nargs='+', choices=['sdb', 'h5'], default=['sdb', 'h5'], help='default: %(default)s')
+    parser.add_argument('--remove_shards', action='store_true', help='Delete the h5 shards once merged')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Configurations merged concurrently (default: %(default)s)')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith('.yml') or file.endswith('.yaml'))
+    else:
+        yaml_files = [args.ini]
+    failed = 0
+    for yaml_file in yaml_files:
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        print(f"Processing ensemble: {dataMap['ens_short']}")
+        if completeness.default_parts(dataMap, 'peram') == ['']:
+            print("  perams not split into shards, nothing to merge")
+            continue
+        for task, (_, flavor) in [(task, flavor) for task in args.list_tasks for flavor in workflow_dag.peram_flavors(task)]:
+            file_type = workflow_dag.peram_output_type(flavor)
+            for nvec in args.nvecs or completeness.default_nvecs(dataMap, file_type):
+                for ext in args.ext:
+                    cfgs = list(completeness.cfg_grid(dataMap))
+                    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+                        statuses = list(pool.map(
+                            lambda cfg: merge_cfg(dataMap, task, flavor, nvec, ext, cfg, args.remove_shards), cfgs))
+                    by_status = {}
+                    for cfg, status in zip(cfgs, statuses):
+                        by_status.setdefault(status.split(':')[0], []).append(cfg)
+                    print(f"  {task} {flavor} nvec {nvec} {ext}: {', '.join(f'{len(c)} {s}' for s, c in by_status.items())}")
+                    if 'missing' in by_status:
+                        print(f"    shards missing: cfg {completeness.compress_ranges(by_status['missing'], dataMap['cfg_d'])}")
+                    for cfg, status in zip(cfgs, statuses):
+                        if status.split(':')[0] in ('truncated', 'corrupt', 'invalid'):
+                            print(f"    cfg {cfg}: {status}")
+                            failed += 1
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
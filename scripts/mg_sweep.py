@@ -0,0 +1,206 @@
+'''benchmark sweep of the perambulator inverter parameters of an ensemble
+
+The multigrid blocking, precisions, pipeline and max_rhs that solve fastest
+depend on the volume and the quark mass. A sweep solves one source time slice
+of one configuration once per grid point, in a single job so all variants run on
+the same nodes, and ranks them by wall time:
+
+    python -m scripts.mg_sweep render --ini ens/a125m400.yml -l peram_mg_light --cfg 11
+    sbatch <run_path>/mg_sweep/peram_mg_light/cfg11/mg_sweep.sh
+    python -m scripts.mg_sweep rank --ini ens/a125m400.yml -l peram_mg_light --cfg 11 --write
+
+render writes variant<i>.ini.xml, variants.json and mg_sweep.sh to the sweep
+directory. The grid is DEFAULT_GRID or a yaml file of lists of values of the
+inverter_params keys (--grid); every other key keeps the value of the ensemble,
+and blockings that do not divide the local lattice of prop_chroma_geometry are
+left out. rank reads the wall time and exit code the job records per variant
+and the solver iterations of its log, and --write stores the fastest parameters
+as inverter_params_<flavor> in the ensemble yaml, where create_tasks_ens.py
+picks them up (yml_to_xml/inverter_params.py).
+'''
+import argparse
+import itertools
+import json
+import os
+
+import yaml
+
+from scripts import chroma_metrics
+
+DEFAULT_GRID = {
+    'blocking': [[[4, 4, 4, 4], [2, 2, 2, 2]], [[2, 2, 2, 2], [2, 2, 2, 2]], [[4, 4, 4, 2], [2, 2, 2, 4]]],
+    'precision': ['HALF', 'SINGLE'],
+    'pipeline': [4, 8],
+    'max_rhs': [4, 8],
+}
+# keys of the clover inverter, the only ones swept for peram_clover_* tasks
+CLOVER_KEYS = ('max_rhs',)
+
+
+def sweep_dir(dataMap: dict, task: str, cfg: int) -> str:
+    return os.path.join(dataMap['run_path'], 'mg_sweep', task, f'cfg{cfg:02d}')
+
+
+def load_grid(path: str = None) -> dict:
+    if not path:
+        return DEFAULT_GRID
+    with open(path) as f:
+        grid = yaml.safe_load(f)
+    if not isinstance(grid, dict) or not all(isinstance(values, list) and values for values in grid.values()):
+        raise ValueError(f"{path}: expected a mapping of parameter names to non-empty lists of values")
+    return grid
+
+
+def variants(dataMap: dict, flavor: str, inverter_type: str, grid: dict) -> tuple:
+    '''(parameter sets of the grid, number left out as not fitting the lattice)'''
+    from yml_to_xml import inverter_params
+    base = inverter_params.inverter_params(dataMap, flavor)
+    unknown = set(grid) - set(base)
+    if unknown:
+        raise ValueError(f"unknown grid parameters {sorted(unknown)}, expected some of {sorted(base)}")
+    if inverter_type != 'mg':
+        grid = {key: values for key, values in grid.items() if key in CLOVER_KEYS}
+    keys = list(grid)
+    found, dropped = [], 0
+    for values in itertools.product(*(grid[key] for key in keys)):
+        params = dict(base, **dict(zip(keys, values)))
+        inverter_params.check(params)
+        if not inverter_params.blocking_fits(dataMap, dataMap['prop_chroma_geometry'], params['blocking']):
+            dropped += 1
+        elif params not in found:
+            found.append(params)
+    return found, dropped
+
+
+def load(yaml_file: str, task: str) -> tuple:
+    '''(render variables, peram job) of a single-flavor peram task'''
+    import create_tasks_ens
+    _, dataMap, _ = create_tasks_ens.load_ensemble(yaml_file, argparse.Namespace(list_tasks=[task]))
+    job = dataMap['peram_jobs'][0]
+    if len(job['peram_flavors']) != 1:
+        raise ValueError(f"{task}: sweep one flavor at a time")
+    return dataMap, job
+
+
+def render(dataMap: dict, job: dict, cfg: int, t_source: int, grid: dict, minutes: float = None) -> str:
+    '''write the variant inputs and the sweep job of a peram job as loaded by load(); returns the sweep directory'''
+    import create_tasks_ens
+    task, flavor, inverter_type = job['peram_task'], job['flavor'], job['inverter_type']
+    found, dropped = variants(dataMap, flavor, inverter_type, grid)
+    if not found:
+        raise ValueError(f"no grid point fits the local lattice of geometry {dataMap['prop_chroma_geometry']}")
+    directory = sweep_dir(dataMap, task, cfg)
+    os.makedirs(directory, exist_ok=True)
+    env = create_tasks_ens.make_env()
+    template = env.get_template(create_tasks_ens.TEMPLATE_FILES['peram'])
+    ids = [f'{i:02d}' for i in range(len(found))]
+    for variant, params in zip(ids, found):
+        peram = dict(job['peram_flavors'][0], inverter=params, output_sdb_path=directory)
+        data = dict(dataMap, cfg_id=f'{cfg:02d}', part_suffix=f'_v{variant}', prop_t_source_list=str(t_source),
+                    peram_flavors=[peram])
+        with open(os.path.join(directory, f'variant{variant}.ini.xml'), 'w') as f:
+            f.write(template.render(data))
+    with open(os.path.join(directory, 'variants.json'), 'w') as f:
+        json.dump({'task': task, 'flavor': flavor, 'cfg': cfg, 't_source': t_source,
+                   'variants': dict(zip(ids, found))}, f, indent=1)
+    # one source time slice of prop_chroma_minutes per variant, with room for slow ones
+    per_variant = minutes or dataMap['prop_chroma_minutes'] * dataMap['num_tsrc'] / dataMap['prop_t_fwd']
+    data = dict(dataMap, peram_task=task, cfg_id=f'{cfg:02d}', t_source=t_source, sweep_dir=directory, variants=ids,
+                sweep_minutes=max(10, round(2 * per_variant * len(ids))))
+    with open(os.path.join(directory, 'mg_sweep.sh'), 'w') as f:
+        f.write(env.get_template('mg_sweep.sh.j2').render(data))
+    print(f"{len(found)} variants of {task} on cfg {cfg} t_source {t_source}"
+          + (f" ({dropped} left out, blocking does not fit the lattice)" if dropped else '') + f": {directory}")
+    return directory
+
+
+def variant_result(directory: str, variant: str) -> dict:
+    '''exit code, wall seconds and solver iterations of one variant; status is ok, failed or not run'''
+    try:
+        with open(os.path.join(directory, f'variant{variant}.status')) as f:
+            code, seconds = f.read().split()
+    except (OSError, ValueError):
+        return {'status': 'not run'}
+    rows = chroma_metrics.new_columns()
+    log = os.path.join(directory, f'variant{variant}.log')
+    if os.path.exists(log):
+        rows = chroma_metrics.parse_xml(log, {})
+    if not any(n is not None for n in rows['iterations']) and os.path.exists(log[:-len('.log')] + '.out'):
+        rows = chroma_metrics.parse_text(log[:-len('.log')] + '.out', {})
+    iterations = [n for n in rows['iterations'] if n is not None]
+    return {'status': 'ok' if int(code) == 0 else 'failed', 'exit': int(code), 'seconds': float(seconds),
+            'iterations': sum(iterations) if iterations else None}
+
+
+def rank(directory: str) -> tuple:
+    '''(sweep description, [(variant, parameters, result)] fastest first, unfinished last)'''
+    with open(os.path.join(directory, 'variants.json')) as f:
+        sweep = json.load(f)
+    results = [(variant, params, variant_result(directory, variant)) for variant, params in sweep['variants'].items()]
+    order = {'ok': 0, 'failed': 1, 'not run': 2}
+    results.sort(key=lambda r: (order[r[2]['status']], r[2].get('seconds') or 0, r[2].get('iterations') or 0))
+    return sweep, results
+
+
+def describe(params: dict) -> str:
+    return (f"blocking {'/'.join('x'.join(map(str, b)) for b in params['blocking'])} nvec {params['null_vectors']} "
+            f"{params['precision']}/{params['sloppy_precision']} pipeline {params['pipeline']} delta {params['delta']} "
+            f"max_rhs {params['max_rhs']}")
+
+
+def write_yaml_key(path: str, key: str, value) -> None:
+    '''set a top-level key of a yaml file, leaving the other lines and their comments as they are'''
+    with open(path) as f:
+        lines = f.read().splitlines(keepends=True)
+    kept, skipping = [], False
+    for line in lines:
+        if line.startswith(f'{key}:'):
+            skipping = True
+            continue
+        if skipping and (line.startswith((' ', '\t')) or not line.strip()):
+            continue
+        skipping = False
+        kept.append(line)
+    if kept and not kept[-1].endswith('\n'):
+        kept[-1] += '\n'
+    kept.append(yaml.safe_dump({key: value}, default_flow_style=None, sort_keys=False))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.writelines(kept)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the inverter parameters of a peram task on one configuration and pick the fastest.")
+    parser.add_argument('mode', choices=['render', 'rank'], help='render the variants and their job, or rank the finished ones')
+    parser.add_argument('--ini', type=str, required=True, help='Ensemble YAML file')
+    parser.add_argument('-l', '--task', type=str, default='peram_mg_light', help='Single-flavor peram task (default: %(default)s)')
+    parser.add_argument('--cfg', type=int, help='Configuration to benchmark on (default: cfg_i of the ensemble)')
+    parser.add_argument('--t_source', type=int, default=0, help='Source time slice solved by every variant (default: %(default)s)')
+    parser.add_argument('--grid', type=str, help='YAML file of parameter lists (default: DEFAULT_GRID of this script)')
+    parser.add_argument('--minutes', type=float, help='Expected minutes per variant (default: prop_chroma_minutes of one source)')
+    parser.add_argument('--write', action='store_true', help='rank: store the fastest parameters as inverter_params_<flavor> in the yaml')
+    args = parser.parse_args()
+
+    dataMap, job = load(args.ini, args.task)
+    cfg = args.cfg if args.cfg is not None else dataMap['cfg_i']
+    if args.mode == 'render':
+        render(dataMap, job, cfg, args.t_source, load_grid(args.grid), args.minutes)
+        return
+    sweep, results = rank(sweep_dir(dataMap, args.task, cfg))
+    print(f"{args.task} cfg {sweep['cfg']} t_source {sweep['t_source']}:")
+    for variant, params, result in results:
+        timing = f"{result['seconds']:8.1f} s" if 'seconds' in result else ' ' * 10
+        iterations = f"{result['iterations']:6d} it" if result.get('iterations') is not None else ' ' * 9
+        print(f"  {variant} {result['status']:8s}{timing} {iterations}  {describe(params)}")
+    best = [params for _, params, result in results if result['status'] == 'ok']
+    if not best:
+        raise SystemExit("no variant finished")
+    if args.write:
+        key = f"inverter_params_{sweep['flavor']}"
+        write_yaml_key(args.ini, key, best[0])
+        print(f"Wrote {key} of variant {results[0][0]} to {args.ini}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+'''helpers shared by the scripts combining the part files of split jobs
+
+h5 parts are merged with h5py, imported only when needed: groups are merged and
+a dataset found in more than one part is an error, since parts hold disjoint
+momenta, time slices or sources. Outputs are written under a temporary name next
+to the target and renamed when complete.
+'''
+import json
+import os
+
+
+def copy_tree(src, dst, path='/') -> None:
+    '''copy the members of an h5 group into another, merging subgroups'''
+    import h5py
+    for name, attr in src.attrs.items():
+        if name not in dst.attrs:
+            dst.attrs[name] = attr
+    for name, obj in src.items():
+        if isinstance(obj, h5py.Group):
+            copy_tree(obj, dst.require_group(name), f'{path}{name}/')
+        elif name in dst:
+            raise ValueError(f'dataset {path}{name} is in more than one part')
+        else:
+            src.copy(obj, dst, name)
+
+
+def merge_h5(part_paths: list, out_path: str) -> None:
+    try:
+        import h5py
+    except ImportError:
+        raise SystemExit("Merging h5 parts needs h5py (pip install h5py)")
+    tmp_path = out_path + '.tmp'
+    try:
+        with h5py.File(tmp_path, 'w') as dst:
+            for part_path in part_paths:
+                with h5py.File(part_path, 'r') as src:
+                    copy_tree(src, dst)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_json(data: dict, out_path: str) -> None:
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, out_path)
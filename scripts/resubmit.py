@@ -0,0 +1,382 @@
+'''resubmit only the jobs of an ensemble that died, never the completed ones
+
+A job killed at its walltime leaves a START stamp without FINISH in its slurm
+output and a partial sdb that passes an existence check, so the submit plan of
+create_tasks_ens.py counts it as done. Every (cfg, task, part) job of the DAG of
+scripts/workflow_dag.py is classified instead from its outputs, checked for size
+and header by scripts/verify_outputs.py, the stamps of its slurm output (the -o of
+its script), the chroma logs and out.xml files, and the slurm errors in its -e:
+
+- completed: every output it writes is ok (or merged from its parts),
+- waiting: an upstream job (the eigs of the configuration) is not completed,
+- timed_out: started but not finished, and slurm cancelled it at its time limit
+  or more than its -t has passed since it started,
+- crashed: finished, or cancelled for another reason, without its outputs, or
+  left a truncated or corrupt file behind,
+- running: started, not finished and still within its -t,
+- not_run: no trace of the job.
+
+The timed out and crashed jobs (and with --not_run those never run) are
+rendered again and resubmitted, together with the waiting jobs depending on them,
+with --dependency=afterok as in the submit plan. Timed out jobs can get a longer
+walltime (--walltime_factor, capped at --max_minutes) or more nodes
+(--nodes_factor, with the -geom solved again by yml_to_xml/geometry.py).
+A disco array job runs again only for the shards whose output is not ok.
+Truncated and corrupt outputs are renamed to *.partial first. The rendered files
+go through the manifest of create_tasks_ens.py, so its next run puts the yaml
+settings back.
+
+    python -m scripts.resubmit --ini ens/a125m400.yml -l eigs peram_mg_light meson --dry_run
+    python -m scripts.resubmit --ini ens/a125m400.yml -l eigs peram_mg_light meson --walltime_factor 1.5 --submit
+'''
+import argparse
+import glob
+import math
+import os
+import re
+from datetime import datetime, timedelta
+
+from scripts import completeness, manifest, slurm_array, verify_outputs, walltime, workflow_dag
+
+CLASSES = ('completed', 'waiting', 'timed_out', 'crashed', 'running', 'not_run')
+TIME_LIMIT = re.compile(r'DUE TO TIME LIMIT')
+SLURM_ERROR = re.compile(r'(?:slurmstepd|srun): error: .*|CANCELLED AT .*|Segmentation fault.*|.*oom[-_]kill.*', re.I)
+# slack between the -t of a job and the last sign of it before it counts as killed
+GRACE_MINUTES = 10
+# slurm output names: %j job id, %a array index, ... -> any
+FILENAME_PATTERN = re.compile(r'%\w')
+
+
+class Trace:
+    '''what the logs of one job say: started, finished, start time and the slurm error'''
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.start = None
+        self.error = None
+
+
+def load(yaml_file: str, tasks: list) -> dict:
+    import create_tasks_ens
+    _, dataMap, _ = create_tasks_ens.load_ensemble(yaml_file, argparse.Namespace(list_tasks=tasks))
+    return dataMap
+
+
+def output_files(dataMap: dict, node) -> list:
+    '''(output type, [alternatives]) of every output of a job; an alternative is a list of (path, ext, min size)
+
+    An output split into parts is also complete once the file merged from them is ok.
+    '''
+    if node.reducer:
+        directory = completeness.output_dir(dataMap, 'disco')
+        merged = os.path.join(directory, f'disco_cfg{node.cfg_id:02d}')
+        return [('disco', [[(merged + '.sdb', 'sdb', 0)], [(merged + '.shards.json', 'json', 0)]])]
+    outputs = []
+    for file_type in workflow_dag.node_output_types(dataMap, node):
+        directory = completeness.output_dir(dataMap, file_type)
+        nvec = completeness.default_nvecs(dataMap, file_type)[0]
+        sizes = dict(verify_outputs.part_sizes(dataMap, file_type))
+        parts = list(sizes) if node.array or node.task in workflow_dag.FUSED_TASKS else [node.part]
+
+        def files(part_list):
+            return [(os.path.join(directory, completeness.file_name(file_type, nvec, node.cfg_id, 'sdb', part)), 'sdb',
+                     verify_outputs.expected_payload(dataMap, file_type, nvec, **sizes.get(part, {})))
+                    for part in part_list]
+
+        alternatives = [files(parts)]
+        if parts != ['']:
+            alternatives.append(files(['']))
+        outputs.append((file_type, alternatives))
+    return outputs
+
+
+def check_outputs(dataMap: dict, node, tolerance: float = 1.0, magic=verify_outputs.SUPERBBLAS_MAGIC) -> tuple:
+    '''(every output ok, [(path, status, detail)] of the truncated and corrupt files)'''
+    complete = True
+    bad = []
+    for _, alternatives in output_files(dataMap, node):
+        ok = False
+        for files in alternatives:
+            statuses = []
+            for path, ext, min_size in files:
+                if ext == 'json':
+                    statuses.append('ok' if os.path.exists(path) else 'missing')
+                    continue
+                status, detail = verify_outputs.verify_file(path, ext, min_size, tolerance, magic)
+                statuses.append(status)
+                if status in ('truncated', 'corrupt'):
+                    bad.append((path, status, detail))
+            ok = ok or all(status == 'ok' for status in statuses)
+        complete = complete and ok
+    return complete, [] if complete else bad
+
+
+def missing_shards(dataMap: dict, node, tolerance: float = 1.0, magic=verify_outputs.SUPERBBLAS_MAGIC) -> list:
+    '''part suffixes of an array job whose output is not ok, in the order of its array indices'''
+    missing = set()
+    for _, alternatives in output_files(dataMap, node):
+        for part, (path, ext, min_size) in zip(node.shards, alternatives[0]):
+            if verify_outputs.verify_file(path, ext, min_size, tolerance, magic)[0] != 'ok':
+                missing.add(part)
+    return [part for part in node.shards if part in missing]
+
+
+def log_paths(script: str) -> tuple:
+    '''(slurm output files, slurm error files, time limit in minutes) of a rendered script'''
+    directives = slurm_array.sbatch_directives(script)
+    found = []
+    for keys in (('-o', '--output'), ('-e', '--error')):
+        pattern = next((directives[key] for key in keys if directives.get(key)), None)
+        found.append(glob.glob(FILENAME_PATTERN.sub('*', pattern)) if pattern else [])
+    return found[0], found[1], slurm_array.parse_limit(directives.get('-t') or directives.get('--time'))
+
+
+def read_stamps(path: str, traces: dict) -> None:
+    '''add the START/FINISH stamps and chroma timings of a log to the traces keyed by (task, cfg, part)'''
+    named = walltime.part_from_name(os.path.basename(path), os.path.basename(os.path.dirname(path)))
+    try:
+        text = walltime.read_ends(path)
+    except OSError:
+        return
+    for match in walltime.STAMP.finditer(text):
+        key = (match['task'], int(match['cfg']), match['part'] or '') if match['task'] else named
+        if key is None:
+            continue
+        trace = traces.setdefault(key, Trace())
+        if match['kind'] == 'START':
+            trace.started, trace.finished = True, False
+            trace.start = walltime.parse_date(match['date']) or trace.start
+        else:
+            trace.finished = True
+    if named:
+        trace = traces.setdefault(named, Trace())
+        trace.started = True
+        trace.finished = trace.finished or bool(walltime.TOTAL_TIME.search(text))
+
+
+def node_trace(node, traces: dict) -> tuple:
+    '''(trace, time limit) of a job from its slurm output and error and the stamps of its (task, cfg, part)'''
+    outs, errs, limit = log_paths(node.script)
+    own = {}
+    for path in outs:
+        read_stamps(path, own)
+    found = [found for traces_of in (traces, own) for (task, cfg, part), found in traces_of.items()
+             if task == node.task and cfg == node.cfg_id and (node.array or part == node.part) and found.started]
+    trace = Trace()
+    # a job split into array tasks has finished once all of its started tasks have
+    trace.started = bool(found or outs)  # slurm creates the output when the job starts
+    trace.finished = bool(found) and all(t.finished for t in found)
+    trace.start = max((t.start for t in found if t.start), default=None)
+    if trace.start is None and outs:
+        trace.start = datetime.fromtimestamp(max(os.stat(path).st_mtime for path in outs))
+    for path in errs:
+        try:
+            text = walltime.read_ends(path)
+        except OSError:
+            continue
+        if TIME_LIMIT.search(text):
+            trace.error = 'time limit'
+        elif trace.error is None:
+            match = SLURM_ERROR.search(text)
+            if match:
+                trace.error = match.group(0).strip()
+    return trace, limit
+
+
+def classify(dataMap: dict, nodes: list, traces: dict, now: datetime, tolerance: float = 1.0,
+             magic=verify_outputs.SUPERBBLAS_MAGIC) -> dict:
+    '''node name -> (class, detail, bad output files)'''
+    by_name = {node.name: node for node in nodes}
+    result = {}
+    eigs_missing = None
+    for node in nodes:  # upstream nodes come first
+        complete, bad = check_outputs(dataMap, node, tolerance, magic)
+        if complete:
+            result[node.name] = ('completed', '', [])
+            continue
+        upstream = []
+        for dep in node.deps:
+            if dep in by_name:
+                if result[dep][0] != 'completed':
+                    upstream.append(dep)
+            else:
+                if eigs_missing is None:
+                    eigs_missing = completeness.find_missing(dataMap, ['eigs'], exts=['sdb'])
+                if any(node.cfg_id in cfgs for cfgs in eigs_missing.values()):
+                    upstream.append(dep)
+        if upstream:
+            result[node.name] = ('waiting', f"on {', '.join(upstream)}", bad)
+            continue
+        trace, limit = node_trace(node, traces)
+        expired = (trace.start is not None and limit is not None
+                   and now > trace.start + timedelta(minutes=limit + GRACE_MINUTES))
+        if trace.started and not trace.finished:
+            if trace.error == 'time limit' or (trace.error is None and expired):
+                result[node.name] = ('timed_out', f'limit {limit:g} min' if limit else '', bad)
+            elif trace.error:
+                result[node.name] = ('crashed', trace.error, bad)
+            else:
+                result[node.name] = ('running', f'since {trace.start:%Y-%m-%dT%H:%M}' if trace.start else '', bad)
+        elif trace.started or bad:
+            details = [trace.error or ('finished without its outputs' if trace.finished else '')]
+            details += [f'{os.path.basename(path)} {status}' for path, status, _ in bad]
+            result[node.name] = ('crashed', ', '.join(filter(None, details)), bad)
+        else:
+            result[node.name] = ('not_run', '', bad)
+    return result
+
+
+def select(nodes: list, classes: dict, rerun: tuple) -> list:
+    '''jobs to resubmit: those in the rerun classes and the waiting jobs downstream of them'''
+    selected = {node.name for node in nodes if classes[node.name][0] in rerun}
+    for node in nodes:
+        if classes[node.name][0] == 'waiting' and any(dep in selected for dep in node.deps):
+            selected.add(node.name)
+    return [node for node in nodes if node.name in selected]
+
+
+def scale_minutes(dataMap: dict, targets: list, factor: float, max_minutes: int) -> None:
+    '''multiply the walltime of the jobs: the *_chroma_minutes of the ensemble and the *_minutes of the parts'''
+    def scaled(minutes):
+        return min(max_minutes, math.ceil(minutes * factor))
+    for key in [key for key in dataMap if key.endswith('_chroma_minutes')]:
+        dataMap[key] = scaled(dataMap[key])
+    for part in {id(target[3]): target[3] for target in targets}.values():
+        for key in [key for key in part if key.endswith('_minutes')]:
+            part[key] = scaled(part[key])
+
+
+def scale_nodes(dataMap: dict, factor: int) -> None:
+    '''multiply the nodes of the multi-node jobs and solve their -geom again'''
+    from yml_to_xml import geometry
+    for prefix in ('prop', 'meson', 'disco', 'fused'):
+        if f'{prefix}_slurm_nodes' in dataMap:
+            dataMap[f'{prefix}_slurm_nodes'] *= factor
+            dataMap[f'{prefix}_chroma_geometry'] = None
+    geometry.resolve_all(dataMap)
+
+
+def regenerate(yaml_file: str, task: str, nodes: list, walltime_factor: float = 1.0, nodes_factor: int = 1,
+               max_minutes: int = 1440) -> dict:
+    '''render the inputs and scripts of the given jobs of one task again; returns the summary of create_tasks_ens'''
+    import create_tasks_ens
+    _, dataMap, run_objects = create_tasks_ens.load_ensemble(yaml_file, argparse.Namespace(list_tasks=[task]))
+    if nodes_factor > 1:
+        scale_nodes(dataMap, nodes_factor)
+    wanted = {(node.cfg_id, None if node.array or node.reducer or node.task in workflow_dag.FUSED_TASKS else node.part)
+              for node in nodes}
+    cfg_ids = sorted({cfg for cfg, _ in wanted})
+    targets = [target for target in create_tasks_ens.plan_targets(dataMap, run_objects, cfg_ids)
+               if (target[0], None) in wanted or (target[0], target[3].get('part_suffix', '')) in wanted]
+    if walltime_factor != 1:
+        scale_minutes(dataMap, targets, walltime_factor, max_minutes)
+    plan = create_tasks_ens.plan_ensemble(dataMap, targets)
+    plan.create_dirs()
+    handler = create_tasks_ens.TaskHandler(create_tasks_ens.make_env())
+    summary = create_tasks_ens.render_cfgs(dataMap, targets, True, {}, plan.existing_files, handler)
+    ens_manifest = manifest.load_manifest(dataMap['launch_path'])
+    ens_manifest['files'].update(summary['entries'])
+    manifest.save_manifest(dataMap['launch_path'], ens_manifest)
+    return summary
+
+
+def set_aside(bad: list) -> None:
+    '''rename truncated and corrupt outputs so the rerun starts from scratch and existence checks miss them'''
+    for path, status, detail in bad:
+        os.replace(path, path + '.partial')
+        print(f"  {status} {path} -> {os.path.basename(path)}.partial" + (f" ({detail})" if detail else ''))
+
+
+def print_classes(ens_short: str, nodes: list, classes: dict) -> None:
+    counts = {name: sum(classes[node.name][0] == name for node in nodes) for name in CLASSES}
+    print(f"{ens_short}: " + ', '.join(f"{n} {name}" for name, n in counts.items()))
+    for name in CLASSES[1:]:
+        for node in nodes:
+            label, detail, _ = classes[node.name]
+            if label == name:
+                print(f"  {label:<10} {node.name}" + (f": {detail}" if detail else ''))
+
+
+def resubmit_ensemble(yaml_file: str, args) -> int:
+    '''classify, regenerate and (plan to) resubmit the jobs of one ensemble; returns the number of jobs planned'''
+    dataMap = load(yaml_file, args.list_tasks)
+    ens_short = dataMap['ens_short']
+    cfg_ids = completeness.cfg_grid(dataMap)
+    if args.cfg:
+        cfg_ids = [cfg for cfg in cfg_ids if cfg in args.cfg]
+    nodes = workflow_dag.build_dag(dataMap, args.list_tasks, cfg_ids)
+    traces = {}
+    for path in walltime.log_files(dataMap):
+        read_stamps(path, traces)
+    magic = None if args.skip_magic else verify_outputs.SUPERBBLAS_MAGIC
+    classes = classify(dataMap, nodes, traces, datetime.now(), args.tolerance, magic)
+    print_classes(ens_short, nodes, classes)
+    rerun = ('timed_out', 'crashed') + (('not_run',) if args.not_run else ())
+    selected = select(nodes, classes, rerun)
+    if not selected:
+        print(f"{ens_short}: nothing to resubmit")
+        return 0
+    if args.dry_run:
+        print(f"{ens_short}: would resubmit {len(selected)} jobs: {', '.join(node.name for node in selected)}")
+        return len(selected)
+    for node in selected:
+        set_aside(classes[node.name][2])
+    for task in dict.fromkeys(node.task.replace('_merge', '') for node in selected):
+        task_nodes = [node for node in selected if node.task.replace('_merge', '') == task]
+        timed_out = [node for node in task_nodes if classes[node.name][0] == 'timed_out']
+        groups = [(timed_out, args.walltime_factor, args.nodes_factor),
+                  ([node for node in task_nodes if node not in timed_out], 1.0, 1)]
+        for group, walltime_factor, nodes_factor in groups:
+            if group:
+                summary = regenerate(yaml_file, task, group, walltime_factor, nodes_factor, args.max_minutes)
+                print(f"{ens_short}: {task}: {summary['written'] + summary['updated'] + summary['skipped']} files rendered"
+                      + (f" with walltime x{walltime_factor:g}" if walltime_factor != 1 else '')
+                      + (f" on x{nodes_factor} nodes" if nodes_factor != 1 else ''))
+                for error in summary['errors']:
+                    print(f"  [FAILED] {error}")
+    chosen = {node.name for node in selected}
+    for node in nodes:
+        node.done = node.name not in chosen
+        node.blocked = False
+        if node.array and not node.done:
+            # only the shards still missing run again, see workflow_dag.sbatch_options
+            node.missing = missing_shards(dataMap, node, args.tolerance, magic)
+    plan_path = os.path.join(dataMap['launch_path'], f'resubmit_{ens_short}.sh')
+    n_jobs = workflow_dag.write_plan(plan_path, nodes)
+    print(f"Wrote resubmit plan with {n_jobs} jobs: {plan_path}")
+    if args.submit:
+        job_ids = workflow_dag.submit(nodes, args.sbatch)
+        print(f"Submitted {len(job_ids)} jobs for {ens_short}")
+    return n_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resubmit the timed out and crashed jobs of ensembles.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('-l', '--list_tasks', nargs='+', required=True, help='Tasks to check, as given to create_tasks_ens.py')
+    parser.add_argument('--cfg', type=int, nargs='+', help='Only these configurations')
+    parser.add_argument('--not_run', action='store_true', help='Also submit the jobs with no trace of ever running')
+    parser.add_argument('--walltime_factor', type=float, default=1.0, help='Multiply the walltime of timed out jobs (default: %(default)s)')
+    parser.add_argument('--max_minutes', type=int, default=1440, help='Cap of the multiplied walltimes, the partition limit (default: %(default)s)')
+    parser.add_argument('--nodes_factor', type=int, default=1, help='Multiply the nodes of timed out multi-node jobs (default: %(default)s)')
+    parser.add_argument('--dry_run', action='store_true', help='Only print the classification and the jobs that would be resubmitted')
+    parser.add_argument('--submit', action='store_true', help='Submit the resubmit plan right away')
+    parser.add_argument('--sbatch', type=str, default='sbatch', help='sbatch command used by --submit, e.g. scripts/fake_sbatch.py (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Fraction of the modelled sdb size below which an output is truncated (default: %(default)s)')
+    parser.add_argument('--skip_magic', action='store_true', help='Do not check the superbblas storage magic of sdb files')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith(('.yml', '.yaml')))
+    else:
+        yaml_files = [args.ini]
+    for yaml_file in yaml_files:
+        resubmit_ensemble(yaml_file, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+'''one slurm array job per (ensemble, task) instead of one job per configuration
+
+Submitting every per-configuration script separately costs one sbatch call and
+one scheduler entry per job, and a few ensembles are enough to hit
+MaxSubmitJobs. In array mode the pending nodes of the job DAG (workflow_dag.py)
+are grouped by task and each group becomes
+
+- launch_path/<task dir>/<task>_array.idx, one line per (cfg, part) of the task
+  over the whole cfg grid: array index, cfg id, part suffix (- for none), the
+  per-configuration script and the files its #SBATCH -o/-e would have written;
+- launch_path/<task dir>/<task>_array.sh, with the #SBATCH directives of the
+  per-configuration scripts, an --array= range listing only the pending indices
+  and an optional %throttle. Each array task looks up its line of the index and
+  runs the per-configuration script, so the rendered XML inputs and scripts are
+  used unchanged.
+
+Every array task gets the longest -t of the pending scripts. The node count and
+GPUs are those of every pending script; a task whose scripts differ in --nodes
+or --gres (e.g. after a resubmit.py --nodes_factor of some configurations) is
+refused and has to be submitted without --array.
+
+Indices are stable across runs since the index covers the whole grid. An array
+depends on its upstream arrays with aftercorr, index i waiting only for index i
+upstream, when both have the same cfg at every index and every pending index is
+pending upstream as well (a fresh eigs -> perams -> meson chain). Otherwise, as
+for the disco shards or when some upstream configurations are already done, it
+depends with afterok on the whole upstream array: one failed configuration then
+holds back the whole downstream array, which has to be resubmitted once the
+failure is fixed. Disco shards, already an array per configuration, get one
+array index per shard; the shard is passed to the disco script in $PART_SUFFIX.
+'''
+import os
+import shlex
+import subprocess
+
+from scripts import completeness, workflow_dag
+
+# slurm's default MaxArraySize; larger indices are rejected by sbatch
+MAX_ARRAY_SIZE = 1001
+SKIPPED_DIRECTIVES = ('-o', '--output', '-e', '--error', '-J', '--job-name', '-a', '--array')
+# directives every script of an array must agree on, by their short and long name
+UNIFORM_DIRECTIVES = (('-N', '--nodes'), ('--gres',))
+
+
+class ArrayJob:
+    def __init__(self, task, script, index, entries, pending, deps):
+        self.task = task
+        self.script = script
+        self.index = index
+        self.entries = entries
+        self.pending = pending
+        self.deps = deps
+        self.corr = []  # upstream tasks depended on index by index, with aftercorr
+
+    @property
+    def var(self) -> str:
+        return array_var(self.task)
+
+
+def array_var(task: str) -> str:
+    '''shell variable holding the slurm job id of the array of a task'''
+    return 'a_' + workflow_dag.safe_name(task).replace('-', '_')
+
+
+def sbatch_directives(script: str) -> dict:
+    '''#SBATCH options of a rendered script, keyed by option name'''
+    directives = {}
+    with open(script) as f:
+        for line in f:
+            if not line.startswith('#SBATCH'):
+                continue
+            option = line[len('#SBATCH'):].strip()
+            name, _, value = option.partition('=') if option.startswith('--') else option.partition(' ')
+            directives[name] = value.strip()
+    return directives
+
+
+def parse_limit(value: str):
+    '''minutes of a slurm --time: M, M:S, H:M:S, D-H, D-H:M or D-H:M:S'''
+    if not value:
+        return None
+    days, _, clock = value.rpartition('-')
+    fields = [int(f) for f in clock.split(':')]
+    if days:
+        hours, minutes, seconds = (fields + [0, 0])[:3]
+    elif len(fields) == 3:
+        hours, minutes, seconds = fields
+    else:
+        hours, (minutes, seconds) = 0, (fields + [0])[:2]
+    return int(days or 0) * 1440 + hours * 60 + minutes + seconds / 60
+
+
+def array_directives(task: str, scripts: list) -> dict:
+    '''#SBATCH options of the array of a task: those of its scripts with the longest time limit'''
+    every = [sbatch_directives(script) for script in dict.fromkeys(scripts)]
+    for names in UNIFORM_DIRECTIVES:
+        values = {next((d[name] for name in names if name in d), None) for d in every}
+        if len(values) > 1:
+            raise ValueError(f"the pending {task} scripts ask for different {names[-1]} "
+                             f"({', '.join(sorted(map(str, values)))}); submit them without --array")
+    directives = dict(every[0])
+    longest = max(every, key=lambda d: parse_limit(d.get('-t') or d.get('--time')) or 0)
+    for name in ('-t', '--time'):
+        if name in longest:
+            directives.pop('-t', None)
+            directives.pop('--time', None)
+            directives[name] = longest[name]
+    return directives
+
+
+def corresponds(upstream: ArrayJob, array: ArrayJob) -> bool:
+    '''whether index i of the array needs only index i of the upstream array'''
+    return ([entry[0] for entry in upstream.entries] == [entry[0] for entry in array.entries]
+            and set(array.pending) <= set(upstream.pending))
+
+
+def dependency(array: ArrayJob, job_id) -> str:
+    '''--dependency value of an array, job_id maps an upstream task to its job id'''
+    kinds = [('aftercorr', [dep for dep in array.deps if dep in array.corr]),
+             ('afterok', [dep for dep in array.deps if dep not in array.corr])]
+    return ','.join(f"{kind}:{':'.join(job_id(dep) for dep in deps)}" for kind, deps in kinds if deps)
+
+
+def array_spec(indices, throttle: int = None) -> str:
+    '''--array value of sorted indices, e.g. "0-3,7,9-12%8"'''
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    spec = ','.join(f'{a}-{b}' if b > a else f'{a}' for a, b in ranges)
+    return spec + (f'%{throttle}' if throttle else '')
+
+
+def node_entries(dataMap: dict, node) -> list:
+    '''(cfg, part, script, stdout, stderr, pending) of the array tasks of one DAG node'''
+    directives = sbatch_directives(node.script)
+    stdout = directives.get('-o') or directives.get('--output') or '/dev/null'
+    stderr = directives.get('-e') or directives.get('--error') or stdout
+    pending = not node.done and not node.blocked
+    if not node.array:
+        return [(node.cfg_id, node.part, node.script, stdout, stderr, pending)]
+    entries = []
+    for i, part in enumerate(completeness.default_parts(dataMap, node.output_type)):
+        shard_pending = pending and (node.missing is None or part in node.missing)
+        entries.append((node.cfg_id, part, node.script, stdout.replace('%a', str(i)),
+                        stderr.replace('%a', str(i)), shard_pending))
+    return entries
+
+
+def build_arrays(dataMap: dict, nodes: list, throttle: int = None) -> list:
+    '''write the index and array script of every task with pending nodes; returns the array jobs in DAG order'''
+    by_task = {}
+    for node in nodes:
+        by_task.setdefault(node.task, []).append(node)
+    task_of = {node.name: node.task for node in nodes}
+    arrays = []
+    for task, task_nodes in by_task.items():
+        node_lists = [node_entries(dataMap, node) for node in task_nodes]
+        entries = [entry for node_list in node_lists for entry in node_list]
+        pending = [i for i, entry in enumerate(entries) if entry[5]]
+        if not pending:
+            continue
+        scripts = [node.script for node, node_list in zip(task_nodes, node_lists) if any(e[5] for e in node_list)]
+        task_dir = os.path.dirname(os.path.dirname(task_nodes[0].script))
+        index = os.path.join(task_dir, f'{workflow_dag.safe_name(task)}_array.idx')
+        script = os.path.join(task_dir, f'{workflow_dag.safe_name(task)}_array.sh')
+        deps = list(dict.fromkeys(task_of[dep] for node in task_nodes if not node.done and not node.blocked
+                                  for dep in node.deps if dep in task_of))
+        array = ArrayJob(task, script, index, entries, pending, deps)
+        write_index(index, entries)
+        write_script(dataMap, array, array_directives(task, scripts), throttle)
+        if pending[-1] >= MAX_ARRAY_SIZE:
+            print(f"Warning: {script} uses array index {pending[-1]}, above slurm's default MaxArraySize {MAX_ARRAY_SIZE}")
+        arrays.append(array)
+    by_name = {array.task: array for array in arrays}
+    for array in arrays:
+        array.deps = [dep for dep in array.deps if dep in by_name]
+        array.corr = [dep for dep in array.deps if corresponds(by_name[dep], array)]
+    return arrays
+
+
+def write_index(path: str, entries: list) -> None:
+    with open(path, 'w') as f:
+        for i, (cfg_id, part, script, stdout, stderr, _) in enumerate(entries):
+            f.write(f'{i} {cfg_id} {part or "-"} {script} {stdout} {stderr}\n')
+
+
+def write_script(dataMap: dict, array: ArrayJob, directives: dict, throttle: int = None) -> None:
+    name = f"{dataMap['ens_short']}_{workflow_dag.safe_name(array.task)}"
+    out_dir = os.path.join(dataMap['run_path'], 'chroma_out')
+    lines = ['#!/bin/bash', f'# slurm array over the per-configuration {array.task} scripts, generated by create_tasks_ens.py', '']
+    for option, value in directives.items():
+        if option not in SKIPPED_DIRECTIVES:
+            lines.append(f'#SBATCH {option}={value}' if option.startswith('--') else f'#SBATCH {option} {value}')
+    lines += [
+        f'#SBATCH -J {name}',
+        f'#SBATCH --array={array_spec(array.pending, throttle)}',
+        f'#SBATCH -o {out_dir}/{name}_%A_%a.out',
+        f'#SBATCH -e {out_dir}/{name}_%A_%a.err',
+        '',
+        f'index={array.index}',
+        'read -r _ cfg_id part script stdout stderr < <(awk -v i="$SLURM_ARRAY_TASK_ID" \'$1 == i\' "$index")',
+        'if [ -z "$script" ]; then',
+        '  echo "no entry $SLURM_ARRAY_TASK_ID in $index"',
+        '  exit 1',
+        'fi',
+        '[ "$part" = - ] && part=',
+        'export PART_SUFFIX=$part',
+        'echo "array task $SLURM_ARRAY_TASK_ID: cfg $cfg_id$part $script"',
+        'bash "$script" > "$stdout" 2> "$stderr"',
+    ]
+    with open(array.script, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(array.script, 0o755)
+
+
+def write_plan(path: str, arrays: list) -> int:
+    '''write the array submit plan as a shell script; returns the number of array jobs in it'''
+    lines = ['#!/bin/bash', '# array submit plan generated by create_tasks_ens.py', 'SBATCH=${SBATCH:-sbatch}', 'set -e', '']
+    for array in arrays:
+        depends = f' --dependency={dependency(array, lambda dep: "$" + array_var(dep))}' if array.deps else ''
+        lines.append(f'{array.var}=$($SBATCH --parsable{depends} {shlex.quote(array.script)})')
+        lines.append(f'echo "{array.task} ${array.var} ({len(array.pending)} tasks)"')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(path, 0o755)
+    return len(arrays)
+
+
+def submit(arrays: list, sbatch: str = 'sbatch') -> dict:
+    '''submit the array jobs in order; returns the job id of every submitted array'''
+    job_ids = {}
+    for array in arrays:
+        if any(dep not in job_ids for dep in array.deps):
+            print(f"Skipping {array.task}: upstream submission failed")
+            continue
+        cmd = shlex.split(sbatch) + ['--parsable']
+        if array.deps:
+            cmd.append('--dependency=' + dependency(array, job_ids.get))
+        cmd.append(array.script)
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error submitting {array.task}: {result.stderr.strip()}")
+            continue
+        job_ids[array.task] = result.stdout.strip().split(';')[0]
+    return job_ids
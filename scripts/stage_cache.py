@@ -0,0 +1,142 @@
+'''node-local cache of the input files chroma jobs read, shared by the jobs on a node
+
+Every peram and meson job of a configuration reads the same multi-GB
+eigs_numvecs<n>_cfg<cfg>.sdb from the parallel filesystem. With stage_dir in the
+ensemble yaml (a node-local disk such as /tmp/<user>/eigs or a burst buffer) the
+inputs read the eigs from there, and the launch scripts stage them first on every
+node of the job:
+
+    python -m scripts.stage_cache --cache_dir /tmp/eigs_cache --max_gb 200 /p/scratch/.../eigs_numvecs64_cfg11.sdb
+
+- A cached copy is a hit when its size and mtime match the source; the copy keeps
+  the mtime of the source, so a regenerated source is copied again.
+- A miss is copied under a per-file lock into a temporary file and renamed into
+  place, so concurrent jobs on the node wait for one copy and never see a partial
+  file.
+- Entries are evicted least recently used first (the access time of an entry is
+  set on every hit) until the copy fits both --max_gb and the free space of the
+  disk minus --reserve_gb. Entries used within the last --min_idle minutes are
+  kept, as a job may be about to open them.
+- If the copy still does not fit, the cache path becomes a symlink to the source,
+  so the job reads the shared file as before; the next job retries the copy.
+'''
+import argparse
+import fcntl
+import os
+import shutil
+import time
+
+LOCK_SUFFIX = '.lock'
+TMP_SUFFIX = '.tmp'
+GB = 1024 ** 3
+
+
+class Entry:
+    def __init__(self, path, size, atime):
+        self.path = path
+        self.size = size
+        self.atime = atime
+
+
+def entries(cache_dir: str, stale_tmp: float = None) -> list:
+    '''regular files of the cache, least recently used first; copies left by killed jobs are removed'''
+    found = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if TMP_SUFFIX in entry.name and stale_tmp is not None:
+                if time.time() - entry.stat(follow_symlinks=False).st_mtime > stale_tmp:
+                    os.remove(entry.path)
+                continue
+            if entry.name.endswith(LOCK_SUFFIX) or TMP_SUFFIX in entry.name or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            found.append(Entry(entry.path, stat.st_size, stat.st_atime))
+    return sorted(found, key=lambda e: e.atime)
+
+
+def is_hit(cached: str, src_stat: os.stat_result) -> bool:
+    try:
+        stat = os.lstat(cached)
+    except FileNotFoundError:
+        return False
+    # a symlink is the fallback of a copy that did not fit
+    return (not os.path.islink(cached) and stat.st_size == src_stat.st_size
+            and int(stat.st_mtime) == int(src_stat.st_mtime))
+
+
+def make_room(cache_dir: str, needed: int, max_bytes: int = None, reserve: int = 0, min_idle: float = 600,
+              keep: str = None) -> bool:
+    '''evict least recently used entries until `needed` bytes fit; returns whether they do'''
+    now = time.time()
+    cached = [e for e in entries(cache_dir, stale_tmp=min_idle) if e.path != keep]
+    used = sum(e.size for e in cached)
+    for entry in cached + [None]:
+        fits_budget = max_bytes is None or used + needed <= max_bytes
+        if fits_budget and shutil.disk_usage(cache_dir).free - needed >= reserve:
+            return True
+        if entry is None or now - entry.atime < min_idle:
+            return False
+        lock = open(entry.path + LOCK_SUFFIX, 'a')
+        try:
+            # an entry being copied by another job is locked; leave it
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        try:
+            os.remove(entry.path)
+            used -= entry.size
+            print(f"evicted {os.path.basename(entry.path)} ({entry.size / GB:.1f} GB)")
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+    return False
+
+
+def stage(src: str, cache_dir: str, max_bytes: int = None, reserve: int = 0, min_idle: float = 600) -> str:
+    '''path of the node-local copy of src, copied in if it is missing or stale'''
+    os.makedirs(cache_dir, exist_ok=True)
+    src_stat = os.stat(src)
+    cached = os.path.join(cache_dir, os.path.basename(src))
+    with open(cached + LOCK_SUFFIX, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_hit(cached, src_stat):
+            os.utime(cached, (time.time(), src_stat.st_mtime))
+            print(f"hit {cached}")
+            return cached
+        if os.path.lexists(cached):
+            os.remove(cached)
+        if not make_room(cache_dir, src_stat.st_size, max_bytes, reserve, min_idle, keep=cached):
+            os.symlink(os.path.abspath(src), cached)
+            print(f"no room for {os.path.basename(src)} ({src_stat.st_size / GB:.1f} GB), linked to the source")
+            return cached
+        tmp_path = f'{cached}{TMP_SUFFIX}.{os.getpid()}'
+        try:
+            start = time.time()
+            shutil.copyfile(src, tmp_path)
+            os.utime(tmp_path, (time.time(), src_stat.st_mtime))
+            os.replace(tmp_path, cached)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"copied {cached} ({src_stat.st_size / GB:.1f} GB in {time.time() - start:.0f} s)")
+        return cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage input files into a node-local cache shared by the jobs of a node.")
+    parser.add_argument('files', nargs='+', help='Files to stage')
+    parser.add_argument('--cache_dir', type=str, required=True, help='Node-local cache directory (stage_dir of the ensemble yaml)')
+    parser.add_argument('--max_gb', type=float, help='Size limit of the cache (default: only the free space of the disk)')
+    parser.add_argument('--reserve_gb', type=float, default=1.0, help='Disk space left free (default: %(default)s)')
+    parser.add_argument('--min_idle', type=float, default=10, help='Minutes since the last use before an entry may be evicted (default: %(default)s)')
+    args = parser.parse_args()
+    max_bytes = int(args.max_gb * GB) if args.max_gb else None
+    for path in args.files:
+        stage(path, args.cache_dir, max_bytes, int(args.reserve_gb * GB), args.min_idle * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''wall time spent in each stage of create_tasks_ens.py
+
+Stages: yaml_load and ensemble_parse (load_ensemble), validate, plan (the
+targets of every configuration), fs (directory scan and creation, reading back
+existing files, writing, the manifest), and per file dict_copy (the render data),
+hash (the manifest record) and render (jinja). Times are accumulated into a
+plain dict so that worker processes can return them with their summary; with
+-j the per-file stages are summed over the workers.
+
+    python create_tasks_ens.py --ini ens/a125m400.yml -l peram_mg_light meson --profile profile.json
+'''
+import contextlib
+import json
+import resource
+import sys
+import time
+
+STAGES = ('yaml_load', 'ensemble_parse', 'validate', 'plan', 'fs', 'dict_copy', 'hash', 'render')
+
+
+@contextlib.contextmanager
+def timed(times: dict, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0.0) + time.perf_counter() - start
+
+
+def add(total: dict, part: dict) -> None:
+    for stage, seconds in part.items():
+        total[stage] = total.get(stage, 0.0) + seconds
+
+
+def peak_rss_mb() -> float:
+    '''largest resident set of this process and of its largest finished child (worker), in MB'''
+    scale = 1 / 1024 ** 2 if sys.platform == 'darwin' else 1 / 1024  # ru_maxrss is bytes on macOS, kB on linux
+    return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * scale
+
+
+def profile(summaries: dict, times: dict, seconds: float, jobs: int) -> dict:
+    '''the report written by --profile: per ensemble and total stage times, file counts and throughput'''
+    report = {'jobs': jobs, 'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'ensembles': {}}
+    total_files = 0
+    stages = {}
+    for ens_short, summary in summaries.items():
+        files = sum(summary[key] for key in ('written', 'updated', 'skipped', 'failed'))
+        total_files += files
+        ens_times = dict(times.get(ens_short, {}))
+        add(ens_times, summary['times'])
+        add(stages, ens_times)
+        report['ensembles'][ens_short] = {'files': files, 'written': summary['written'], 'updated': summary['updated'],
+                                          'skipped': summary['skipped'], 'failed': summary['failed'],
+                                          'stages': {stage: ens_times.get(stage, 0.0) for stage in STAGES}}
+    report['files'] = total_files
+    report['files_per_second'] = total_files / seconds if seconds > 0 else 0.0
+    report['stages'] = {stage: stages.get(stage, 0.0) for stage in STAGES}
+    return report
+
+
+def write_profile(path: str, report: dict) -> None:
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,199 @@
+'''verify chroma outputs beyond existence: size and header checks of sdb and h5 files
+
+A job killed at walltime leaves a short or half-written file behind that passes an
+existence check. Each file is compared with a size model derived from NL, NT, nvec,
+the number of t_sources, momenta and displacements, and only its header is read
+through mmap (the HDF5 superblock, the superbblas storage magic of the sdb), so a
+multi-TB ensemble is verified without reading any payload. Files are checked on a
+thread pool and classified as ok, truncated, corrupt or missing. The size model
+takes 16 bytes per complex number, 8 where output_precision (or
+<type>_output_precision, e.g. meson_output_precision) of the yaml is single.
+
+Single files are checked from the job scripts, which keep an output that is ok:
+
+    python -m scripts.verify_outputs res/disco_sdb/disco_cfg11_c0.sdb
+'''
+import argparse
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts import completeness
+
+STATUSES = ('ok', 'truncated', 'corrupt', 'missing')
+HEADER_BYTES = 4096
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+# superbblas storage files (the sdb written by the *_SUPERB chroma tasks) start with this int32
+SUPERBBLAS_MAGIC = 314
+UNDEFINED_ADDRESS = 0xffffffffffffffff
+BYTES_PER_COMPLEX = {'double': 16, 'single': 8}
+
+
+def complex_bytes(dataMap: dict, file_type: str) -> int:
+    '''bytes of a complex number in the sdb of a type, from the output precision of the yaml'''
+    precision = dataMap.get(f"{file_type.split('_')[0]}_output_precision", dataMap.get('output_precision', 'double'))
+    return BYTES_PER_COMPLEX[precision]
+
+
+def expected_payload(dataMap: dict, file_type: str, nvec: int, bytes_per_complex: int = None,
+                     n_mom: int = None, n_t: int = None, n_src: int = None) -> int:
+    '''lower bound on the size of an sdb: the number of complex numbers it must hold
+
+    ``n_mom`` and ``n_t`` are the momenta and time slices of a meson part and
+    ``n_src`` the source time slices of a peram shard, by default all.
+    ``bytes_per_complex`` defaults to the output precision of the yaml.
+    '''
+    NL, NT = dataMap['NL'], dataMap['NT']
+    bytes_per_complex = bytes_per_complex or complex_bytes(dataMap, file_type)
+    if file_type == 'eigs':
+        return NL ** 3 * NT * 3 * nvec * bytes_per_complex
+    if file_type.startswith('peram'):
+        num_tsrc = n_src or len(range(0, dataMap.get('prop_t_fwd', NT), dataMap['num_tsrc']))
+        return num_tsrc * dataMap.get('prop_t_fwd', NT) * (4 * nvec) ** 2 * bytes_per_complex
+    if file_type in ('meson', 'meson2'):
+        from yml_to_xml import meson_xml, momenta
+        if n_mom is None:
+            n_mom = len(momenta.meson_momenta(dataMap, file_type))
+        disps = meson_xml._displacement_list()
+        return (n_t or NT) * n_mom * len(disps) * nvec ** 2 * bytes_per_complex
+    return 0
+
+
+def hdf5_end_of_file(header: bytes) -> int:
+    '''file size recorded in the HDF5 superblock, None if undefined; raises ValueError if unreadable'''
+    # the superblock sits at 0 or after a user block of 512, 1024, 2048, ... bytes
+    offset = 0
+    while header[offset:offset + 8] != HDF5_SIGNATURE:
+        offset = 512 if offset == 0 else offset * 2
+        if offset + 8 > len(header):
+            raise ValueError('no HDF5 superblock signature')
+    version = header[offset + 8]
+    if version in (0, 1):
+        size_of_offsets = header[offset + 13]
+        base = offset + (24 if version == 0 else 28)
+    elif version in (2, 3):
+        size_of_offsets = header[offset + 9]
+        base = offset + 12
+    else:
+        raise ValueError(f'unknown superblock version {version}')
+    if size_of_offsets != 8:
+        raise ValueError(f'unsupported size of offsets {size_of_offsets}')
+    # base address, free-space/extension address and end-of-file address follow each other
+    base_address, _, eof_address = struct.unpack_from('<QQQ', header, base)
+    if eof_address == UNDEFINED_ADDRESS:
+        return None
+    return base_address + eof_address
+
+
+def check_sdb_header(header: bytes, magic=SUPERBBLAS_MAGIC) -> None:
+    if not any(header[:64]):
+        raise ValueError('zero-filled header')
+    if magic is not None and struct.unpack_from('<i', header)[0] != magic:
+        raise ValueError('bad storage magic')
+
+
+def verify_file(path: str, ext: str, min_size: int = 0, tolerance: float = 1.0, magic=SUPERBBLAS_MAGIC):
+    '''(status, detail) of a single output file, reading at most HEADER_BYTES of it'''
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return 'missing', ''
+    if size == 0:
+        return 'truncated', 'empty file'
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), min(size, HEADER_BYTES), access=mmap.ACCESS_READ) as mm:
+            header = mm[:]
+    except (OSError, ValueError) as e:
+        return 'corrupt', str(e)
+    try:
+        if ext == 'h5':
+            eof = hdf5_end_of_file(header)
+            if eof is not None and size < eof:
+                return 'truncated', f'{size} < {eof} bytes in superblock'
+        else:
+            check_sdb_header(header, magic)
+    except (ValueError, struct.error, IndexError) as e:
+        return 'corrupt', str(e)
+    if ext == 'sdb' and size < min_size * tolerance:
+        return 'truncated', f'{size} < {int(min_size * tolerance)} expected bytes'
+    return 'ok', ''
+
+
+def part_sizes(dataMap: dict, file_type: str) -> list:
+    '''(file name suffix, size arguments of expected_payload) of the files one cfg is split into'''
+    if file_type in ('meson', 'meson2'):
+        from yml_to_xml import meson_parts
+        return [(part['part_suffix'], {'n_mom': len(part['momentum_list']), 'n_t': part['meson_t_fwd']})
+                for part in meson_parts.meson_parts(dataMap, file_type)]
+    if file_type.startswith('peram'):
+        from yml_to_xml import peram_parts
+        return [(shard['part_suffix'], {'n_src': len(shard['prop_t_source_list'].split())})
+                for shard in peram_parts.peram_shards(dataMap)]
+    if file_type == 'disco':
+        from yml_to_xml import disco_parts
+        return [(suffix, {}) for suffix in disco_parts.shard_suffixes(dataMap)]
+    return [('', {})]
+
+
+def verify_ensemble(dataMap: dict, file_types, nvecs=None, exts=None, jobs: int = 16,
+                    tolerance: float = 1.0, bytes_per_complex: int = None, magic=SUPERBBLAS_MAGIC) -> dict:
+    '''cfgs per status keyed by (type, nvec, ext), plus the details of the bad files
+
+    A cfg split into parts gets the worst status of its parts, unless the file
+    merged from them (with the parts removed, as completeness.find_missing
+    accepts) is better.
+    '''
+    checks = []
+    for file_type in file_types:
+        directory = completeness.output_dir(dataMap, file_type)
+        parts = part_sizes(dataMap, file_type)
+        if len(parts) > 1:
+            parts.append((None, {}))  # the merged file
+        for nvec in nvecs or completeness.default_nvecs(dataMap, file_type):
+            for ext in completeness.OUTPUTS[file_type][2]:
+                if exts is not None and ext not in exts:
+                    continue
+                for part, sizes in parts:
+                    min_size = expected_payload(dataMap, file_type, nvec, bytes_per_complex, **sizes)
+                    for cfg in completeness.cfg_grid(dataMap):
+                        path = os.path.join(directory, completeness.file_name(file_type, nvec, cfg, ext, part or ''))
+                        checks.append(((file_type, nvec, ext), cfg, path, min_size, part is None))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(lambda c: verify_file(c[2], c[0][2], c[3], tolerance, magic), checks))
+    report = {}
+    worst = {}
+    merged = {}
+    for (key, cfg, path, _, is_merged), (status, detail) in zip(checks, results):
+        if is_merged:
+            merged[(key, cfg)] = status
+        elif STATUSES.index(status) >= STATUSES.index(worst.get((key, cfg), 'ok')):
+            worst[(key, cfg)] = status
+        entry = report.setdefault(key, {status: [] for status in STATUSES})
+        if detail:
+            entry.setdefault('details', []).append(f'{path}: {detail}')
+    for (key, cfg), status in worst.items():
+        status = min(status, merged.get((key, cfg), 'missing'), key=STATUSES.index)
+        report[key][status].append(cfg)
+    return report
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the size and header of output files; fails unless every file is ok.")
+    parser.add_argument('files', nargs='+', help='sdb or h5 files')
+    parser.add_argument('--min_size', type=int, default=0, help='Bytes an sdb must have at least (default: %(default)s)')
+    parser.add_argument('--skip_magic', action='store_true', help='Do not check the superbblas storage magic of sdb files')
+    args = parser.parse_args()
+    bad = 0
+    for path in args.files:
+        ext = 'h5' if path.endswith('.h5') else 'sdb'
+        status, detail = verify_file(path, ext, args.min_size, magic=None if args.skip_magic else SUPERBBLAS_MAGIC)
+        print(f"{path}: {status}" + (f" ({detail})" if detail else ''))
+        bad += status != 'ok'
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
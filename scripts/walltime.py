@@ -0,0 +1,329 @@
+'''walltime predictor fitted on the timings of past chroma runs
+
+Timings come from the START/FINISH stamps the .sh.j2 templates echo into the slurm
+output, and from the "total time = ... secs" lines chroma writes to its stdout,
+log and out.xml files. Every (task, cfg) sample is turned into GPU-minutes and
+fitted per task kind against the work model of scripts/binpack.py (lattice
+volume, nvec, t_sources, flavor) as gpu_minutes = coef * work**exponent. The
+prediction for an ensemble divides by the GPU count of its chroma geometry
+(ideal strong scaling) and is inflated by the spread of the fit and a margin.
+
+    python -m scripts.walltime --ini_dir ens --model walltime_model.json
+    python create_tasks_ens.py --ini_dir ens -l eigs meson --walltime_model walltime_model.json
+'''
+import argparse
+import json
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from scripts import binpack, completeness, workflow_dag
+
+MODEL_VERSION = 1
+# directories below data_path/run_path that hold slurm outputs, chroma logs and out.xml files
+LOG_DIRS = ['chroma_out', 'res/log', 'res/out', 'log', 'out']
+# only the ends of a file are read: stamps are at the top and bottom, timings at the bottom
+HEAD_BYTES = 4096
+TAIL_BYTES = 65536
+MIN_MINUTES = 5
+
+PERAM_RE = r'peram_(?:mg|clover)_(?:light|strange|charm)'
+# combined peram jobs join their flavors with + in the stamps and with NAME_SEP in file names
+SEP_RE = rf'(?:\+|{workflow_dag.NAME_SEP})'
+TASK_RE = rf'eigs|meson2|meson|disco|fused|{PERAM_RE}(?:{SEP_RE}{PERAM_RE})*'
+# file name suffix of one part of a split configuration: meson chunks and slabs, disco shards, peram shards
+PART_RE = r'(?P<part>(?:_mom\d+)?(?:_c\d+)?(?:_t\d+)?)'
+STAMP = re.compile(rf'^(?P<kind>START|FINISH)(?: JOB)?\s+(?:(?P<task>{TASK_RE})\s+(?P<cfg>\d+){PART_RE}\s+)?'
+                   r'(?:gpus=(?P<gpus>\d+)\s+)?(?P<date>\S.*?)\s*$', re.M)
+TOTAL_TIME = re.compile(r'total time\s*=\s*(?P<secs>[0-9.]+(?:[eE][+-]?[0-9]+)?)\s*secs', re.I)
+# file names written by the .sh.j2 templates and create_binned_tasks.py
+FILE_NAMES = [
+    (re.compile(r'^eigs_?(?P<cfg>\d+)(?:\.out\.xml|\.out|\.log)$'), 'eigs'),
+    (re.compile(rf'^meson2_(?:\d+_cfg)?(?P<cfg>\d+){PART_RE}(?:\.out\.xml|\.out|\.log)$'), 'meson2'),
+    (re.compile(rf'^meson_?(?:\d+_cfg)?(?P<cfg>\d+){PART_RE}(?:\.out\.xml|\.out|\.log)$'), 'meson'),
+    (re.compile(rf'^disco_(?:cfg)?(?P<cfg>\d+){PART_RE}(?:\.out\.xml|\.out|\.log)$'), 'disco'),
+    (re.compile(rf'^perams?_(?P<flavor>(?:light|strange|charm)(?:{SEP_RE}(?:light|strange|charm))*)_(?P<inverter>(?:mg|clover)(?:{SEP_RE}(?:mg|clover))*)_(?P<cfg>\d+){PART_RE}(?:\.out\.xml|\.out|\.log)$'), None),
+    (re.compile(rf'^(?P<task>{TASK_RE})_cfg(?P<cfg>\d+){PART_RE}(?:\.out\.xml|\.out|\.log)$'), None),
+]
+DATE_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%a %b %d %H:%M:%S %Y']
+
+
+def parse_date(text: str):
+    '''timestamp of a START/FINISH stamp: ISO as echoed by the templates, or plain `date`'''
+    text = text.strip()
+    words = text.split()
+    if len(words) == 6:  # `date` default output has the time zone before the year
+        text = ' '.join(words[:4] + words[5:])
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def task_from_name(name: str, parent: str):
+    '''(task, cfg) of a log file name, or None; meson logs are told apart by their directory'''
+    named = part_from_name(name, parent)
+    return named[:2] if named else None
+
+
+def part_from_name(name: str, parent: str):
+    '''(task, cfg, part suffix) of a log file name, or None'''
+    for pattern, task in FILE_NAMES:
+        match = pattern.match(name)
+        if not match:
+            continue
+        groups = match.groupdict()
+        if task is None:
+            task = groups.get('task') or '+'.join(f'peram_{inverter}_{flavor}' for inverter, flavor in
+                                                  zip(re.split(SEP_RE, groups['inverter']), re.split(SEP_RE, groups['flavor'])))
+            task = re.sub(SEP_RE, '+', task)
+        if task == 'meson' and parent == 'meson2':
+            task = 'meson2'
+        return task, int(match['cfg']), groups.get('part') or ''
+    return None
+
+
+def read_ends(path: str) -> str:
+    with open(path, 'rb') as f:
+        head = f.read(HEAD_BYTES)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size <= HEAD_BYTES:
+            data = head
+        else:
+            f.seek(max(HEAD_BYTES, size - TAIL_BYTES))
+            data = head + b'\n' + f.read()
+    return data.replace(b'\0', b'').decode('utf-8', 'replace')
+
+
+def parse_file(path: str) -> list:
+    '''timing records of one file: (task, cfg, part, source, minutes or None if unfinished, gpus)'''
+    named = part_from_name(os.path.basename(path), os.path.basename(os.path.dirname(path)))
+    try:
+        text = read_ends(path)
+    except OSError:
+        return []
+    records = []
+    started = {}
+    for match in STAMP.finditer(text):
+        if match['task']:
+            key = (match['task'], int(match['cfg']), match['part'] or '')
+        elif named:
+            key = named
+        else:
+            continue
+        date = parse_date(match['date'])
+        if date is None:
+            continue
+        gpus = int(match['gpus']) if match['gpus'] else None
+        if match['kind'] == 'START':
+            started[key] = date
+        elif key in started:
+            minutes = (date - started.pop(key)).total_seconds() / 60
+            records.append((*key, 'stamp', minutes, gpus))
+    for key in started:
+        records.append((*key, 'stamp', None, None))
+    if named:
+        secs = [float(m['secs']) for m in TOTAL_TIME.finditer(text)]
+        if secs:
+            records.append((*named, 'chroma', max(secs) / 60, None))
+    return records
+
+
+def log_files(dataMap: dict) -> list:
+    roots = dict.fromkeys(dataMap[key] for key in ('data_path', 'run_path') if dataMap.get(key))
+    paths = []
+    for root in roots:
+        for log_dir in LOG_DIRS:
+            top = os.path.join(root, log_dir)
+            for dir_path, _, files in os.walk(top):
+                paths.extend(os.path.join(dir_path, name) for name in files)
+    return paths
+
+
+def ensemble_gpus(dataMap: dict, task: str) -> int:
+    '''number of GPUs a regular (unbinned) job of a task runs chroma on'''
+    kind, _ = binpack.task_kind(task)
+    geometry = dataMap.get(f'{binpack.TASK_PREFIX[kind]}_chroma_geometry') or [1]
+    return math.prod(geometry)
+
+
+def default_nvec(dataMap: dict, task: str) -> int:
+    kind, _ = binpack.task_kind(task)
+    return dataMap['num_vecs'] if kind == 'eigs' else dataMap['NT']
+
+
+def collect_samples(dataMap: dict, jobs: int = 8) -> dict:
+    '''timing samples of an ensemble keyed by (task, cfg)
+
+    A stamp pair is the job walltime and takes precedence over the chroma total
+    time; a START without FINISH marks a run that hit its walltime limit. A
+    configuration split into parts takes the sum of the times of its parts, so
+    samples stay comparable with unsplit runs.
+    '''
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        parsed = pool.map(parse_file, log_files(dataMap))
+        records = [record for file_records in parsed for record in file_records]
+    parts = {}
+    for task, cfg, part, source, minutes, gpus in records:
+        sample = parts.setdefault((task, cfg), {}).setdefault(part, {'stamp': None, 'chroma': None, 'gpus': None, 'unfinished': False})
+        if minutes is None:
+            sample['unfinished'] = True
+            continue
+        sample[source] = max(sample[source] or 0, minutes)
+        if gpus:
+            sample['gpus'] = gpus
+    samples = {}
+    for (task, cfg), by_part in parts.items():
+        minutes = [part['stamp'] or part['chroma'] for part in by_part.values()]
+        complete = all(minutes)
+        samples[(task, cfg)] = {
+            'minutes': sum(minutes) if complete else None,
+            'unfinished': not complete and any(part['unfinished'] for part in by_part.values()),
+            'gpus': next((part['gpus'] for part in by_part.values() if part['gpus']), None) or ensemble_gpus(dataMap, task),
+        }
+    return samples
+
+
+def fit(points: list) -> dict:
+    '''least squares of log(gpu_minutes) on log(work); fixed exponent 1 unless work varies'''
+    logs = [(math.log(work), math.log(gpu_minutes)) for work, gpu_minutes in points]
+    xs = [x for x, _ in logs]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(y for _, y in logs) / len(logs)
+    var = sum((x - x_mean) ** 2 for x in xs)
+    exponent = 1.0
+    if len(points) >= 3 and var > 1e-6:
+        exponent = sum((x - x_mean) * (y - y_mean) for x, y in logs) / var
+    log_coef = y_mean - exponent * x_mean
+    ratios = sorted(math.exp(y - log_coef - exponent * x) for x, y in logs)
+    spread = ratios[min(len(ratios) - 1, int(math.ceil(0.95 * len(ratios))) - 1)]
+    return {'coef': math.exp(log_coef), 'exponent': exponent, 'spread': max(1.0, spread), 'samples': len(points)}
+
+
+def fit_model(ensembles: list) -> dict:
+    '''per task kind cost model from the samples of several (dataMap, samples) pairs'''
+    points = {}
+    for dataMap, samples in ensembles:
+        for (task, _), sample in samples.items():
+            if not sample['minutes']:
+                continue
+            kind, _ = binpack.task_kind(task)
+            work = binpack.task_work(dataMap, task, default_nvec(dataMap, task))
+            points.setdefault(kind, []).append((work, sample['minutes'] * sample['gpus']))
+    return {'version': MODEL_VERSION, 'tasks': {kind: fit(kind_points) for kind, kind_points in sorted(points.items())}}
+
+
+def predict(model: dict, dataMap: dict, task: str, margin: float = 1.0, gpus: int = None):
+    '''predicted walltime in minutes of one configuration, None if the task kind was never fitted'''
+    kind, _ = binpack.task_kind(task)
+    params = model['tasks'].get(kind)
+    if params is None:
+        return None
+    work = binpack.task_work(dataMap, task, default_nvec(dataMap, task))
+    gpu_minutes = params['coef'] * work ** params['exponent'] * params['spread']
+    return gpu_minutes / (gpus or ensemble_gpus(dataMap, task)) * margin
+
+
+def load_model(path: str) -> dict:
+    with open(path) as f:
+        model = json.load(f)
+    if model.get('version') != MODEL_VERSION:
+        raise ValueError(f"{path}: unsupported walltime model version {model.get('version')}")
+    return model
+
+
+def save_model(path: str, model: dict) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(model, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def apply_walltimes(dataMap: dict, model: dict, list_tasks, margin: float) -> dict:
+    '''set the *_chroma_minutes of the requested tasks from the model; returns the changes
+
+    Tasks sharing a key (the peram flavors, meson and meson2) get the longest prediction.
+    prop_chroma_minutes is per flavor, so a combined peram task counts with its
+    prediction split over its flavors. meson_chroma_minutes is per configuration,
+    like the samples; its parts get their share of it as meson_part_minutes
+    (yml_to_xml/meson_parts.py), the share scripts/create_binned_tasks.py packs.
+    '''
+    minutes = {}
+    for task in list_tasks:
+        predicted = predict(model, dataMap, task, margin)
+        if predicted is None:
+            continue
+        predicted /= len(task.split('+'))
+        kind, _ = binpack.task_kind(task)
+        key = f'{binpack.TASK_PREFIX[kind]}_chroma_minutes'
+        minutes[key] = max(minutes.get(key, 0), max(MIN_MINUTES, int(math.ceil(predicted))))
+    changes = {}
+    for key, value in minutes.items():
+        if dataMap.get(key) != value:
+            changes[key] = (dataMap.get(key), value)
+        dataMap[key] = value
+    return changes
+
+
+def report(model: dict, ensembles: list, margin: float) -> None:
+    '''predicted against measured walltimes per ensemble and task'''
+    print(f"{'ensemble':<14}{'task':<22}{'runs':>5}{'unfin':>6}{'median':>8}{'max':>8}{'yaml':>7}{'pred':>7}")
+    for dataMap, samples in ensembles:
+        by_task = {}
+        for (task, _), sample in samples.items():
+            by_task.setdefault(task, []).append(sample)
+        for task, task_samples in sorted(by_task.items()):
+            times = sorted(s['minutes'] for s in task_samples if s['minutes'])
+            unfinished = sum(s['unfinished'] for s in task_samples)
+            kind, _ = binpack.task_kind(task)
+            hand_set = dataMap.get(f'{binpack.TASK_PREFIX[kind]}_chroma_minutes', '-')
+            predicted = predict(model, dataMap, task, margin)
+            median = f'{times[len(times) // 2]:.1f}' if times else '-'
+            longest = f'{times[-1]:.1f}' if times else '-'
+            pred = f'{predicted:.0f}' if predicted else '-'
+            print(f"{dataMap['ens_short']:<14}{task:<22}{len(times):>5}{unfinished:>6}{median:>8}{longest:>8}"
+                  f"{hand_set:>7}{pred:>7}")
+    for kind, params in model['tasks'].items():
+        print(f"{kind}: gpu_minutes = {params['coef']:.3g} * work^{params['exponent']:.3f}, "
+              f"spread {params['spread']:.2f}, {params['samples']} runs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit chroma walltimes on past runs and report predicted against actual times.")
+    parser.add_argument('--ini', type=str, help='Ensemble YAML file')
+    parser.add_argument('--ini_dir', type=str, help='Directory of ensemble YAML files')
+    parser.add_argument('--model', type=str, default='walltime_model.json', help='Model file to write (default: %(default)s)')
+    parser.add_argument('--margin', type=float, default=1.25, help='Safety factor on the predicted walltime (default: %(default)s)')
+    parser.add_argument('--report_only', action='store_true', help='Compare against an existing --model instead of refitting')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Log files parsed concurrently (default: %(default)s)')
+    args = parser.parse_args()
+    if not (args.ini or args.ini_dir):
+        parser.error("One of --ini or --ini_dir must be provided")
+
+    if args.ini_dir:
+        yaml_files = sorted(os.path.join(root, file) for root, _, files in os.walk(args.ini_dir)
+                            for file in files if file.endswith('.yml') or file.endswith('.yaml'))
+    else:
+        yaml_files = [args.ini]
+    ensembles = []
+    for yaml_file in yaml_files:
+        dataMap = completeness.load_ensemble_data(yaml_file)
+        ensembles.append((dataMap, collect_samples(dataMap, args.jobs)))
+    if args.report_only:
+        model = load_model(args.model)
+    else:
+        model = fit_model(ensembles)
+        if not model['tasks']:
+            raise SystemExit("No finished runs found to fit on")
+        save_model(args.model, model)
+        print(f"Wrote walltime model: {args.model}")
+    report(model, ensembles, args.margin)
+
+
+if __name__ == '__main__':
+    main()
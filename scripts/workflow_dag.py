@@ -0,0 +1,238 @@
+'''per-configuration job DAG and slurm submit plan for the generated launch scripts
+
+Perambulators and meson elementals read the distillation basis written by the eigs
+job of the same configuration, so they are submitted with --dependency=afterok on
+it instead of starting, finding no eigs file and exiting. Disconnected loops only
+need the gauge field and have no dependency; their shards run as one array job
+per configuration, followed by the disco_merge job reducing them; when only some
+shards are missing the array is submitted with --array= of those. A fused job
+computes its own eigs and has no dependency either. Jobs whose
+output already exists are left out of the plan, and dependents of those run
+without waiting.
+
+The plan is written as a shell script that honours $SBATCH, and can also be
+submitted directly; both accept a stand-in such as scripts/fake_sbatch.py.
+'''
+import os
+import shlex
+import subprocess
+
+from scripts import completeness
+
+# tasks rendered as one slurm array job per configuration over all their parts
+ARRAY_TASKS = ('disco',)
+# tasks whose single job per configuration writes all parts of several output types
+FUSED_TASKS = ('fused',)
+# joins the flavors of a combined peram task in directory, file, job and shell variable
+# names; --list_tasks and the START/FINISH stamps keep the +
+NAME_SEP = '_and_'
+
+
+class Node:
+    def __init__(self, task, cfg_id, script, output_type, deps, part='', array=False, reducer=False):
+        self.task = task
+        self.cfg_id = cfg_id
+        self.part = part
+        self.script = script
+        self.output_type = output_type
+        self.deps = deps
+        # an array job writes all parts of its output type, a reducer the file merged from them
+        self.array = array
+        self.reducer = reducer
+        # part suffixes of the output still missing, set by mark_done
+        self.missing = None
+        # part suffixes of an array job, in the order of its array indices
+        self.shards = []
+        self.done = False
+        self.blocked = False
+
+    @property
+    def name(self) -> str:
+        return f'{self.task}{self.part}_{self.cfg_id}'
+
+    @property
+    def var(self) -> str:
+        '''shell variable holding the slurm job id of the node'''
+        return 'j_' + safe_name(self.name).replace('-', '_')
+
+
+def safe_name(task: str) -> str:
+    '''a task, job or flavor list as written in directory, file and job names, e.g. peram_mg_light_and_peram_mg_charm'''
+    return task.replace('+', NAME_SEP)
+
+
+def peram_flavors(task: str) -> list:
+    '''(inverter, flavor) of every flavor of a peram task
+
+    peram_mg_light+peram_mg_strange+peram_clover_charm solves all three flavors in
+    one chroma run, reading the gauge field and eigs once.
+    '''
+    flavors = []
+    for name in task.split('+'):
+        parts = name.split('_')
+        if len(parts) != 3 or parts[0] != 'peram':
+            raise ValueError(f"Invalid peram task: {name}. Use peram_mg_light, peram_clover_charm, etc.")
+        _, inverter_type, flavor = parts
+        if inverter_type not in ['mg', 'clover']:
+            raise ValueError(f"Invalid inverter: {inverter_type}")
+        if flavor not in ['light', 'strange', 'charm']:
+            raise ValueError(f"Invalid flavor: {flavor}")
+        if any(flavor == other for _, other in flavors):
+            raise ValueError(f"Flavor {flavor} appears twice in {task}")
+        flavors.append((inverter_type, flavor))
+    return flavors
+
+
+def peram_output_type(flavor: str) -> str:
+    return 'peram' if flavor == 'light' else f'peram_{flavor}'
+
+
+def task_spec(task: str):
+    '''(run object, launch directory, output type, upstream task kind) of a --list_tasks entry
+
+    The output type of a combined peram task joins those of its flavors with +,
+    its launch directory its flavors and inverters with NAME_SEP.
+    '''
+    if task == 'eigs':
+        return 'eigs', 'ini-eigs', 'eigs', None
+    if task.startswith('peram'):
+        flavors = peram_flavors(task)
+        inverter_type = NAME_SEP.join(inverter for inverter, _ in flavors)
+        flavor = NAME_SEP.join(flavor for _, flavor in flavors)
+        output_type = '+'.join(peram_output_type(flavor) for _, flavor in flavors)
+        return 'peram', f'ini-perams-{flavor}-{inverter_type}', output_type, 'eigs'
+    if task in ('meson', 'meson2'):
+        return task, f'ini-{task}', task, 'eigs'
+    if task == 'disco':
+        return 'disco', 'ini-disco', 'disco', None
+    if task == 'fused':
+        return 'fused', 'ini-fused', 'fused', None
+    raise ValueError(f"Unknown task: {task}")
+
+
+def build_dag(dataMap: dict, list_tasks, cfg_ids) -> list:
+    '''nodes of every (cfg, task, part), each configuration's eigs ahead of its dependents'''
+    list_tasks = sorted(dict.fromkeys(list_tasks), key=lambda t: t != 'eigs')
+    specs = {task: task_spec(task) for task in list_tasks}
+    parts = {task: [''] if task in FUSED_TASKS else completeness.default_parts(dataMap, specs[task][2])
+             for task in list_tasks}
+    nodes = []
+    for cfg_id in cfg_ids:
+        for task in list_tasks:
+            obj, task_dir, output_type, upstream = specs[task]
+            deps = [f'{upstream}_{cfg_id}'] if upstream else []
+            cfg_dir = os.path.join(dataMap['launch_path'], task_dir, f'cnfg{cfg_id:02d}')
+            if task in ARRAY_TASKS:
+                node = Node(task, cfg_id, os.path.join(cfg_dir, f'{obj}_cfg{cfg_id:02d}.sh'), output_type, deps, array=True)
+                node.shards = parts[task]
+                nodes.append(node)
+                if len(parts[task]) > 1:
+                    nodes.append(Node(f'{task}_merge', cfg_id, os.path.join(cfg_dir, f'{obj}_merge_cfg{cfg_id:02d}.sh'),
+                                      output_type, [f'{task}_{cfg_id}'], reducer=True))
+                continue
+            for part in parts[task]:
+                script = os.path.join(cfg_dir, f'{obj}_cfg{cfg_id:02d}{part}.sh')
+                nodes.append(Node(task, cfg_id, script, output_type, deps, part))
+    return nodes
+
+
+def node_output_types(dataMap: dict, node: Node) -> list:
+    if node.output_type == 'fused':
+        from yml_to_xml import fused
+        return fused.output_types(dataMap)
+    return node.output_type.split('+')
+
+
+def mark_done(dataMap: dict, nodes: list) -> None:
+    '''flag nodes whose output exists, and nodes whose upstream is neither done nor planned'''
+    output_types = {output_type for node in nodes for output_type in node_output_types(dataMap, node)} | {'eigs'}
+    missing = completeness.find_missing(dataMap, output_types, exts=['sdb'], parts=True)
+    missing_cfgs = {file_type: by_cfg for (file_type, _, _), by_cfg in missing.items()}
+    by_name = {node.name: node for node in nodes}
+    merged = set()
+    if any(node.reducer for node in nodes):
+        try:
+            merged = set(os.listdir(completeness.output_dir(dataMap, 'disco')))
+        except FileNotFoundError:
+            pass
+    for node in nodes:
+        # a combined peram job is done once every flavor has the part, a fused job once every output is complete
+        missing_parts = sorted({part for output_type in node_output_types(dataMap, node)
+                                for part in missing_cfgs[output_type].get(node.cfg_id, [])})
+        node.missing = missing_parts
+        if node.reducer:
+            # reduced into one sdb by disco_merge_cmd, or indexed by scripts/merge_disco_shards.py
+            node.done = any(f'disco_cfg{node.cfg_id:02d}{ext}' in merged for ext in ('.sdb', '.shards.json'))
+        elif node.array or node.task in FUSED_TASKS:
+            node.done = not missing_parts
+        else:
+            node.done = node.part not in missing_parts
+    for node in nodes:
+        for dep in node.deps:
+            upstream = by_name.get(dep)
+            if upstream is None and node.cfg_id in missing_cfgs['eigs']:
+                node.blocked = True
+
+
+def pending(nodes: list) -> list:
+    return [node for node in nodes if not node.done and not node.blocked]
+
+
+def sbatch_options(node: Node) -> list:
+    '''options overriding the #SBATCH of a script: --array of the missing shards of a partly done array job'''
+    if not node.array or not node.missing or len(node.missing) == len(node.shards):
+        return []
+    from scripts import slurm_array
+    return ['--array=' + slurm_array.array_spec(sorted(node.shards.index(part) for part in node.missing))]
+
+
+def dependency_vars(node: Node, by_name: dict) -> list:
+    return [by_name[dep].var for dep in node.deps if dep in by_name and not by_name[dep].done]
+
+
+def write_plan(path: str, nodes: list) -> int:
+    '''write the submit plan as a shell script; returns the number of jobs in it'''
+    by_name = {node.name: node for node in nodes}
+    lines = ['#!/bin/bash', '# submit plan generated by create_tasks_ens.py', 'SBATCH=${SBATCH:-sbatch}', 'set -e', '']
+    jobs = pending(nodes)
+    for node in jobs:
+        dep_vars = dependency_vars(node, by_name)
+        dependency = f' --dependency=afterok:{":".join("$" + v for v in dep_vars)}' if dep_vars else ''
+        options = ''.join(' ' + option for option in sbatch_options(node))
+        lines.append(f'{node.var}=$($SBATCH --parsable{dependency}{options} {shlex.quote(node.script)})')
+        lines.append(f'echo "{node.name} ${node.var}"')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(path, 0o755)
+    return len(jobs)
+
+
+def submit(nodes: list, sbatch: str = 'sbatch') -> dict:
+    '''submit the pending nodes in order; returns the job id of every submitted node'''
+    by_name = {node.name: node for node in nodes}
+    job_ids = {}
+    for node in pending(nodes):
+        deps = [by_name[dep] for dep in node.deps if dep in by_name and not by_name[dep].done]
+        if any(dep.name not in job_ids for dep in deps):
+            print(f"Skipping {node.name}: upstream submission failed")
+            continue
+        cmd = shlex.split(sbatch) + ['--parsable']
+        if deps:
+            cmd.append('--dependency=afterok:' + ':'.join(job_ids[dep.name] for dep in deps))
+        cmd += sbatch_options(node)
+        cmd.append(node.script)
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error submitting {node.name}: {result.stderr.strip()}")
+            continue
+        job_ids[node.name] = result.stdout.strip().split(';')[0]
+    return job_ids
+
+
+def print_plan(ens_short: str, nodes: list) -> None:
+    done = sum(node.done for node in nodes)
+    blocked = [node.name for node in nodes if node.blocked and not node.done]
+    print(f"{ens_short}: {len(pending(nodes))} jobs to submit, {done} already done, {len(blocked)} blocked")
+    if blocked:
+        print(f"  blocked (eigs missing and not requested): {', '.join(blocked[:10])}"
+              + (' ...' if len(blocked) > 10 else ''))
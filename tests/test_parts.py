@@ -0,0 +1,104 @@
+'''the parts and shards a configuration is split into cover its work exactly once'''
+import itertools
+
+import pytest
+
+from yml_to_xml import disco_parts, meson_parts, momenta, peram_parts
+
+
+def covered_slices(slabs, NT):
+    return [(t_source + t) % NT for t_source, nt_forward in slabs for t in range(nt_forward)]
+
+
+@pytest.mark.parametrize('t_start, NT, n_parts, max_tslices', [
+    (0, 64, 1, 1), (0, 64, 4, 1), (10, 64, 3, 4), (0, 10, 4, 4), (5, 48, 7, 8), (0, 8, 20, 1), (63, 64, 2, 16),
+])
+def test_time_slabs_cover_every_slice_once(t_start, NT, n_parts, max_tslices):
+    slabs = meson_parts.time_slabs(t_start, NT, n_parts, max_tslices)
+    assert 1 <= len(slabs) <= n_parts
+    assert sorted(covered_slices(slabs, NT)) == list(range(NT))
+    assert slabs[0][0] == t_start % NT
+
+
+def test_time_slabs_are_whole_batches():
+    slabs = meson_parts.time_slabs(10, 64, 3, 4)
+    assert slabs == [(10, 24), (34, 20), (54, 20)]
+    # only the last slab may hold a partial batch
+    assert meson_parts.time_slabs(0, 10, 4, 4) == [(0, 4), (4, 4), (8, 2)]
+
+
+@pytest.mark.parametrize('n, max_per_job', [(10, 0), (10, 10), (10, 3), (33, 8), (7, 1)])
+def test_chunk_momenta_partition(n, max_per_job):
+    moms = [f'{i} 0 0' for i in range(n)]
+    chunks = momenta.chunk_momenta(moms, max_per_job)
+    assert list(itertools.chain(*chunks)) == moms
+    if max_per_job:
+        assert max(len(chunk) for chunk in chunks) <= max_per_job
+        assert len(chunks) == -(-n // max_per_job)
+    assert max(map(len, chunks)) - min(map(len, chunks)) <= 1
+
+
+def test_meson_parts_cover_momenta_and_slices_once():
+    dataMap = {'NT': 64, 't_start': 10, 'mom2_min': 0, 'mom2_max': 3, 'max_moms_per_job': 9,
+               'meson_chroma_parts': 3, 'meson_chroma_max_tslices_in_contraction': 4, 'meson_chroma_minutes': 120}
+    parts = meson_parts.meson_parts(dataMap, 'meson')
+    moms = momenta.meson_momenta(dataMap, 'meson')
+    covered = [(mom, t) for part in parts for mom in part['momentum_list']
+               for t in covered_slices([(part['meson_t_source'], part['meson_t_fwd'])], 64)]
+    assert sorted(covered) == sorted(itertools.product(moms, range(64)))
+    assert len({part['part_suffix'] for part in parts}) == len(parts)
+    assert sum(part['meson_part_share'] for part in parts) == pytest.approx(1)
+    assert all(part['meson_part_minutes'] >= 120 * part['meson_part_share'] for part in parts)
+
+
+def test_single_meson_part_keeps_plain_name():
+    parts = meson_parts.meson_parts({'NT': 64, 'meson_chroma_minutes': 30}, 'meson')
+    assert [part['part_suffix'] for part in parts] == ['']
+    assert parts[0]['meson_part_minutes'] == 30
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'prop_t_source_shards': 3}, {'prop_t_source_shards': 100}, {'prop_max_minutes': 50},
+])
+def test_peram_shards_cover_sources_once(options):
+    dataMap = {'NT': 96, 'prop_t_fwd': 96, 'num_tsrc': 8, 'prop_chroma_minutes': 240, **options}
+    shards = peram_parts.peram_shards(dataMap)
+    sources = [int(t) for shard in shards for t in shard['prop_t_source_list'].split()]
+    assert sources == peram_parts.t_sources(dataMap) == list(range(0, 96, 8))
+    assert len({shard['part_suffix'] for shard in shards}) == len(shards)
+
+
+def test_peram_shard_counts_and_minutes():
+    dataMap = {'NT': 96, 'num_tsrc': 8, 'prop_chroma_minutes': 240, 'prop_max_minutes': 50}
+    shards = peram_parts.peram_shards(dataMap)
+    # 12 sources of 20 minutes: 2 per 50 minute shard
+    assert [shard['part_suffix'] for shard in shards] == ['_t0', '_t1', '_t2', '_t3', '_t4', '_t5']
+    assert all(shard['prop_shard_minutes'] <= 50 for shard in shards)
+    # a job of two flavors solves every source twice
+    assert [s['prop_shard_minutes'] for s in peram_parts.peram_shards(dataMap, n_flavors=2)] == \
+        [2 * s['prop_shard_minutes'] for s in shards]
+    # never more shards than sources
+    assert len(peram_parts.peram_shards({**dataMap, 'prop_t_source_shards': 50, 'prop_max_minutes': None})) == 12
+
+
+@pytest.mark.parametrize('max_colors, at_once, t_list, per_job', [
+    (16, 0, None, None), (16, 4, None, 16), (10, 4, '0 8 16 24', 3), (1, 1, [0, 32], 1),
+])
+def test_disco_shards_cover_colors_and_sources_once(max_colors, at_once, t_list, per_job):
+    dataMap = {'NT': 48, 'disco_max_colors': max_colors, 'disco_max_colors_at_once': at_once,
+               'disco_t_source_list': t_list, 'disco_t_sources_per_job': per_job}
+    shards = disco_parts.disco_shards(dataMap)
+    covered = [(color, int(t)) for shard in shards
+               for color in range(shard['disco_first_color'], shard['disco_first_color'] + shard['disco_num_colors'])
+               for t in shard['disco_t_sources'].split()]
+    assert sorted(covered) == sorted(itertools.product(range(max_colors), disco_parts.t_source_list(dataMap)))
+    assert len({shard['part_suffix'] for shard in shards}) == len(shards)
+    assert all(shard['t_offset'] == int(shard['disco_t_sources'].split()[0]) for shard in shards)
+
+
+def test_disco_shard_suffixes():
+    dataMap = {'NT': 48, 'disco_max_colors': 10, 'disco_max_colors_at_once': 4,
+               'disco_t_source_list': '0 8 16', 'disco_t_sources_per_job': 2}
+    assert disco_parts.shard_suffixes(dataMap) == ['_c0_t0', '_c0_t1', '_c1_t0', '_c1_t1', '_c2_t0', '_c2_t1']
+    assert disco_parts.color_parts(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert disco_parts.shard_suffixes({**dataMap, 'disco_max_colors_at_once': 0, 'disco_t_sources_per_job': None}) == ['']
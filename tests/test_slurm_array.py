@@ -0,0 +1,32 @@
+import pytest
+
+from scripts import completeness, slurm_array
+
+
+@pytest.mark.parametrize('indices, throttle, spec', [
+    ([0], None, '0'),
+    ([0, 1, 2, 3], None, '0-3'),
+    ([0, 1, 2, 3, 7, 9, 10, 11, 12], 8, '0-3,7,9-12%8'),
+    ([3, 5, 12], None, '3,5,12'),
+    ([4, 5], 2, '4-5%2'),
+])
+def test_array_spec(indices, throttle, spec):
+    assert slurm_array.array_spec(indices, throttle) == spec
+
+
+@pytest.mark.parametrize('value, minutes', [
+    ('90', 90), ('30:30', 30.5), ('2:15:00', 135), ('1-2', 1560), ('1-2:30', 1590), ('1-00:00:30', 1440.5),
+    ('', None), (None, None),
+])
+def test_parse_limit(value, minutes):
+    assert slurm_array.parse_limit(value) == minutes
+
+
+@pytest.mark.parametrize('cfgs, spec', [
+    ([11, 21, 31, 41], '11-41/10'),
+    ([351, 11, 21, 31], '11-31/10, 351'),
+    ([11, 31, 51], '11, 31, 51'),
+    ([], ''),
+])
+def test_compress_ranges(cfgs, spec):
+    assert completeness.compress_ranges(cfgs, 10) == spec
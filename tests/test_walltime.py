@@ -0,0 +1,36 @@
+import math
+
+import pytest
+
+from scripts import walltime
+
+
+def test_fit_recovers_power_law():
+    points = [(work, 3e-6 * work ** 1.3) for work in (1e6, 4e6, 2e7, 1e8)]
+    params = walltime.fit(points)
+    assert params['exponent'] == pytest.approx(1.3)
+    assert params['coef'] == pytest.approx(3e-6)
+    assert params['spread'] == pytest.approx(1.0)
+    assert params['samples'] == 4
+
+
+def test_fit_keeps_linear_exponent_with_fixed_work():
+    params = walltime.fit([(1e6, 10.0), (1e6, 20.0)])
+    assert params['exponent'] == 1.0
+    assert params['coef'] == pytest.approx(math.sqrt(200) / 1e6)
+    # the slower sample is covered by the spread
+    assert params['coef'] * 1e6 * params['spread'] == pytest.approx(20.0)
+
+
+@pytest.mark.parametrize('name, parent, expected', [
+    ('eigs_11.log', 'eigs', ('eigs', 11, '')),
+    ('meson_64_cfg11.log', 'meson', ('meson', 11, '')),
+    ('meson_64_cfg11_mom1_t2.log', 'meson2', ('meson2', 11, '_mom1_t2')),
+    ('disco_cfg11_c1_t0.out', 'disco', ('disco', 11, '_c1_t0')),
+    ('fused_cfg21.log', 'fused', ('fused', 21, '')),
+    ('perams_light_mg_31_t3.log', 'perams', ('peram_mg_light', 31, '_t3')),
+    ('perams_light_and_strange_mg_and_mg_11.log', 'perams', ('peram_mg_light+peram_mg_strange', 11, '')),
+    ('notes.log', 'eigs', None),
+])
+def test_part_from_name(name, parent, expected):
+    assert walltime.part_from_name(name, parent) == expected
@@ -0,0 +1,55 @@
+'''shards one configuration of the disconnected loops is split into
+
+DISCO_PROBING_3D_DEFLATION_SUPERB probes disco_max_colors colors of the
+distance-disco_probing_displacement coloring. A shard covers one color part of
+at most disco_max_colors_at_once colors, starting at first_color, and one group
+of at most disco_t_sources_per_job time sources of disco_t_source_list (all time
+slices by default). Shards are independent: they run as the tasks of one slurm
+array job per configuration and write disco_cfg<cfg>_c<i>_t<k>.sdb. The traces
+of different color parts add up and different time groups hold different time
+slices; scripts/merge_disco_shards.py reduces the shards of a configuration.
+'''
+from typing import List
+
+
+def num_color_parts(max_colors: int, max_colors_at_once: int) -> int:
+    return -(-max_colors // max(1, max_colors_at_once or max_colors))
+
+
+def color_parts(max_colors: int, max_colors_at_once: int) -> List[tuple]:
+    '''(first_color, num_colors) of every color part, the last one holding the remainder'''
+    at_once = max(1, max_colors_at_once or max_colors)
+    return [(first, min(at_once, max_colors - first)) for first in range(0, max_colors, at_once)]
+
+
+def t_groups(t_sources: list, per_job: int = None) -> List[list]:
+    '''consecutive groups of at most per_job time sources'''
+    per_job = per_job or len(t_sources)
+    return [t_sources[i:i + per_job] for i in range(0, len(t_sources), per_job)]
+
+
+def t_source_list(dataMap: dict) -> List[int]:
+    t_sources = dataMap.get('disco_t_source_list')
+    if t_sources is None:
+        return list(range(dataMap['NT']))
+    if isinstance(t_sources, str):
+        return [int(t) for t in t_sources.split()]
+    return [int(t) for t in t_sources]
+
+
+def disco_shards(dataMap: dict) -> List[dict]:
+    '''render variables of every shard: suffix, color part and time sources'''
+    colors = color_parts(dataMap['disco_max_colors'], dataMap['disco_max_colors_at_once'])
+    groups = t_groups(t_source_list(dataMap), dataMap.get('disco_t_sources_per_job'))
+    shards = []
+    for i, (first_color, num_colors) in enumerate(colors):
+        for k, group in enumerate(groups):
+            suffix = (f'_c{i}' if len(colors) > 1 else '') + (f'_t{k}' if len(groups) > 1 else '')
+            shards.append({'part_suffix': suffix, 'color_part': i, 'disco_first_color': first_color,
+                           'disco_num_colors': num_colors, 't_offset': group[0],
+                           'disco_t_sources': ' '.join(str(t) for t in group)})
+    return shards
+
+
+def shard_suffixes(dataMap: dict) -> List[str]:
+    return [shard['part_suffix'] for shard in disco_shards(dataMap)]
@@ -1,17 +1,11 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, model_validator
 from typing import List
 
-def _gen_mom_list():
-   momentum_list: List[str] = [
-        "0 0 0", "1 0 0", "-1 0 0",
-        "0 1 0", "0 -1 0", "0 0 1",
-        "0 0 -1", "2 0 0", "-2 0 0",
-        "0 2 0", "0 -2 0", "0 0 2",
-        "0 0 -2", "3 0 0", "-3 0 0",
-        "0 3 0", "0 -3 0", "0 0 3",
-        "0 0 -3"
-    ]
-   return momentum_list
+from yml_to_xml import disco_parts, momenta
+
+def _gen_mom_list() -> List[str]:
+    '''zero and the on-axis momenta up to |p| = 3'''
+    return momenta.axis_momenta(3)
 
 
 def  _displacement_list()->List[str]: 
@@ -26,29 +20,27 @@ class Disco(BaseModel):
     # universal imports for a given ensemble 
     NL: int
     NT: int
-    prop_mass_light_label: str 
-    prop_clov_coeff: int 
+    prop_mass_light_label: float
+    prop_clov_coeff: float
     cfg_name: str 
 
     t_start: int
     ens_short: str
-    disco_t_source_list: list #HARDCODED RIGHT NOW 0-64
     disco_max_rhs: int
     disco_probing_displacement: int
     disco_probing_power: int
     disco_max_colors_at_once: int
     disco_max_colors: int
     disco_noise_vectors: int
-    num_color_parts:int = Field(init=False)
     disco_displacement_list: List[str] = ['', '1', '2', '3', '1 1', '2 2', '3 3', '1 2', '1 3', '2 1', '2 3', '3 1', '3 2']
 
     run_path:str
     #link smearing options 
     cfg_path: str
-    num_color_parts: int = 14
-
-    def __post_init__(self):
-        # Calculate num_color_parts after initialization
-            self.num_color_parts = (self.disco_max_colors + self.disco_max_colors_at_once - 1) // self.disco_max_colors_at_once
+    num_color_parts: int = 0
 
-            3325 + 256-1 // 256
\ No newline at end of file
+    @model_validator(mode='after')
+    def _count_color_parts(self):
+        # pydantic models never call __post_init__, so the count is derived here
+        self.num_color_parts = disco_parts.num_color_parts(self.disco_max_colors, self.disco_max_colors_at_once)
+        return self
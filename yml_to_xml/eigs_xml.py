@@ -14,10 +14,11 @@ class Eigs(BaseModel):
     run_path:str
     eigs_tasks_node: int
     ens_short: str 
-    P: int 
+    P: Optional[int] = None  # stream; not in the long tag of the mc ensembles
     beta: Decimal = Field(max_digits=5, decimal_places=2)
-    ms: Decimal = Field(max_digits=5, decimal_places=3)
-    mud: Decimal= Field(max_digits=5, decimal_places=3)
+    ms: Optional[Decimal] = Field(default=None, max_digits=5, decimal_places=3)
+    mc: Optional[Decimal] = Field(default=None, max_digits=5, decimal_places=3)
+    mud: Decimal= Field(max_digits=5, decimal_places=4)
     Frequency: int
     max_nvec: int # colorvecs to compute
     num_vecs: int # colorvecs to use
@@ -0,0 +1,89 @@
+'''registry of the gauge ensembles, read from ensembles.yml
+
+The short tag of an ensemble (the name of its yaml, e.g. a125m400) maps to the
+long tag of its configurations (b3.30_ms-0.057_mud-0.1200_s16t64-000), which
+holds beta, the quark masses, the lattice size and the stream. The file is read
+and every tag parsed once per process; lookups return a copy of the cached
+result. Two naming conventions are in use:
+
+- b<beta>_ms<ms>_mud-<mud>_s<NL>t<NT>-<P>: 2+1 flavor ensembles,
+  configurations under .../6stout/beta_<beta>/ms_<ms>/mud_-<mud>/s<NL>t<NT>/cnfg/
+- b<beta>_mc<mc>_mud-<mud>_s<NL>t<NT>: 3+1 flavor ensembles with a charm mass,
+  configurations under .../NF3P1/B<beta>/B<beta>_M-<mud>M<mc>_L<NL>T<NT>/NS8_LS1_G2
+
+Besides the parsed fields, an entry has volume (NL^3 NT) and the default
+cfg_path and cfg_name of its configurations, which the ensemble yaml overrides.
+'''
+import functools
+import os
+import re
+from typing import Any, Dict
+
+import yaml
+
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ensembles.yml')
+PATTERNS = [
+    re.compile(r"b(?P<beta>[0-9]+\.[0-9]+)_ms(?P<ms>-?[0-9]+\.[0-9]+)_mud-(?P<mud>[0-9]+\.[0-9]+)"
+               r"_s(?P<NL>[0-9]+)t(?P<NT>[0-9]+)-(?P<P>[0-9]{3})"),
+    re.compile(r"b(?P<beta>[0-9]+\.[0-9]+)_mc(?P<mc>[0-9]+\.[0-9]+)_mud-(?P<mud>[0-9]+\.[0-9]+)"
+               r"_s(?P<NL>[0-9]+)t(?P<NT>[0-9]+)"),
+]
+TYPES = {'beta': str, 'ms': str, 'mud': str, 'mc': str, 'NL': int, 'NT': int, 'P': str}
+
+
+@functools.lru_cache(maxsize=None)
+def registry() -> Dict[str, str]:
+    '''short tag -> long tag, aliases included'''
+    with open(REGISTRY_FILE) as f:
+        data = yaml.safe_load(f)
+    tags = dict(data['ensembles'])
+    for alias, short_tag in (data.get('aliases') or {}).items():
+        tags[alias] = data['ensembles'][short_tag]
+    return tags
+
+
+def parse_long_tag(long_tag: str) -> Dict[str, Any]:
+    for pattern in PATTERNS:
+        match = pattern.fullmatch(long_tag)
+        if match:
+            return {key: TYPES[key](value) for key, value in match.groupdict().items() if value is not None}
+    raise ValueError(f"Unrecognised ensemble long tag: {long_tag}")
+
+
+def derived(info: Dict[str, Any]) -> Dict[str, Any]:
+    '''volume and the default location of the configurations'''
+    beta, mud, NL, NT = info['beta'], info['mud'], info['NL'], info['NT']
+    if 'mc' in info:
+        cfg_path = f"/p/data1/slnpp/GREGORY/CONFIGS/NF3P1/B{beta}/B{beta}_M-{mud}M{info['mc']}_L{NL}T{NT}/NS8_LS1_G2"
+        cfg_name = f"test_b{beta}_m{mud}m{info['mc']}_l{NL}t{NT}_nf3p1_cfg_"
+    else:
+        cfg_path = f"/p/project1/exotichadrons/pederiva/6stout/beta_{beta}/ms_{info['ms']}/mud_-{mud}/s{NL}t{NT}/cnfg/"
+        cfg_name = f"b{beta}_ms{info['ms']}_mud-{mud}_s{NL}t{NT}-{info['P']}-n_cfg_"
+    return {'volume': NL ** 3 * NT, 'cfg_path': cfg_path, 'cfg_name': cfg_name}
+
+
+@functools.lru_cache(maxsize=None)
+def _lookup(short_tag: str) -> Dict[str, Any]:
+    tags = registry()
+    if short_tag not in tags:
+        raise ValueError(f"Unknown ensemble short tag: {short_tag}")
+    info = parse_long_tag(tags[short_tag])
+    info.update(derived(info))
+    return info
+
+
+def lookup(short_tag: str) -> Dict[str, Any]:
+    '''every field of an ensemble: parsed from the long tag plus derived'''
+    return dict(_lookup(short_tag))
+
+
+def parse_ensemble(short_tag: str) -> Dict[str, Any]:
+    '''physics parameters of an ensemble (beta, ms or mc, mud, NL, NT, P), to update the yaml data with'''
+    info = lookup(short_tag)
+    return {key: info[key] for key in TYPES if key in info}
+
+
+def defaults(short_tag: str) -> Dict[str, Any]:
+    '''derived fields of an ensemble, for the keys its yaml leaves out'''
+    info = lookup(short_tag)
+    return {key: info[key] for key in ('volume', 'cfg_path', 'cfg_name')}
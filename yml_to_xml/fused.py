@@ -0,0 +1,67 @@
+'''eigs, perambulators and meson elementals of one configuration in a single chroma run
+
+On small and medium volumes loading and smearing the gauge field and writing and
+re-reading the distillation basis between the eigs, peram and meson jobs take as
+long as the solves. The fused task chains the three in one input: the gauge field
+is read once and stays in memory, and the eigs are written once and read back by
+the measurements of the same job. The inputs of the separate jobs are reused
+(templates/*_elem.jinja.xml), with one measurement per peram flavor and shard and
+per meson part, so the outputs are the files the separate jobs would write.
+
+- fused_peram_task: flavors solved, as a (combined) peram task (default peram_mg_light)
+- fused_keep_eigs: write the eigs to eigs_path as the eigs job does (default true);
+  when false they go to fused_scratch_path and are deleted at the end of the job
+- fused_slurm_nodes, fused_num_gpu, fused_chroma_geometry: default to those of the
+  perams, the largest of the three steps; the peram geometry is only taken if it
+  fits the rank count of the fused job, else one is chosen by geometry.py
+- fused_chroma_minutes: defaults to the sum of the walltimes of the separate jobs
+
+Large volumes, where the eigs job wants a different geometry than the solves,
+keep using the separate eigs, peram and meson tasks.
+'''
+import os
+
+from yml_to_xml import geometry, meson_parts, peram_parts
+
+DEFAULT_PERAM_TASK = 'peram_mg_light'
+
+
+def peram_task(dataMap: dict) -> str:
+    return dataMap.get('fused_peram_task', DEFAULT_PERAM_TASK)
+
+
+def eigs_dir(dataMap: dict) -> str:
+    '''where the fused job writes the eigs it reads back'''
+    if dataMap.get('fused_keep_eigs', True):
+        return dataMap.get('eigs_path') or os.path.join(dataMap['data_path'], 'eigs_sdb')
+    return dataMap.get('fused_scratch_path') or os.path.join(dataMap['run_path'], 'eigs_scratch')
+
+
+def output_types(dataMap: dict) -> list:
+    '''output types written by a fused job, as in scripts/completeness.py'''
+    from scripts import workflow_dag
+    types = ['eigs'] if dataMap.get('fused_keep_eigs', True) else []
+    types += [workflow_dag.peram_output_type(flavor) for _, flavor in workflow_dag.peram_flavors(peram_task(dataMap))]
+    return types + ['meson']
+
+
+def fused_vars(dataMap: dict, peram_job: dict) -> dict:
+    '''render variables of the fused job; peram_job as built by create_tasks_ens.peram_job'''
+    shards = peram_parts.peram_shards(dataMap)
+    mesons = meson_parts.meson_parts(dataMap, 'meson')
+    n_flavors = len(peram_job['peram_flavors'])
+    requested = dataMap.get('fused_chroma_geometry')
+    # prop_chroma_minutes is per flavor, meson_chroma_minutes per configuration whatever its parts
+    minutes = (dataMap['eigs_chroma_minutes'] + dataMap['prop_chroma_minutes'] * n_flavors
+               + dataMap['meson_chroma_minutes'])
+    return dict(peram_job, **{
+        'peram_shards': shards,
+        'meson_parts': mesons,
+        'fused_keep_eigs': dataMap.get('fused_keep_eigs', True),
+        'fused_eigs_dir': eigs_dir(dataMap),
+        'fused_slurm_nodes': dataMap.get('fused_slurm_nodes', dataMap['prop_slurm_nodes']),
+        'fused_num_gpu': dataMap.get('fused_num_gpu', dataMap['num_gpu']),
+        'fused_chroma_geometry': geometry.resolve(dataMap, 'fused', requested or dataMap['prop_chroma_geometry'],
+                                                  warn=print if requested else None),
+        'fused_chroma_minutes': dataMap.get('fused_chroma_minutes', minutes),
+    })
@@ -0,0 +1,169 @@
+'''chroma -geom process grids of the jobs of an ensemble
+
+Every job runs chroma on a fixed number of MPI ranks (one per GPU, see ranks()),
+and its *_chroma_geometry must split (NL, NL, NL, NT) over exactly that many
+ranks into even local extents. A geometry left out of the yaml or set to auto is
+chosen among all factorizations of the rank count that divide the lattice:
+
+- first the ones whose per-GPU memory fits gpu_mem (GB, default 40) and, for the
+  perams, whose local lattice takes the multigrid blocking of every flavor,
+- then the smallest halo: the sites on the faces of the local lattice in the
+  partitioned directions, which are sent to the neighbours at every
+  application of the Dirac operator and held in ghost buffers,
+- then the fewest partitioned directions, splitting time before space.
+
+A geometry given in the yaml is kept if it is valid for the rank count, with a
+warning if it fails the blocking or memory checks or if a factorization with a
+smaller halo passes as many of them; an invalid one is replaced by the chosen
+one with a warning, as is a rank count no geometry works for, with the node
+counts that would.
+'''
+import itertools
+import math
+from typing import List
+
+# yaml prefix of the geometry -> task kind of scripts/binpack.py, for the memory estimate
+KINDS = {'eigs': 'eigs', 'prop': 'peram', 'meson': 'meson', 'disco': 'disco', 'fused': 'fused'}
+# yaml key of the colorvecs a job holds, num_vecs when unset
+NVEC_KEYS = {'prop': 'prop_nvec', 'meson': 'meson_nvec', 'fused': 'prop_nvec'}
+# GPUs per node of the meson jobs, fixed in templates/meson.sh.j2
+MESON_GPUS = 4
+GB = 1e9
+
+
+def lattice(dataMap: dict) -> List[int]:
+    return [dataMap['NL']] * 3 + [dataMap['NT']]
+
+
+def ranks(dataMap: dict, prefix: str) -> int:
+    '''MPI ranks chroma runs on in the job of a task, as launched by its template'''
+    if prefix == 'eigs':
+        return 1
+    if prefix == 'prop':
+        return dataMap['prop_slurm_nodes'] * dataMap['num_gpu']
+    if prefix == 'meson':
+        return dataMap['meson_slurm_nodes'] * MESON_GPUS
+    if prefix == 'disco':
+        return dataMap['disco_slurm_nodes'] * dataMap['disco_num_gpu']
+    if prefix == 'fused':
+        return (dataMap.get('fused_slurm_nodes', dataMap['prop_slurm_nodes'])
+                * dataMap.get('fused_num_gpu', dataMap['num_gpu']))
+    raise ValueError(f'unknown geometry prefix {prefix}')
+
+
+def gpus_per_node(dataMap: dict, prefix: str) -> int:
+    return {'eigs': 1, 'prop': dataMap['num_gpu'], 'meson': MESON_GPUS, 'disco': dataMap.get('disco_num_gpu', 1),
+            'fused': dataMap.get('fused_num_gpu', dataMap['num_gpu'])}[prefix]
+
+
+def factorizations(n: int) -> List[tuple]:
+    '''every (x, y, z, t) of positive integers with product n'''
+    divisors = [d for d in range(1, n + 1) if n % d == 0]
+    return [g for g in itertools.product(divisors, repeat=4) if math.prod(g) == n]
+
+
+def local_dims(dims: List[int], geometry) -> List[int]:
+    return [d // g for d, g in zip(dims, geometry)]
+
+
+def is_valid(dims: List[int], geometry) -> bool:
+    '''whether the geometry splits the lattice into equal local lattices of even extent (for even-odd preconditioning)'''
+    return len(geometry) == 4 and all(d % g == 0 and (d // g) % 2 == 0 for d, g in zip(dims, geometry))
+
+
+def halo_sites(dims: List[int], geometry) -> int:
+    '''sites of one local lattice on the faces it exchanges, both sides of every partitioned direction'''
+    local = local_dims(dims, geometry)
+    volume = math.prod(local)
+    return sum(2 * volume // extent for extent, g in zip(local, geometry) if g > 1)
+
+
+def memory_per_gpu(dataMap: dict, prefix: str, geometry) -> float:
+    '''device memory of one rank: its share of the job plus the ghost zones of a spinor per right hand side'''
+    from scripts import binpack
+    kind = KINDS[prefix]
+    nvec = dataMap.get(NVEC_KEYS.get(prefix), dataMap['num_vecs'])
+    max_rhs = dataMap.get('disco_max_rhs' if kind == 'disco' else 'max_rhs', 1)
+    total = binpack.memory_bytes(kind, dataMap['NL'], dataMap['NT'], nvec, max_rhs)
+    return total / math.prod(geometry) + halo_sites(lattice(dataMap), geometry) * 12 * 16 * max_rhs
+
+
+def blocking_fits(dataMap: dict, prefix: str, geometry) -> bool:
+    '''whether the multigrid blocking of every flavor divides the local lattice; only the perams use multigrid'''
+    if prefix not in ('prop', 'fused'):
+        return True
+    from yml_to_xml import inverter_params
+    return all(inverter_params.blocking_fits(dataMap, geometry, inverter_params.inverter_params(dataMap, flavor)['blocking'])
+               for flavor in ('light', 'strange', 'charm'))
+
+
+def score(dataMap: dict, prefix: str, geometry) -> tuple:
+    '''sort key of a valid geometry, lower is better: blocking and memory checks failed, halo, partitioned directions'''
+    dims = lattice(dataMap)
+    return (not blocking_fits(dataMap, prefix, geometry),
+            memory_per_gpu(dataMap, prefix, geometry) > dataMap.get('gpu_mem', 40) * GB,
+            halo_sites(dims, geometry), sum(g > 1 for g in geometry), tuple(-g for g in reversed(geometry)))
+
+
+def candidates(dataMap: dict, prefix: str, n_ranks: int) -> List[tuple]:
+    '''valid geometries of n_ranks ranks, best first'''
+    dims = lattice(dataMap)
+    return sorted((g for g in factorizations(n_ranks) if is_valid(dims, g)), key=lambda g: score(dataMap, prefix, g))
+
+
+def check(dataMap: dict, prefix: str, geometry, best) -> List[str]:
+    '''what is wrong with a valid geometry given in the yaml, compared to the best one'''
+    problems = []
+    if not blocking_fits(dataMap, prefix, geometry):
+        problems.append('does not take the multigrid blocking of every flavor')
+    memory = memory_per_gpu(dataMap, prefix, geometry)
+    if memory > dataMap.get('gpu_mem', 40) * GB:
+        problems.append(f"needs {memory / GB:.1f} GB per GPU, more than gpu_mem {dataMap.get('gpu_mem', 40)}")
+    if best is not None:
+        mine, theirs = score(dataMap, prefix, geometry)[:3], score(dataMap, prefix, best)[:3]
+        if theirs[:2] < mine[:2]:
+            problems.append(f'fails checks {list(best)} passes')
+        elif theirs < mine:
+            problems.append(f'exchanges {mine[2]} halo sites per rank, {list(best)} only {theirs[2]}')
+    return problems
+
+
+def working_nodes(dataMap: dict, prefix: str, per_node: int, limit: int) -> List[int]:
+    '''node counts up to limit with at least one valid geometry'''
+    dims = lattice(dataMap)
+    return [n for n in range(1, limit + 1) if any(is_valid(dims, g) for g in factorizations(n * per_node))]
+
+
+def resolve(dataMap: dict, prefix: str, requested=None, n_ranks: int = None, warn=print) -> List[int]:
+    '''geometry of the job of a task: the requested one if valid, else the best one for its rank count'''
+    n_ranks = n_ranks or ranks(dataMap, prefix)
+    dims = lattice(dataMap)
+    if isinstance(requested, (list, tuple)) and math.prod(requested) == n_ranks and is_valid(dims, requested):
+        if warn:
+            best = candidates(dataMap, prefix, n_ranks)
+            for problem in check(dataMap, prefix, requested, best[0] if best else None):
+                warn(f"Warning: {prefix}_chroma_geometry {list(requested)} {problem}")
+        return list(requested)
+    best = candidates(dataMap, prefix, n_ranks)
+    if not best:
+        per_node = gpus_per_node(dataMap, prefix)
+        nodes = working_nodes(dataMap, prefix, per_node, 4 * max(1, n_ranks // per_node))
+        if warn:
+            warn(f"Warning: no {prefix} geometry of {n_ranks} ranks divides the {'x'.join(map(str, dims))} lattice "
+                 f"into even local extents; node counts that do: {nodes or 'none'}")
+        return list(requested) if isinstance(requested, (list, tuple)) else [1, 1, 1, n_ranks]
+    if isinstance(requested, (list, tuple)) and warn:
+        warn(f"Warning: {prefix}_chroma_geometry {list(requested)} does not split the "
+             f"{'x'.join(map(str, dims))} lattice over {n_ranks} ranks, using {list(best[0])}")
+    return list(best[0])
+
+
+def resolve_all(dataMap: dict, warn=print) -> None:
+    '''set every *_chroma_geometry of the ensemble, solving the missing and auto ones'''
+    for prefix in ('eigs', 'prop', 'meson', 'disco'):
+        try:
+            n_ranks = ranks(dataMap, prefix)
+        except KeyError:
+            continue  # the yaml has no jobs of this task
+        dataMap[f'{prefix}_chroma_geometry'] = resolve(dataMap, prefix, dataMap.get(f'{prefix}_chroma_geometry'),
+                                                       n_ranks, warn)
@@ -0,0 +1,71 @@
+'''tunable solver parameters of the perambulator inverters
+
+The QUDA multigrid setup of peram_elem.jinja.xml depends on the lattice and the
+quark mass, so it is read from the ensemble yaml instead of being fixed in the
+template. Keys not given keep the values below, which are the ones every
+ensemble ran with before:
+
+    inverter_params:            # all flavors of the ensemble
+      max_rhs: 8
+    inverter_params_light:      # one flavor, as written by scripts/mg_sweep.py
+      blocking: [[4, 4, 4, 4], [2, 2, 2, 2]]
+      precision: HALF
+
+max_rhs is the number of right hand sides solved at once by either inverter
+(default: max_rhs of the yaml); the other keys only apply to the mg inverter.
+The template has three multigrid levels, hence two blockings and two null
+vector counts.
+'''
+from typing import List
+
+MG_DEFAULTS = {
+    'blocking': [[4, 4, 4, 4], [2, 2, 2, 2]],
+    'null_vectors': [24, 32],
+    'post_smoother': [8, 8],
+    'pipeline': 4,
+    'delta': 0.1,
+    'precision': 'HALF',
+    'sloppy_precision': 'SINGLE',
+}
+PRECISIONS = ('HALF', 'SINGLE', 'DOUBLE')
+LEVELS = 2
+
+
+def inverter_params(dataMap: dict, flavor: str) -> dict:
+    '''solver parameters of one flavor: defaults, then inverter_params, then inverter_params_<flavor>'''
+    params = dict(MG_DEFAULTS, max_rhs=dataMap['max_rhs'])
+    for key in ('inverter_params', f'inverter_params_{flavor}'):
+        overrides = dataMap.get(key) or {}
+        unknown = set(overrides) - set(params)
+        if unknown:
+            raise ValueError(f"{key}: unknown parameters {sorted(unknown)}, expected some of {sorted(params)}")
+        params.update(overrides)
+    check(params)
+    return params
+
+
+def check(params: dict) -> None:
+    for key in ('blocking', 'null_vectors', 'post_smoother'):
+        if len(params[key]) != LEVELS:
+            raise ValueError(f"{key} needs {LEVELS} entries, one per coarse level: {params[key]}")
+    if any(len(block) != 4 for block in params['blocking']):
+        raise ValueError(f"blocking entries need 4 dimensions: {params['blocking']}")
+    for key in ('precision', 'sloppy_precision'):
+        if params[key] not in PRECISIONS:
+            raise ValueError(f"{key} must be one of {PRECISIONS}: {params[key]}")
+
+
+def local_dims(dataMap: dict, geometry: List[int]) -> List[int]:
+    '''lattice extent of one GPU'''
+    dims = [dataMap['NL']] * 3 + [dataMap['NT']]
+    return [d // g for d, g in zip(dims, geometry)]
+
+
+def blocking_fits(dataMap: dict, geometry: List[int], blocking: List[List[int]]) -> bool:
+    '''whether every level of the blocking divides the local lattice of the level above'''
+    dims = local_dims(dataMap, geometry)
+    for block in blocking:
+        if any(d % b for d, b in zip(dims, block)):
+            return False
+        dims = [d // b for d, b in zip(dims, block)]
+    return True
@@ -0,0 +1,54 @@
+'''jobs one configuration of a meson run object is split into
+
+A configuration is split along two independent axes: momentum chunks of at most
+max_moms_per_job momenta (see momenta.py) and meson_chroma_parts time slabs.
+Each slab is a (t_source, Nt_forward) range of time slices; slabs are made of
+whole batches of meson_chroma_max_tslices_in_contraction slices, so no
+contraction batch is left partly empty, and the batches are spread evenly over
+the slabs. Every part writes its own sdb, named with a _mom<j> and/or _t<k>
+suffix; a configuration with a single part keeps the plain names.
+scripts/merge_meson_parts.py puts the parts back together.
+
+meson_chroma_minutes is the time of a whole configuration; every part gets it in
+proportion to its momenta times time slices as meson_part_minutes, its -t.
+'''
+import math
+from typing import List
+
+import numpy as np
+
+from yml_to_xml import momenta
+
+
+def time_slabs(t_start: int, NT: int, n_parts: int, max_tslices: int = 1) -> List[tuple]:
+    '''(t_source, Nt_forward) of up to n_parts slabs covering NT time slices from t_start'''
+    batch = max(1, max_tslices or 1)
+    n_batches = -(-NT // batch)
+    slabs = []
+    for batches in np.array_split(np.arange(n_batches), max(1, min(n_parts or 1, n_batches))):
+        first = int(batches[0]) * batch
+        last = min(NT, (int(batches[-1]) + 1) * batch)
+        slabs.append(((t_start + first) % NT, last - first))
+    return slabs
+
+
+def meson_parts(dataMap: dict, obj: str) -> List[dict]:
+    '''render variables of every part: suffix, momenta, time slab, share of the work and walltime'''
+    chunks = momenta.meson_chunks(dataMap, obj)
+    slabs = time_slabs(dataMap.get('t_start', 0), dataMap['NT'], dataMap.get('meson_chroma_parts', 1),
+                       dataMap.get('meson_chroma_max_tslices_in_contraction', 1))
+    total = sum(len(chunk) or 1 for chunk in chunks) * sum(nt_forward for _, nt_forward in slabs)
+    minutes = dataMap.get('meson_chroma_minutes')
+    parts = []
+    for j, chunk in enumerate(chunks):
+        for k, (t_source, nt_forward) in enumerate(slabs):
+            suffix = (f'_mom{j}' if len(chunks) > 1 else '') + (f'_t{k}' if len(slabs) > 1 else '')
+            share = (len(chunk) or 1) * nt_forward / total
+            parts.append({'part_suffix': suffix, 'momentum_list': chunk,
+                          'meson_t_source': t_source, 'meson_t_fwd': nt_forward, 'meson_part_share': share,
+                          'meson_part_minutes': max(1, math.ceil(minutes * share)) if minutes else None})
+    return parts
+
+
+def part_suffixes(dataMap: dict, obj: str) -> List[str]:
+    return [part['part_suffix'] for part in meson_parts(dataMap, obj)]
@@ -1,22 +1,11 @@
 from pydantic import BaseModel, Field
 from typing import List
 
-def _gen_mom_list():
-#    momentum_list: List[str] = [
-#         "0 0 0", "1 0 0", "-1 0 0"
-#     ]
-   momentum_list: List[str] = [
-        "0 0 0", "1 0 0", "-1 0 0",
-        "0 1 0", "0 -1 0", "0 0 1",
-        "0 0 -1", "2 0 0", "-2 0 0",
-        "0 2 0", "0 -2 0", "0 0 2",
-        "0 0 -2", "3 0 0", "-3 0 0",
-        "0 3 0", "0 -3 0", "0 0 3",
-        "0 0 -3", "1 1 0", "-1 -1 0",
-        "1 1 1", "-1 -1 -1",
-        "2 1 0", "2 1 1"
-    ]
-   return momentum_list
+from yml_to_xml import momenta
+
+def _gen_mom_list(mom2_min: int = 0, mom2_max: int = 3, reduction: str = 'none') -> List[str]:
+    '''all momenta with mom2 in [mom2_min, mom2_max], see momenta.py'''
+    return momenta.momentum_list(mom2_min, mom2_max, reduction)
 
 def _gen_mom_list2():
      momentum_list_2: List[str]= [
@@ -46,34 +35,14 @@ class Meson(BaseModel):
     NT: int
     t_start: int
     ens_short: str
-    t_source_list: list #HARDCODED RIGHT NOW 0-64
     meson_nvec: int
-    meson_zphases: list
+    meson_zphases: str
     mom2_min: int 
     mom2_max : int
     eigs_path: str 
-    momentum_list: List[str] = [
-        "0 0 0", "1 0 0", "-1 0 0",
-        "0 1 0", "0 -1 0", "0 0 1",
-        "0 0 -1", "2 0 0", "-2 0 0",
-        "0 2 0", "0 -2 0", "0 0 2",
-        "0 0 -2", "3 0 0", "-3 0 0",
-        "0 3 0", "0 -3 0", "0 0 3",
-        "0 0 -3", "1 1 0", "-1 -1 0",
-        "1 1 1", "-1 -1 -1",
-        "2 1 0", "2 1 1"
-    ]
-
-    momentum_list_2: List[str]= [
-        "1 1 0", "-1 -1 0",
-        "1 1 1", "-1 -1 -1",
-        "2 1 0", "2 1 1"
-    ]
-    # momentum_list: List[str] = [
-    #     "0 0 0", "1 0 0", "-1 0 0"
-    # ]
-    # displacement_list: List[str] = ['', '1']
-    displacement_list: List[str] = ['', '1', '2', '3', '1 1', '2 2', '3 3', '1 2', '1 3', '2 1', '2 3', '3 1', '3 2']
+    momentum_list: List[str] = Field(default_factory=_gen_mom_list)
+    momentum_list_2: List[str] = Field(default_factory=_gen_mom_list2)
+    displacement_list: List[str] = Field(default_factory=_displacement_list)
 
     meson_chroma_max_tslices_in_contraction: int
     meson_nvec: int
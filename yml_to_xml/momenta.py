@@ -0,0 +1,96 @@
+'''momentum sets of the meson elementals
+
+All integer momenta with mom2 in [mom2_min, mom2_max] are enumerated on a NumPy
+grid instead of being typed by hand. They can be reduced to one representative
+per parity pair (p ~ -p) or per orbit of the cubic group with parity, whose
+canonical member has its absolute components sorted in descending order, e.g.
+"2 1 0" for all 24 permutations and sign flips of (2, 1, 0). A reduced set only
+holds the elementals of the representatives; the others follow by symmetry in
+the analysis.
+
+Every momentum costs the same in MESON_MATELEM_COLORVEC_SUPERB (one phase and
+one contraction per displacement), so a set larger than max_moms_per_job is cut
+into the smallest number of chunks of as equal size as possible rather than
+full chunks plus a small remainder.
+'''
+from typing import List
+
+import numpy as np
+
+REDUCTIONS = ('none', 'parity', 'little_group')
+
+
+def enumerate_momenta(mom2_min: int, mom2_max: int) -> np.ndarray:
+    '''(N, 3) integer momenta with mom2_min <= p^2 <= mom2_max, ordered by p^2 with p and -p adjacent'''
+    p_max = int(np.floor(np.sqrt(max(mom2_max, 0))))
+    axis = np.arange(-p_max, p_max + 1)
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    mom2 = (grid ** 2).sum(axis=1)
+    moms = grid[(mom2 >= mom2_min) & (mom2 <= mom2_max)]
+    rep = parity_representatives(moms)
+    is_rep = (moms == rep).all(axis=1)
+    # sort keys, last one primary: p^2, then the parity representative descending, p before -p
+    order = np.lexsort((~is_rep, -rep[:, 2], -rep[:, 1], -rep[:, 0], (moms ** 2).sum(axis=1)))
+    return moms[order]
+
+
+def parity_representatives(moms: np.ndarray) -> np.ndarray:
+    '''the lexicographically larger of p and -p for every row'''
+    first = np.argmax(moms != 0, axis=1)
+    sign = np.where(moms[np.arange(len(moms)), first] < 0, -1, 1)
+    return moms * sign[:, None]
+
+
+def little_group_representatives(moms: np.ndarray) -> np.ndarray:
+    '''absolute components in descending order: one member per cubic-group orbit'''
+    return -np.sort(-np.abs(moms), axis=1)
+
+
+def reduce_momenta(moms: np.ndarray, reduction: str = 'none') -> np.ndarray:
+    '''canonical representatives in the order of their first appearance'''
+    if reduction == 'none':
+        return moms
+    if reduction == 'parity':
+        reps = parity_representatives(moms)
+    elif reduction == 'little_group':
+        reps = little_group_representatives(moms)
+    else:
+        raise ValueError(f"Unknown momentum reduction: {reduction}. Use one of {', '.join(REDUCTIONS)}")
+    _, first = np.unique(reps, axis=0, return_index=True)
+    return reps[np.sort(first)]
+
+
+def format_momenta(moms: np.ndarray) -> List[str]:
+    return [' '.join(str(int(c)) for c in mom) for mom in moms]
+
+
+def momentum_list(mom2_min: int, mom2_max: int, reduction: str = 'none') -> List[str]:
+    return format_momenta(reduce_momenta(enumerate_momenta(mom2_min, mom2_max), reduction))
+
+
+def axis_momenta(p_max: int) -> List[str]:
+    '''zero and the on-axis momenta up to |p| = p_max'''
+    moms = enumerate_momenta(0, p_max ** 2)
+    return format_momenta(moms[(moms != 0).sum(axis=1) <= 1])
+
+
+def chunk_momenta(momenta: list, max_per_job: int) -> List[list]:
+    '''fewest chunks of at most max_per_job momenta, sizes differing by at most one'''
+    if not max_per_job or len(momenta) <= max_per_job:
+        return [list(momenta)]
+    n_chunks = -(-len(momenta) // max_per_job)
+    return [[momenta[i] for i in idx] for idx in np.array_split(np.arange(len(momenta)), n_chunks)]
+
+
+def meson_momenta(dataMap: dict, obj: str) -> List[str]:
+    '''momenta of a meson run object: the yaml mom2 range for meson, the moving frames for meson2'''
+    from yml_to_xml import meson_xml
+    if obj == 'meson2':
+        return meson_xml._gen_mom_list2()
+    return meson_xml._gen_mom_list(dataMap.get('mom2_min', 0), dataMap.get('mom2_max', 3),
+                                   dataMap.get('meson_mom_reduction', 'none'))
+
+
+def meson_chunks(dataMap: dict, obj: str) -> List[list]:
+    return chunk_momenta(meson_momenta(dataMap, obj), dataMap.get('max_moms_per_job'))
+
@@ -0,0 +1,53 @@
+'''jobs the perambulators of one configuration and flavor are split into
+
+PROP_AND_MATELEM_DISTILLATION_SUPERB solves for every source time slice in
+range(0, prop_t_fwd, num_tsrc) in one run, which makes peram jobs the longest of
+a campaign and the hardest to backfill. The source time slices can be split into
+shards, each a job of its own writing peram_<nvec>_cfg<cfg>_t<k>.sdb from the
+same eigs file:
+
+- prop_t_source_shards: number of shards, or
+- prop_max_minutes: walltime budget of one job; prop_chroma_minutes, the time of
+  all source time slices of a configuration, is split into as few shards as fit.
+
+Every source costs the same solves, so shards hold consecutive sources in
+near-equal numbers and get prop_chroma_minutes in proportion. prop_chroma_minutes
+is the time of one flavor; a job solving several flavors gets it once per flavor,
+while the shards stay those of a single flavor so that the output files do not
+depend on how flavors are grouped into jobs.
+scripts/merge_peram_shards.py checks and combines the shards.
+'''
+import math
+from typing import List
+
+import numpy as np
+
+
+def t_sources(dataMap: dict) -> List[int]:
+    return list(range(0, dataMap.get('prop_t_fwd', dataMap['NT']), dataMap['num_tsrc']))
+
+
+def num_shards(dataMap: dict, n_sources: int) -> int:
+    shards = dataMap.get('prop_t_source_shards')
+    if not shards and dataMap.get('prop_max_minutes'):
+        # the largest shard holds ceil(n_sources / shards) sources and must fit the budget
+        per_shard = max(1, math.floor(n_sources * dataMap['prop_max_minutes'] / dataMap['prop_chroma_minutes']))
+        shards = math.ceil(n_sources / per_shard)
+    return max(1, min(shards or 1, n_sources))
+
+
+def peram_shards(dataMap: dict, n_flavors: int = 1) -> List[dict]:
+    '''render variables of every shard of a job solving n_flavors flavors: suffix, source time slices and walltime'''
+    sources = t_sources(dataMap)
+    minutes = dataMap['prop_chroma_minutes'] * n_flavors
+    groups = np.array_split(np.array(sources), num_shards(dataMap, len(sources)))
+    shards = []
+    for k, group in enumerate(groups):
+        shards.append({'part_suffix': f'_t{k}' if len(groups) > 1 else '',
+                       'prop_t_source_list': ' '.join(str(int(t)) for t in group),
+                       'prop_shard_minutes': max(1, math.ceil(minutes * len(group) / len(sources)))})
+    return shards
+
+
+def shard_suffixes(dataMap: dict) -> List[str]:
+    return [shard['part_suffix'] for shard in peram_shards(dataMap)]
@@ -1,5 +1,6 @@
 import os 
 from pydantic import BaseModel
+from typing import Optional
 import numpy as np
 
 class Perams(BaseModel):
@@ -26,20 +27,17 @@ class Perams(BaseModel):
     num_tries: int 
     max_rhs: int 
     phase: list 
-    prop_t_sources: str
     prop_t_fwd: int
     prop_t_back: int
     prop_nvec: int
-    prop_zphases: float
-    prop_mass: str
-    prop_clov_coeff: str
-    prop_mass_label: str
-    prop_mass_light_label: str
-    prop_mass_strange_label: str
-    prop_mass_charm_label: str
+    prop_zphases: str
+    prop_clov_coeff: float
+    prop_mass_light_label: float
+    prop_mass_strange_label: Optional[float] = None
+    prop_mass_charm_label: Optional[float] = None
 
-    rho: str
-    precision: str
+    rho: float
+    precision: float
     max_iter: int
 
     #link smearing options 
@@ -51,7 +49,6 @@ class Perams(BaseModel):
     # perams_path: str
     cfg_path: str
     run_path:str
-    oldscratch_path: str
     # colorvec_out : str
 
 def generate_t_source_list(prop_t_fwd: int, num_tsrc: int) -> np.ndarray:
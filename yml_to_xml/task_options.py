@@ -0,0 +1,97 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+
+class ChromaOptions(BaseModel):
+    """Chroma run options every job needs."""
+    # Slurm job options
+    code_dir: str
+    account: str
+    facility: str
+    partition: str
+    # Ensemble properties
+    cfg_i: int
+    cfg_f: int
+    cfg_d: int  # cfg step size
+    # precision of the sdb outputs, for their expected size in scripts/verify_outputs.py
+    output_precision: Literal['double', 'single'] = 'double'
+
+
+class EigsOptions(ChromaOptions):
+    """Options of the distillation basis jobs."""
+    num_iter: int
+    num_orthog: int
+    eigs_tasks_node: int
+    eigs_slurm_nodes: int
+    eigs_chroma_geometry: List[int]
+    eigs_chroma_minutes: int
+    # Distillation basis
+    Frequency: int
+    max_nvec: int
+    num_vecs: int
+    decay_dir: int
+    t_start: int
+    phase: List[float]
+    write_fingerprint: bool
+    LinkSmearingType: str
+    link_smear_fact: float
+    link_smear_num: int
+    no_smear_dir: int
+    gauge_id: str
+    colorvec_out: str
+
+
+class PeramOptions(ChromaOptions):
+    """Options of the perambulator jobs."""
+    num_gpu: int
+    eigs_path: str
+    prop_slurm_nodes: int
+    prop_num_gpu: int
+    prop_chroma_geometry: List[int]
+    prop_chroma_minutes: int
+    prop_mass_charm_label: Optional[float] = None
+    prop_t_back: int
+    prop_nvec: int
+    prop_zphases: str
+    prop_clov_coeff: float
+    rho: float
+    precision: float
+    max_iter: int
+    num_vecs: int
+    num_vecs_perams: int
+    Nt_backward: int
+    num_tries: int
+    max_rhs: int
+
+
+class MesonOptions(ChromaOptions):
+    """Options of the meson (and meson2) jobs."""
+    num_gpu: int
+    max_moms_per_job: int
+    eigs_path: str
+    meson_slurm_nodes: int
+    meson_chroma_max_tslices_in_contraction: int
+    meson_nvec: int
+    meson_chroma_geometry: List[int]
+    meson_chroma_minutes: int
+    meson_chroma_parts: int
+    meson_zphases: str
+    meson_t_back: int
+    num_vecs: int
+
+
+class DiscoOptions(ChromaOptions):
+    """Options of the disco array jobs."""
+    disco_slurm_nodes: int
+    disco_num_gpu: int
+    disco_chroma_geometry: List[int]
+    disco_chroma_minutes: int
+    disco_max_colors: int
+    disco_max_colors_at_once: int
+    disco_t_sources_per_job: Optional[int] = None
+    superbblas_threads: int
+    omp_threads: int
+
+
+class FusedOptions(EigsOptions, PeramOptions, MesonOptions):
+    """Options of the fused jobs, which run the eigs, peram and meson steps of a cfg in one allocation."""
@@ -0,0 +1,80 @@
+'''pre-flight checks of an ensemble before any of its inputs are rendered
+
+A key missing from the yaml otherwise only shows up as a StrictUndefined error
+part way through the configurations, and an inconsistent one as a chroma crash
+after the job waited in the queue. create_tasks_ens.py checks every ensemble
+once, before writing anything:
+
+- the yaml, with the parameters derived from the short tag, against the pydantic
+  model of every run object it renders (TaskHandler.xml_classes), and
+- the constraints between fields that the models cannot express: eigenvector
+  counts within max_nvec, source time slices and process grids that divide the
+  lattice, quark masses of the flavors solved for.
+'''
+import math
+from typing import List
+
+from pydantic import ValidationError
+
+from yml_to_xml import geometry
+
+# run object -> yaml prefix of its process grid
+GEOMETRY_PREFIX = {'eigs': 'eigs', 'peram': 'prop', 'meson': 'meson', 'meson2': 'meson', 'disco': 'disco', 'fused': 'prop'}
+
+
+def model_errors(dataMap: dict, run_objects: List[str], models: dict) -> List[str]:
+    '''messages of the fields every distinct model of the run objects rejects'''
+    errors = []
+    for model in dict.fromkeys(models[obj] for obj in run_objects if obj in models):
+        try:
+            model.model_validate(dataMap)
+        except ValidationError as e:
+            for error in e.errors():
+                field = '.'.join(str(loc) for loc in error['loc'])
+                got = '' if error['type'] == 'missing' else f" (got {error['input']!r})"
+                errors.append(f"{model.__name__}: {field}: {error['msg']}{got}")
+    return errors
+
+
+def _at_most(dataMap: dict, key: str, limit_key: str) -> List[str]:
+    if dataMap.get(key) is not None and dataMap.get(limit_key) is not None and dataMap[key] > dataMap[limit_key]:
+        return [f"{key} {dataMap[key]} exceeds {limit_key} {dataMap[limit_key]}"]
+    return []
+
+
+def constraint_errors(dataMap: dict, run_objects: List[str]) -> List[str]:
+    '''messages of the cross-field constraints the run objects break'''
+    objects = set(run_objects)
+    errors = []
+    if dataMap.get('cfg_d', 0) <= 0 or not range(dataMap['cfg_i'], dataMap['cfg_f'], dataMap['cfg_d']):
+        errors.append(f"cfg_i {dataMap['cfg_i']}, cfg_f {dataMap['cfg_f']}, cfg_d {dataMap.get('cfg_d')} give no configuration")
+    if objects & {'eigs', 'fused'}:
+        errors += _at_most(dataMap, 'num_vecs', 'max_nvec')
+    if objects & {'peram', 'fused'}:
+        errors += _at_most(dataMap, 'num_vecs_perams', 'max_nvec')
+        if dataMap['num_tsrc'] <= 0:
+            errors.append(f"num_tsrc {dataMap['num_tsrc']} is not a positive source spacing")
+        elif dataMap['prop_t_fwd'] % dataMap['num_tsrc']:
+            errors.append(f"num_tsrc {dataMap['num_tsrc']} does not divide prop_t_fwd {dataMap['prop_t_fwd']}")
+        for job in dataMap.get('peram_jobs', []):
+            for peram in job['peram_flavors']:
+                if peram['quark_mass'] is None:
+                    errors.append(f"{job['peram_task']} needs prop_mass_{peram['flavor']}_label")
+    if objects & {'meson', 'meson2', 'fused'}:
+        errors += _at_most(dataMap, 'meson_nvec', 'max_nvec')
+        errors += _at_most(dataMap, 'mom2_min', 'mom2_max')
+    if 'meson2' in objects and 'mc' not in dataMap:
+        errors.append(f"meson2 reads the configurations of the 3+1 flavor ensembles, {dataMap['ens_short']} has no mc")
+    dims = geometry.lattice(dataMap)
+    for prefix in dict.fromkeys(GEOMETRY_PREFIX[obj] for obj in objects if obj in GEOMETRY_PREFIX):
+        grid = dataMap.get(f'{prefix}_chroma_geometry')
+        n_ranks = geometry.ranks(dataMap, prefix)
+        if not isinstance(grid, list) or math.prod(grid) != n_ranks or not geometry.is_valid(dims, grid):
+            errors.append(f"{prefix}_chroma_geometry {grid} does not split the {'x'.join(map(str, dims))} lattice "
+                          f"into {n_ranks} even local lattices")
+    return errors
+
+
+def validate(dataMap: dict, run_objects: List[str], models: dict) -> List[str]:
+    '''every problem found, empty if the ensemble can be rendered; the constraints are only checked on valid fields'''
+    return model_errors(dataMap, run_objects, models) or constraint_errors(dataMap, run_objects)